@@ -12,11 +12,7 @@ from rssant_api.models.worker_task import (
     WorkerTaskPriority,
 )
 from rssant_common.service_client import SERVICE_CLIENT
-from rssant_feedlib.fulltext import (
-    FulltextAcceptStrategy,
-    StoryContentInfo,
-    split_sentences,
-)
+from rssant_feedlib.fulltext import FulltextAcceptStrategy
 from rssant_feedlib.response import FeedResponseStatus
 
 LOG = logging.getLogger(__name__)
@@ -48,8 +44,7 @@ class RssantApiService:
         feed = Feed.get_by_pk(feed_id, detail='+use_proxy')
         story = STORY_SERVICE.get_by_offset(feed_id, offset, detail=True)
         assert story, f'story#{feed_id},{offset} not found'
-        story_content_info = StoryContentInfo(story.content)
-        num_sub_sentences = len(split_sentences(story_content_info.text))
+        num_sub_sentences = story.get_content_info().sentence_count
         ret = dict(
             feed_id=feed_id,
             offset=offset,
@@ -49,6 +49,76 @@ def forward_url(url):
     return result
 
 
+def _is_default_port(url_obj: yarl.URL):
+    scheme_port = (url_obj.scheme, url_obj.port)
+    return scheme_port in (('http', 80), ('https', 443))
+
+
+def duplicate_feed_key(url):
+    """
+    key to find duplicate feeds, scheme and default port stripped,
+    empty string if the url not has default port
+
+    >>> duplicate_feed_key('http://rss.anyant.com/changelog.atom?v=1')
+    'com.anyant.rss!/changelog.atom?v=1'
+    >>> duplicate_feed_key('https://rss.anyant.com/changelog.atom?v=1')
+    'com.anyant.rss!/changelog.atom?v=1'
+    >>> duplicate_feed_key('https://rss.anyant.com:8443/changelog.atom')
+    ''
+    """
+    url_obj = yarl.URL(url)
+    if not url_obj.host or not _is_default_port(url_obj):
+        return ''
+    host = '.'.join(reversed(url_obj.host.split('.')))
+    return f'{host}!{url_obj.path_qs}'
+
+
+def _group_duplicate_feeds(items) -> list:
+    """
+    items: (feed_id, url_obj) of feeds which have same key
+    Returns: (primary_feed_id, duplicate_feed_id ...) or None
+    """
+    if len(items) < 2:
+        return None
+    primary = None
+    duplicates = []
+    for feed_id, url_obj in sorted(set(items), key=lambda x: x[0]):
+        if primary is None and url_obj.scheme == 'https':
+            primary = feed_id
+        else:
+            duplicates.append(feed_id)
+    # use oldest feed as primary
+    if primary is None:
+        primary = duplicates.pop(0)
+    return (primary, *duplicates)
+
+
+def group_duplicate_feeds(feeds) -> list:
+    """
+    Group feeds by duplicate_feed_key, prefer oldest https feed as primary.
+
+    >>> group_duplicate_feeds([
+    ...     (11, 'http://blog.guyskk.com/feed.xml'),
+    ...     (12, 'https://blog.guyskk.com/feed.xml'),
+    ...     (13, 'http://blog.guyskk.com/feed.xml'),
+    ...     (21, 'https://blog.guyskk.com:8443/feed.xml'),
+    ...     (31, 'https://blog.guyskk.com/atom.xml'),
+    ... ])
+    [(12, 11, 13)]
+    """
+    groups = defaultdict(list)
+    for feed_id, url in feeds:
+        key = duplicate_feed_key(url)
+        if key:
+            groups[key].append((feed_id, yarl.URL(url)))
+    results = []
+    for items in groups.values():
+        group = _group_duplicate_feeds(items)
+        if group:
+            results.append(group)
+    return results
+
+
 class DuplicateFeedDetector:
     """
     A stream detector to find duplicate feeds,
@@ -83,32 +153,18 @@ class DuplicateFeedDetector:
         self._last_host = None
 
     def _is_ignore(self, url_obj: yarl.URL):
-        scheme_port = (url_obj.scheme, url_obj.port)
-        return scheme_port not in (('http', 80), ('https', 443))
-
-    def _is_primary(self, url_obj: yarl.URL):
-        scheme_port = (url_obj.scheme, url_obj.port)
-        return scheme_port == ('https', 443)
+        return not _is_default_port(url_obj)
 
     def _flush(self):
         cache = defaultdict(list)
         for feed_id, rev_url, url_obj in self._buffer:
             key = url_obj.path_qs
-            cache[key].append((feed_id, rev_url, url_obj))
+            cache[key].append((feed_id, url_obj))
         results = []
         for _, values in cache.items():
-            if len(values) >= 2:
-                primary = None
-                duplicates = []
-                for feed_id, rev_url, url_obj in sorted(set(values)):
-                    if primary is None and self._is_primary(url_obj):
-                        primary = feed_id
-                    else:
-                        duplicates.append(feed_id)
-                # use oldest feed as primary
-                if primary is None:
-                    primary = duplicates.pop(0)
-                results.append((primary, *duplicates))
+            group = _group_duplicate_feeds(values)
+            if group:
+                results.append(group)
         self._results.extend(results)
         self._buffer.clear()
         self._last_host = None
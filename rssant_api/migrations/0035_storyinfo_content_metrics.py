@@ -0,0 +1,33 @@
+# Generated by Django 2.2.28 on 2026-10-19 10:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rssant_api', '0034_auto_20240821_0736'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storyinfo',
+            name='image_count',
+            field=models.IntegerField(blank=True, help_text='image count of content', null=True),
+        ),
+        migrations.AddField(
+            model_name='storyinfo',
+            name='link_count',
+            field=models.IntegerField(blank=True, help_text='link count of content', null=True),
+        ),
+        migrations.AddField(
+            model_name='storyinfo',
+            name='text_length',
+            field=models.IntegerField(blank=True, help_text='length of content text', null=True),
+        ),
+        migrations.AddField(
+            model_name='storyinfo',
+            name='url_count',
+            field=models.IntegerField(blank=True, help_text='url count of content', null=True),
+        ),
+    ]
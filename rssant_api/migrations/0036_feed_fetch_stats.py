@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-19 11:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rssant_api', '0035_storyinfo_content_metrics'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='feed',
+            name='fetch_interval_factor',
+            field=models.IntegerField(blank=True, default=1, help_text='check interval factor learned by fetch stats', null=True),
+        ),
+        migrations.AddField(
+            model_name='feed',
+            name='fetch_stats_data',
+            field=models.BinaryField(blank=True, help_text='learned conditional request behavior, see FeedFetchStats', max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 2.2.28 on 2026-10-19 11:12
+
+from django.conf import settings
+from django.db import migrations, models
+import django.utils.timezone
+
+# same as Feed.compute_dt_next_check, pending feeds are retried after 3x interval
+BACKFILL_DT_NEXT_CHECK_SQL = """
+UPDATE rssant_api_feed AS feed
+SET dt_next_check = CASE
+    WHEN feed.dt_checked IS NULL THEN NOW()
+    WHEN feed.status IN ('ready', 'error') THEN feed.dt_checked
+        + %s * (1 + random() / 10)
+        * GREATEST(COALESCE(feed.freeze_level, 1), 1)
+        * GREATEST(COALESCE(feed.fetch_interval_factor, 1), 1)
+        * '1s'::interval
+    ELSE feed.dt_checked
+        + 3 * %s * GREATEST(COALESCE(feed.freeze_level, 1), 1) * '1s'::interval
+END
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rssant_api', '0036_feed_fetch_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='feed',
+            name='dt_next_check',
+            field=models.DateTimeField(blank=True, default=django.utils.timezone.now, help_text='下次检查时间, maintained on check and freeze level changes', null=True),
+        ),
+        migrations.RunSQL(
+            [(BACKFILL_DT_NEXT_CHECK_SQL, [settings.RSSANT_CHECK_FEED_SECONDS] * 2)],
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name='feed',
+            index=models.Index(condition=models.Q(_negated=True, status='discard'), fields=['dt_next_check'], name='rssant_api_feed_next_check'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-19 11:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rssant_api', '0037_feed_dt_next_check'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='feed',
+            name='publish_stats_data',
+            field=models.BinaryField(blank=True, help_text='story publish history, see PublishStats', max_length=64, null=True),
+        ),
+    ]
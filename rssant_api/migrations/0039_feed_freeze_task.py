@@ -0,0 +1,27 @@
+# Generated by Django 2.2.28 on 2026-10-19 11:26
+
+from django.db import migrations, models
+import ool
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rssant_api', '0038_feed_publish_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedFreezeTask',
+            fields=[
+                ('_version', ool.VersionField(default=0)),
+                ('_created', models.DateTimeField(auto_now_add=True, help_text='创建时间')),
+                ('_updated', models.DateTimeField(auto_now=True, help_text='更新时间')),
+                ('id', models.PositiveIntegerField(help_text='feed id', primary_key=True, serialize=False)),
+            ],
+            options={
+                'abstract': False,
+            },
+            bases=(ool.VersionedMixin, models.Model),
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 2.2.28 on 2026-10-19 11:29
+
+from django.db import migrations, models
+import ool
+
+# same as UserActivity.rebuild on empty tables
+BACKFILL_USER_ACTIVITY_SQL = """
+INSERT INTO rssant_api_useractivity
+    (id, dt_last_active, is_active, feed_count, _version, _created, _updated)
+SELECT user_id, MAX(dt_updated),
+    COALESCE(MAX(dt_updated) >= NOW() - INTERVAL '90 days', FALSE),
+    COUNT(1), 1, NOW(), NOW()
+FROM rssant_api_userfeed GROUP BY user_id
+"""
+
+BACKFILL_FEED_SUBSCRIBER_STAT_SQL = """
+INSERT INTO rssant_api_feedsubscriberstat
+    (id, user_count, active_user_count, _version, _created, _updated)
+SELECT feed_id, COUNT(1), SUM(CASE WHEN ua.is_active THEN 1 ELSE 0 END), 1, NOW(), NOW()
+FROM rssant_api_userfeed AS userfeed
+LEFT OUTER JOIN rssant_api_useractivity AS ua ON ua.id = userfeed.user_id
+GROUP BY feed_id
+"""
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rssant_api', '0039_feed_freeze_task'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedSubscriberStat',
+            fields=[
+                ('_version', ool.VersionField(default=0)),
+                ('_created', models.DateTimeField(auto_now_add=True, help_text='创建时间')),
+                ('_updated', models.DateTimeField(auto_now=True, help_text='更新时间')),
+                ('id', models.PositiveIntegerField(help_text='feed id', primary_key=True, serialize=False)),
+                ('user_count', models.IntegerField(default=0, help_text='number of subscribers')),
+                ('active_user_count', models.IntegerField(default=0, help_text='number of active subscribers')),
+            ],
+            options={
+                'abstract': False,
+            },
+            bases=(ool.VersionedMixin, models.Model),
+        ),
+        migrations.CreateModel(
+            name='UserActivity',
+            fields=[
+                ('_version', ool.VersionField(default=0)),
+                ('_created', models.DateTimeField(auto_now_add=True, help_text='创建时间')),
+                ('_updated', models.DateTimeField(auto_now=True, help_text='更新时间')),
+                ('id', models.PositiveIntegerField(help_text='user id', primary_key=True, serialize=False)),
+                ('dt_last_active', models.DateTimeField(blank=True, help_text='last read or edit time', null=True)),
+                ('is_active', models.BooleanField(default=False, help_text='active in USER_ACTIVE_DAYS')),
+                ('feed_count', models.IntegerField(default=0, help_text='number of subscribed feeds')),
+            ],
+            bases=(ool.VersionedMixin, models.Model),
+        ),
+        migrations.AddIndex(
+            model_name='useractivity',
+            index=models.Index(condition=models.Q(is_active=True), fields=['dt_last_active'], name='rssant_api_user_active'),
+        ),
+        migrations.RunSQL(
+            [BACKFILL_USER_ACTIVITY_SQL, BACKFILL_FEED_SUBSCRIBER_STAT_SQL],
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
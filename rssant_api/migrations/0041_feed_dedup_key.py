@@ -0,0 +1,26 @@
+# Generated by Django 2.2.28 on 2026-10-19 11:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rssant_api', '0040_user_activity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='feed',
+            name='dedup_key',
+            field=models.TextField(blank=True, help_text='duplicate feed key, NULL means not checked, see duplicate_feed_key', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='feed',
+            index=models.Index(fields=['dedup_key'], name='rssant_api__dedup_k_4cf581_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='feed',
+            index=models.Index(condition=models.Q(dedup_key__isnull=True), fields=['id'], name='rssant_api_feed_dedup_pending'),
+        ),
+    ]
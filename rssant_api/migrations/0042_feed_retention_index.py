@@ -0,0 +1,21 @@
+# Generated by Django 2.2.28 on 2026-10-19 11:36
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rssant_api', '0041_feed_dedup_key'),
+    ]
+
+    operations = [
+        # expression index for Feed.take_retention_feeds
+        migrations.RunSQL(
+            """
+            CREATE INDEX IF NOT EXISTS rssant_api_feed_retention
+            ON rssant_api_feed ((total_storys - retention_offset))
+            """,
+            reverse_sql="DROP INDEX IF EXISTS rssant_api_feed_retention",
+        ),
+    ]
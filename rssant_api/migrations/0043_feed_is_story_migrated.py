@@ -0,0 +1,24 @@
+# Generated by Django 2.2.28 on 2026-10-19 11:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rssant_api', '0042_feed_retention_index'),
+    ]
+
+    operations = [
+        # existing feeds may have legacy storys, new feeds not
+        migrations.AddField(
+            model_name='feed',
+            name='is_story_migrated',
+            field=models.BooleanField(blank=True, default=False, help_text='legacy storys all migrated to StoryInfo', null=True),
+        ),
+        migrations.AlterField(
+            model_name='feed',
+            name='is_story_migrated',
+            field=models.BooleanField(blank=True, default=True, help_text='legacy storys all migrated to StoryInfo', null=True),
+        ),
+    ]
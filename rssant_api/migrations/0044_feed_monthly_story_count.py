@@ -0,0 +1,47 @@
+# Generated by Django 2.2.28 on 2026-10-19 11:52
+
+from django.db import migrations, models
+import ool
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rssant_api', '0043_feed_is_story_migrated'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedMonthlyStoryCount',
+            fields=[
+                ('_version', ool.VersionField(default=0)),
+                ('_created', models.DateTimeField(auto_now_add=True, help_text='创建时间')),
+                ('_updated', models.DateTimeField(auto_now=True, help_text='更新时间')),
+                ('id', models.BigIntegerField(help_text='feed_id and month_id', primary_key=True, serialize=False)),
+                ('count', models.IntegerField(default=0, help_text='number of storys published in the month')),
+            ],
+            options={
+                'abstract': False,
+            },
+            bases=(ool.VersionedMixin, models.Model),
+        ),
+        # decode Feed.monthly_story_count_data, see MonthlyStoryCount.dump
+        migrations.RunSQL(
+            sql="""
+            INSERT INTO rssant_api_feedmonthlystorycount
+                (id, count, _version, _created, _updated)
+            SELECT
+                (feed.id::bigint << 20)
+                    + get_byte(feed.monthly_story_count_data, 0) * 256
+                    + get_byte(feed.monthly_story_count_data, 1)
+                    + get_byte(feed.monthly_story_count_data, 2 + 2 * i),
+                get_byte(feed.monthly_story_count_data, 3 + 2 * i),
+                1, NOW(), NOW()
+            FROM rssant_api_feed AS feed,
+                generate_series(0, length(feed.monthly_story_count_data) / 2 - 2) AS i
+            WHERE length(feed.monthly_story_count_data) >= 4
+            ON CONFLICT (id) DO NOTHING
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
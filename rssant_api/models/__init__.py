@@ -1,6 +1,7 @@
 from .feed import Feed, FeedStatus, RawFeed, UserFeed
 from .feed_creation import FeedCreation, FeedUrlMap
-from .feed_story_stat import FeedStoryStat
+from .feed_freeze_task import FeedFreezeTask
+from .feed_story_stat import FeedMonthlyStoryCount, FeedStoryStat
 from .image import ImageInfo
 from .registery import Registery
 from .story import Story, UserStory
@@ -8,6 +9,7 @@ from .story_info import StoryId, StoryInfo
 from .story_service import STORY_SERVICE, CommonStory
 from .union_feed import FeedImportItem, FeedUnionId, UnionFeed
 from .union_story import StoryUnionId, UnionStory
+from .user_activity import FeedSubscriberStat, UserActivity
 from .user_publish import UserPublish
 from .worker_task import WorkerTask
 
@@ -21,8 +23,12 @@ __models__ = (
     UserStory,
     FeedUrlMap,
     FeedStoryStat,
+    FeedMonthlyStoryCount,
+    FeedFreezeTask,
     Registery,
     ImageInfo,
     UserPublish,
+    UserActivity,
+    FeedSubscriberStat,
     WorkerTask,
 )
@@ -1,12 +1,16 @@
 import gzip
+import random
 
 from django.db import connection
+from django.db.models import Q
 from django.utils import timezone
 from validr import T
 
-from rssant_api.helper import DuplicateFeedDetector
+from rssant_api.helper import duplicate_feed_key, group_duplicate_feeds
 from rssant_api.monthly_story_count import MonthlyStoryCount
+from rssant_api.publish_stats import PublishStats
 from rssant_common.detail import Detail
+from rssant_config import CONFIG
 
 from .helper import (
     ContentHashMixin,
@@ -78,6 +82,24 @@ FeedDetailSchema = (
 FEED_DETAIL_FIELDS = Detail.from_schema(False, FeedDetailSchema).exclude_fields
 USER_FEED_DETAIL_FIELDS = [f'feed__{x}' for x in FEED_DETAIL_FIELDS]
 
+# check interval of feeds, multiplied by freeze_level and fetch_interval_factor
+CHECK_FEED_SECONDS = CONFIG.check_feed_minutes * 60
+# feeds frozen at or above this level ignore publish stats, eg: no active users
+PREDICT_MAX_FREEZE_LEVEL = 24
+
+
+def _sql_next_check(freeze_level: str = 'feed.freeze_level', check_seconds: str = '%s') -> str:
+    """
+    SQL expression of Feed.compute_dt_next_check without publish stats, the
+    feed table should be aliased as feed, takes one param: check seconds.
+    """
+    return f"""(
+        COALESCE(feed.dt_checked, NOW()) + {check_seconds} * (1 + random() / 10)
+        * GREATEST(COALESCE({freeze_level}, 1), 1)
+        * GREATEST(COALESCE(feed.fetch_interval_factor, 1), 1)
+        * '1s'::interval
+    )"""
+
 
 class Feed(Model, ContentHashMixin):
     """订阅的最新数据"""
@@ -86,6 +108,17 @@ class Feed(Model, ContentHashMixin):
         indexes = [
             models.Index(fields=["url"]),
             models.Index(fields=["reverse_url"]),
+            models.Index(
+                name="rssant_api_feed_next_check",
+                fields=["dt_next_check"],
+                condition=~Q(status=FeedStatus.DISCARD),
+            ),
+            models.Index(fields=["dedup_key"]),
+            models.Index(
+                name="rssant_api_feed_dedup_pending",
+                fields=["id"],
+                condition=Q(dedup_key__isnull=True),
+            ),
         ]
 
     class Admin:
@@ -95,6 +128,9 @@ class Feed(Model, ContentHashMixin):
     url = models.TextField(unique=True, help_text="供稿地址")
     # TODO: make reverse_url unique and not null
     reverse_url = models.TextField(**optional, help_text="倒转URL")
+    dedup_key = models.TextField(
+        **optional, help_text="duplicate feed key, NULL means not checked, see duplicate_feed_key"
+    )
     status = models.CharField(
         max_length=20,
         choices=FEED_STATUS_CHOICES,
@@ -115,6 +151,10 @@ class Feed(Model, ContentHashMixin):
     dt_created = models.DateTimeField(auto_now_add=True, help_text="创建时间")
     dt_checked = models.DateTimeField(**optional, help_text="最近一次检查同步时间")
     dt_synced = models.DateTimeField(**optional, help_text="最近一次同步时间")
+    dt_next_check = models.DateTimeField(
+        **optional, default=timezone.now,
+        help_text="下次检查时间, maintained on check and freeze level changes",
+    )
     encoding = models.CharField(max_length=200, **optional, help_text="编码")
     etag = models.CharField(
         max_length=200, **optional, help_text="HTTP response header ETag"
@@ -159,6 +199,18 @@ class Feed(Model, ContentHashMixin):
     checksum_data = models.BinaryField(
         **optional, max_length=4096, help_text="feed checksum data"
     )
+    fetch_stats_data = models.BinaryField(
+        **optional, max_length=64, help_text="learned conditional request behavior, see FeedFetchStats"
+    )
+    fetch_interval_factor = models.IntegerField(
+        **optional, default=1, help_text="check interval factor learned by fetch stats"
+    )
+    publish_stats_data = models.BinaryField(
+        **optional, max_length=64, help_text="story publish history, see PublishStats"
+    )
+    is_story_migrated = models.BooleanField(
+        **optional, default=True, help_text="legacy storys all migrated to StoryInfo"
+    )
     warnings = models.TextField(
         **optional, help_text="warning messages when processing the feed"
     )
@@ -178,10 +230,10 @@ class Feed(Model, ContentHashMixin):
         **optional, help_text="最新的story发布时间"
     )
 
-    def merge(self, other: "Feed"):
+    def merge(self, other: "Feed") -> list:
         """
         Merge other feed to self by change other's userfeeds' feed_id to self id.
-        User stotys are ignored / not handled.
+        User stotys are ignored / not handled. Return user ids of moved userfeeds.
         """
         user_feeds = (
             UserFeed.objects.only('id', 'user_id', 'feed_id', 'story_offset')
@@ -207,6 +259,7 @@ class Feed(Model, ContentHashMixin):
         # TODO: correct implement DISCARD logic, feed creation and feedurlmap
         # other.status = FeedStatus.DISCARD
         other.save()
+        return [x.user_id for x in updates]
 
     @property
     def monthly_story_count(self):
@@ -221,6 +274,14 @@ class Feed(Model, ContentHashMixin):
             self.monthly_story_count_data = value.dump()
             self.dryness = value.dryness()
 
+    @property
+    def publish_stats(self):
+        return PublishStats.load(self.publish_stats_data)
+
+    @publish_stats.setter
+    def publish_stats(self, value: PublishStats):
+        self.publish_stats_data = value.dump() if value is not None else None
+
     @staticmethod
     def get_by_pk(feed_id, detail=True) -> 'Feed':
         detail = Detail.from_schema(detail, FeedDetailSchema)
@@ -233,69 +294,67 @@ class Feed(Model, ContentHashMixin):
         q = Feed.objects.seal().defer(*detail.exclude_fields)
         return q.filter(url=url).first()
 
+    def compute_dt_next_check(self, check_seconds: int = None):
+        """
+        Next check time of READY or ERROR feed, with 10% random jitter.
+        Predict by publish stats if has enough history, else by freeze_level.
+        """
+        if check_seconds is None:
+            check_seconds = CHECK_FEED_SECONDS
+        dt_checked = self.dt_checked or timezone.now()
+        freeze_level = max(1, self.freeze_level or 1)
+        seconds = None
+        if freeze_level < PREDICT_MAX_FREEZE_LEVEL:
+            seconds = self.publish_stats.predict_check_seconds(dt_checked, check_seconds)
+        if seconds is None:
+            seconds = check_seconds * freeze_level
+        fetch_interval_factor = max(1, self.fetch_interval_factor or 1)
+        seconds = seconds * (1 + random.random() / 10) * fetch_interval_factor
+        return dt_checked + timezone.timedelta(seconds=seconds)
+
     @staticmethod
-    def take_outdated(outdate_seconds=300, timeout_seconds=None, limit=300):
+    def take_outdated(timeout_seconds=None, limit=300):
         feeds = Feed.take_outdated_feeds(
-            outdate_seconds=outdate_seconds,
             timeout_seconds=timeout_seconds,
             limit=limit,
         )
         return [x['feed_id'] for x in feeds]
 
     @staticmethod
-    def take_outdated_feeds(
-        outdate_seconds=300, timeout_seconds=None, limit=300
-    ):
+    def take_outdated_feeds(timeout_seconds=None, limit=300):
         """
-        outdate_seconds: 正常检查时间间隔
-        timeout_seconds: 异常检查时间间隔
+        Take feeds which dt_next_check is due and mark them PENDING.
+        timeout_seconds: 异常检查时间间隔, retry if the feed not updated after taken
         """
         if not timeout_seconds:
-            timeout_seconds = 3 * outdate_seconds
-        statuses = [FeedStatus.READY, FeedStatus.ERROR]
-        # 单个SQL实现查询并更新，再加上 _version 字段乐观锁，可避免并发情况下重复读
+            timeout_seconds = 3 * CHECK_FEED_SECONDS
+        # served by partial index on dt_next_check, SKIP LOCKED let concurrent
+        # schedulers take different feeds instead of waiting for each other
         sql_check_update = f"""
         WITH t AS (
-            SELECT id, _version
+            SELECT id
             FROM rssant_api_feed AS feed
-            WHERE
-                (status != '{FeedStatus.DISCARD}') AND (
-                (
-                    dt_checked IS NULL
-                )
-                OR
-                (
-                    (freeze_level IS NULL OR freeze_level < 1) AND (
-                        (status=ANY(%s) AND NOW() - dt_checked > %s * '1s'::interval)
-                        OR
-                        (NOW() - dt_checked > %s * '1s'::interval)
-                    )
-                )
-                OR
-                (
-                    (status=ANY(%s) AND NOW() - dt_checked > %s * freeze_level * '1s'::interval)
-                    OR
-                    (NOW() - dt_checked > %s * freeze_level * '1s'::interval)
-                ))
-            ORDER BY id LIMIT %s
+            WHERE status != '{FeedStatus.DISCARD}' AND dt_next_check <= %s
+            ORDER BY dt_next_check LIMIT %s
+            FOR UPDATE SKIP LOCKED
         )
         UPDATE rssant_api_feed AS feed
-        SET status=%s, dt_checked=%s, _version=t._version+1
+        SET status=%s, dt_checked=%s, _version=feed._version+1,
+            dt_next_check=%s + %s * GREATEST(COALESCE(feed.freeze_level, 1), 1) * '1s'::interval
         FROM t
-        WHERE feed.id=t.id AND feed._version=t._version
-        RETURNING feed.id, url, etag, last_modified, use_proxy, checksum_data
+        WHERE feed.id=t.id
+        RETURNING feed.id, url, etag, last_modified, use_proxy, checksum_data,
+            content_hash_base64, fetch_stats_data
         ;
         """
+        now = timezone.now()
         params = [
-            statuses,
-            outdate_seconds,
-            timeout_seconds,
-            statuses,
-            outdate_seconds,
-            timeout_seconds,
+            now,
             limit,
             FeedStatus.PENDING,
-            timezone.now(),
+            now,
+            now,
+            timeout_seconds,
         ]
         feeds = []
         columns = [
@@ -305,6 +364,8 @@ class Feed(Model, ContentHashMixin):
             'last_modified',
             'use_proxy',
             'checksum_data',
+            'content_hash_base64',
+            'fetch_stats_data',
         ]
         with connection.cursor() as cursor:
             cursor.execute(sql_check_update, params)
@@ -313,55 +374,67 @@ class Feed(Model, ContentHashMixin):
         return feeds
 
     @classmethod
-    def _query_feeds_by_reverse_url(cls, begin=None, limit=1000) -> list:
-        if begin:
-            where = 'AND reverse_url >= %s'
-            params = [begin, limit]
-        else:
-            where = ''
-            params = [limit]
-        sql = f"""
-        SELECT id, reverse_url FROM rssant_api_feed
-        WHERE status != '{FeedStatus.DISCARD}' AND
-            reverse_url IS NOT NULL AND reverse_url != '' {where}
-        ORDER BY reverse_url LIMIT %s
-        """
-        with connection.cursor() as cursor:
-            cursor.execute(sql, params)
-            feeds = list(cursor.fetchall())
-        return feeds
-
-    @classmethod
-    def find_duplicate_feeds(cls, checkpoint=None, limit=5000):
+    def find_duplicate_feeds(cls, limit=1000):
         """
-        find duplicate feeds
+        find duplicates of feeds not checked yet, by index of dedup_key
 
-        Returns: (duplicates, checkpoint)
+        Returns: (duplicates, dedup_keys)
             duplicates:
                 (primary_feed_id, duplicate_feed_id ...)
                 (primary_feed_id, duplicate_feed_id ...)
                 ...
+            dedup_keys: {feed_id: dedup_key} of checked feeds,
+                save by save_dedup_keys after duplicates merged
         """
-        detector = DuplicateFeedDetector()
-        feeds = cls._query_feeds_by_reverse_url(begin=checkpoint, limit=limit)
-        rev_url = None
-        for feed_id, rev_url in feeds:
-            detector.push(feed_id, rev_url)
-        if len(feeds) < limit:
-            detector.flush()
-        next_checkpoint = detector.checkpoint
-        # force flush when single host has too many feeds
-        if checkpoint is not None and checkpoint == next_checkpoint:
-            detector.flush()
-            next_checkpoint = rev_url
-        got = detector.poll()
-        return got, next_checkpoint
+        sql_pending = f"""
+        SELECT id, url FROM rssant_api_feed
+        WHERE dedup_key IS NULL AND status != '{FeedStatus.DISCARD}'
+        ORDER BY id LIMIT %s
+        """
+        sql_checked = f"""
+        SELECT id, url FROM rssant_api_feed
+        WHERE dedup_key = ANY(%s) AND status != '{FeedStatus.DISCARD}'
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(sql_pending, [limit])
+            pending = list(cursor.fetchall())
+            dedup_keys = {feed_id: duplicate_feed_key(url) for feed_id, url in pending}
+            keys = list(set(x for x in dedup_keys.values() if x))
+            checked = []
+            if keys:
+                cursor.execute(sql_checked, [keys])
+                checked = list(cursor.fetchall())
+        found = []
+        for primary_id, *duplicates in group_duplicate_feeds(pending + checked):
+            # checked duplicates are merged already, unless primary changed
+            if primary_id not in dedup_keys:
+                duplicates = [x for x in duplicates if x in dedup_keys]
+            if duplicates:
+                found.append((primary_id, *duplicates))
+        return found, dedup_keys
+
+    @staticmethod
+    def save_dedup_keys(dedup_keys: dict):
+        if not dedup_keys:
+            return
+        sql = """
+        UPDATE rssant_api_feed AS feed
+        SET dedup_key = t.dedup_key
+        FROM unnest(%s::integer[], %s::text[]) AS t(id, dedup_key)
+        WHERE feed.id = t.id
+        """
+        feed_ids = list(dedup_keys.keys())
+        keys = [dedup_keys[x] for x in feed_ids]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [feed_ids, keys])
 
     @staticmethod
     def take_retention_feeds(retention=5000, limit=5):
+        # use expression index rssant_api_feed_retention, see migrations
         sql_check = """
         SELECT id, url FROM rssant_api_feed
-        WHERE total_storys - retention_offset > %s
+        WHERE (total_storys - retention_offset) > %s
+        ORDER BY (total_storys - retention_offset) DESC
         LIMIT %s
         """
         params = [retention, limit]
@@ -372,17 +445,83 @@ class Feed(Model, ContentHashMixin):
                 feeds.append(dict(feed_id=feed_id, url=url))
             return feeds
 
+    @staticmethod
+    def bulk_set_retention_offset(retention_offsets: dict):
+        if not retention_offsets:
+            return
+        sql = """
+        UPDATE rssant_api_feed AS feed
+        SET retention_offset = t.retention_offset, _version = feed._version + 1
+        FROM unnest(%s::integer[], %s::integer[]) AS t(id, retention_offset)
+        WHERE feed.id = t.id
+        """
+        feed_ids = list(retention_offsets.keys())
+        offsets = [retention_offsets[x] for x in feed_ids]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [feed_ids, offsets])
+
+    @staticmethod
+    def bulk_set_monthly_story_count(monthly_story_counts: dict):
+        """Update monthly_story_count_data and dryness, see monthly_story_count setter"""
+        if not monthly_story_counts:
+            return
+        sql = """
+        UPDATE rssant_api_feed AS feed
+        SET monthly_story_count_data = t.data, dryness = t.dryness, _version = feed._version + 1
+        FROM unnest(%s::integer[], %s::bytea[], %s::integer[]) AS t(id, data, dryness)
+        WHERE feed.id = t.id
+        """
+        feed_ids = list(sorted(monthly_story_counts.keys()))
+        data_s = []
+        dryness_s = []
+        for feed_id in feed_ids:
+            value = monthly_story_counts[feed_id]
+            data_s.append(value.dump() if value else None)
+            dryness_s.append(value.dryness() if value else None)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [feed_ids, data_s, dryness_s])
+
     def unfreeze(self):
         self.freeze_level = 1
+        dt_next_check = self.compute_dt_next_check()
+        if self.dt_next_check is None or dt_next_check < self.dt_next_check:
+            self.dt_next_check = dt_next_check
         self.save()
 
     @classmethod
     def unfreeze_by_id(cls, feed_id: int):
-        Feed.objects.filter(pk=feed_id).update(freeze_level=1)
+        cls.unfreeze_by_ids([feed_id])
+
+    @staticmethod
+    def unfreeze_by_ids(feed_ids: list, check_seconds: int = None):
+        """Set freeze_level to 1, unfreeze only bring forward dt_next_check"""
+        if not feed_ids:
+            return
+        if check_seconds is None:
+            check_seconds = CHECK_FEED_SECONDS
+        sql = f"""
+        UPDATE rssant_api_feed AS feed
+        SET freeze_level = 1,
+            dt_next_check = LEAST(feed.dt_next_check, {_sql_next_check('1')})
+        WHERE feed.id = ANY(%s) AND (feed.freeze_level IS NULL OR feed.freeze_level != 1)
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [check_seconds, list(feed_ids)])
 
     @staticmethod
-    def refresh_freeze_level():
+    def content_length_freeze_level(content_length: int) -> int:
+        """Content length grade used by refresh_freeze_level"""
+        if not content_length or content_length < 300 * 1024:
+            return 0
+        if content_length < 1500 * 1024:
+            return 1
+        return 2
+
+    @staticmethod
+    def refresh_freeze_level(feed_ids: list = None):
         """
+        Refresh freeze level of given feeds, or all feeds if feed_ids is None.
+        Subscriber counts come from FeedSubscriberStat, see UserActivity.
         活跃用户: 90天内有阅读记录
         冻结策略:
             1. 无人订阅，冻结1个月。有人订阅时解冻。
@@ -404,6 +543,12 @@ class Feed(Model, ContentHashMixin):
         |   月更博客  |    4H    |     8H     |    9H    |
         +------------+----------+------------+----------+
         """
+        where_feed = ''
+        if feed_ids is not None:
+            feed_ids = list(feed_ids)
+            if not feed_ids:
+                return
+            where_feed = 'AND feed.id = ANY(%(feed_ids)s)'
         # https://stackoverflow.com/questions/7869592/how-to-do-an-update-join-in-postgresql
         sql = f"""
         WITH t AS (
@@ -411,7 +556,7 @@ class Feed(Model, ContentHashMixin):
             feed.id AS id,
             CASE
                 WHEN (
-                    feed_stat.feed_id is NULL OR feed_stat.user_count <= 0
+                    feed_stat.id is NULL OR feed_stat.user_count <= 0
                 ) THEN 31 * 24
                 WHEN (
                     (feed.dt_created <= NOW() - INTERVAL '7 days')
@@ -442,31 +587,24 @@ class Feed(Model, ContentHashMixin):
                 ELSE 1
             END AS freeze_level
         FROM rssant_api_feed AS feed
-        LEFT OUTER JOIN (
-            SELECT
-                feed_id,
-                COUNT(1) AS user_count,
-                SUM(user_stat.is_active) AS active_user_count
-            FROM rssant_api_userfeed JOIN (
-                SELECT user_id, CASE WHEN (
-                    MAX(dt_updated) >= NOW() - INTERVAL '90 days'
-                ) THEN 1 ELSE 0 END AS is_active
-                FROM rssant_api_userfeed GROUP BY user_id
-            ) user_stat
-            ON rssant_api_userfeed.user_id = user_stat.user_id
-            GROUP BY feed_id
-        ) AS feed_stat
-        ON feed.id = feed_stat.feed_id
-        WHERE feed.status != '{FeedStatus.DISCARD}'
+        LEFT OUTER JOIN rssant_api_feedsubscriberstat AS feed_stat
+        ON feed.id = feed_stat.id
+        WHERE feed.status != '{FeedStatus.DISCARD}' {where_feed}
         )
         UPDATE rssant_api_feed AS feed
-        SET freeze_level = t.freeze_level
+        SET freeze_level = t.freeze_level,
+            dt_next_check = CASE
+                WHEN feed.status IN ('{FeedStatus.READY}', '{FeedStatus.ERROR}')
+                THEN {_sql_next_check('t.freeze_level', '%(check_seconds)s')}
+                ELSE feed.dt_next_check
+            END
         FROM t
         WHERE feed.id = t.id AND feed.freeze_level != t.freeze_level
         ;
         """
+        params = dict(check_seconds=CHECK_FEED_SECONDS, feed_ids=feed_ids)
         with connection.cursor() as cursor:
-            cursor.execute(sql)
+            cursor.execute(sql, params)
 
 
 class RawFeed(Model, ContentHashMixin):
@@ -0,0 +1,56 @@
+from django.db import connection
+
+from .helper import Model, models
+
+# freeze levels which depend on active users, see Feed.refresh_freeze_level
+USER_ACTIVITY_FREEZE_LEVEL = 3 * 24
+
+
+class FeedFreezeTask(Model):
+    """
+    feed_id -> pending freeze level refresh, consumed by harbor
+    """
+
+    id = models.PositiveIntegerField(primary_key=True, help_text='feed id')
+
+    @staticmethod
+    def enqueue(feed_ids: list):
+        feed_ids = list(set(feed_ids))
+        if not feed_ids:
+            return
+        sql = """
+        INSERT INTO rssant_api_feedfreezetask (id, _version, _created, _updated)
+        SELECT id, 1, NOW(), NOW() FROM unnest(%s::integer[]) AS id
+        ON CONFLICT (id) DO NOTHING
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [feed_ids])
+
+    @staticmethod
+    def enqueue_by_user(user_id: int):
+        """Enqueue feeds which frozen because of user inactive"""
+        sql = """
+        INSERT INTO rssant_api_feedfreezetask (id, _version, _created, _updated)
+        SELECT feed.id, 1, NOW(), NOW()
+        FROM rssant_api_userfeed AS userfeed
+        JOIN rssant_api_feed AS feed ON feed.id = userfeed.feed_id
+        WHERE userfeed.user_id = %s AND feed.freeze_level >= %s
+        ON CONFLICT (id) DO NOTHING
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [user_id, USER_ACTIVITY_FREEZE_LEVEL])
+
+    @staticmethod
+    def take(limit: int = 500) -> list:
+        sql = """
+        DELETE FROM rssant_api_feedfreezetask
+        WHERE id IN (
+            SELECT id FROM rssant_api_feedfreezetask
+            ORDER BY _created LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [limit])
+            return [x[0] for x in cursor.fetchall()]
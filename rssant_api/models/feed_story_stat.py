@@ -1,4 +1,13 @@
+import datetime
+import typing
+from collections import Counter
+
+from django.db import connection, transaction
+
+from rssant_api.monthly_story_count import MonthlyStoryCount, id_of_month, month_of_id
 from .helper import Model, models, optional
+from .feed import Feed
+from .story_storage import StoryId
 
 
 class FeedStoryStat(Model):
@@ -44,3 +53,125 @@ class FeedStoryStat(Model):
     @classmethod
     def save_checksum_data(cls, feed_id: int, checksum_data: bytes):
         cls._create_or_update(feed_id, checksum_data=checksum_data)
+
+
+# month_id of FeedMonthlyStoryCount.id, see also id_of_month
+_MONTH_ID_BITS = 20
+
+
+class FeedMonthlyStoryCount(Model):
+    """
+    (feed_id, month) -> story count, feed dryness is derived from it lazily
+    """
+
+    id = models.BigIntegerField(primary_key=True, help_text='feed_id and month_id')
+    count = models.IntegerField(default=0, help_text='number of storys published in the month')
+
+    @staticmethod
+    def encode_id(feed_id: int, month_id: int) -> int:
+        return (feed_id << _MONTH_ID_BITS) + month_id
+
+    @staticmethod
+    def decode_id(value: int) -> typing.Tuple[int, int]:
+        return value >> _MONTH_ID_BITS, value & ((1 << _MONTH_ID_BITS) - 1)
+
+    @classmethod
+    def incr(cls, feed_id: int, dt_published_s: typing.List[datetime.datetime]):
+        """Increase story count of months by storys publish time"""
+        counter = Counter()
+        for dt in dt_published_s:
+            if not dt or not MonthlyStoryCount.is_valid_year_month(dt.year, dt.month):
+                continue
+            counter[cls.encode_id(feed_id, id_of_month(dt.year, dt.month))] += 1
+        if not counter:
+            return
+        # sort ids to avoid deadlock between concurrent upserts
+        ids = list(sorted(counter))
+        counts = [counter[x] for x in ids]
+        sql = """
+        INSERT INTO rssant_api_feedmonthlystorycount AS t
+            (id, count, _version, _created, _updated)
+        SELECT id, count, 1, NOW(), NOW()
+        FROM unnest(%s::bigint[], %s::integer[]) AS x(id, count)
+        ON CONFLICT (id) DO UPDATE
+        SET count = t.count + EXCLUDED.count, _version = t._version + 1, _updated = NOW()
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [ids, counts])
+
+    @classmethod
+    def batch_get(cls, feed_ids: typing.List[int]) -> typing.Dict[int, MonthlyStoryCount]:
+        """Query monthly story count of feeds, by id range of each feed"""
+        feed_ids = list(sorted(set(feed_ids)))
+        result = {feed_id: MonthlyStoryCount() for feed_id in feed_ids}
+        if not feed_ids:
+            return result
+        sql = """
+        SELECT t.id, t.count FROM rssant_api_feedmonthlystorycount AS t
+        JOIN unnest(%s::bigint[], %s::bigint[]) AS r(begin_id, end_id)
+        ON t.id >= r.begin_id AND t.id < r.end_id
+        """
+        begin_ids = [cls.encode_id(x, 0) for x in feed_ids]
+        end_ids = [cls.encode_id(x + 1, 0) for x in feed_ids]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [begin_ids, end_ids])
+            rows = cursor.fetchall()
+        for value, count in rows:
+            feed_id, month_id = cls.decode_id(value)
+            year, month = month_of_id(month_id)
+            result[feed_id].put(year, month, max(0, count))
+        return result
+
+    @classmethod
+    def refresh_dryness(cls, feed_ids: typing.List[int]):
+        """Update feed monthly_story_count_data and dryness"""
+        monthly_story_counts = cls.batch_get(feed_ids)
+        Feed.bulk_set_monthly_story_count(monthly_story_counts)
+
+    @classmethod
+    def rebuild(cls, feed_id: int, legacy: bool = True):
+        """
+        Recompute monthly story count of feed from StoryInfo, and legacy
+        Story which not migrated if legacy is True.
+        """
+        sql_count = """
+        WITH story AS (
+            SELECT dt_published FROM rssant_api_storyinfo
+            WHERE id >= %(begin_story_id)s AND id < %(end_story_id)s
+            UNION ALL
+            SELECT dt_published FROM rssant_api_story AS story
+            WHERE %(legacy)s AND story.feed_id = %(feed_id)s AND NOT EXISTS (
+                SELECT 1 FROM rssant_api_storyinfo AS info
+                WHERE info.id = %(begin_story_id)s + (story."offset"::bigint << 4)
+            )
+        ), month AS (
+            SELECT CAST(EXTRACT(YEAR FROM dt_published) AS INTEGER) AS year,
+                CAST(EXTRACT(MONTH FROM dt_published) AS INTEGER) AS month
+            FROM story WHERE dt_published IS NOT NULL
+        )
+        SELECT year, month, count(1) AS count FROM month
+        WHERE year >= 1970 AND year <= 9999
+        GROUP BY year, month
+        """
+        sql_delete = """
+        DELETE FROM rssant_api_feedmonthlystorycount
+        WHERE id >= %s AND id < %s
+        """
+        params = dict(
+            feed_id=feed_id,
+            legacy=bool(legacy),
+            begin_story_id=StoryId.encode(feed_id, 0),
+            end_story_id=StoryId.encode(feed_id, 0) + (1 << 32),
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql_count, params)
+            rows = list(cursor.fetchall())
+        items = []
+        for year, month, count in rows:
+            month_id = id_of_month(int(year), int(month))
+            items.append(FeedMonthlyStoryCount(id=cls.encode_id(feed_id, month_id), count=count))
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(sql_delete, [cls.encode_id(feed_id, 0), cls.encode_id(feed_id + 1, 0)])
+            FeedMonthlyStoryCount.objects.bulk_create(items)
+            cls.refresh_dryness([feed_id])
@@ -1,11 +1,13 @@
 from django.utils import timezone
 from django.db import connection, transaction
+from django.db.models import Q
 from validr import T
 
 from rssant_common.detail import Detail
-from rssant_api.monthly_story_count import MonthlyStoryCount
 from .helper import Model, ContentHashMixin, models, optional, User
-from .feed import Feed, UserFeed
+from .feed import Feed, UserFeed, FeedStatus
+from .feed_freeze_task import FeedFreezeTask
+from .feed_story_stat import FeedMonthlyStoryCount
 
 
 MONTH_18 = timezone.timedelta(days=18 * 30)
@@ -150,11 +152,10 @@ class Story(Model, ContentHashMixin):
                 .only(
                     '_version',
                     'id',
-                    'dryness',
-                    'monthly_story_count_data',
                     'total_storys',
                     'dt_first_story_published',
                     'dt_latest_story_published',
+                    'is_story_migrated',
                 )\
                 .get(pk=feed_id)
             offset = feed.total_storys
@@ -204,50 +205,29 @@ class Story(Model, ContentHashMixin):
                 modified_story_objects.append(story)
             if new_story_objects:
                 Story.objects.bulk_create(new_story_objects, batch_size=batch_size)
+                # reads of the feed need fallback to legacy storys again
+                feed.is_story_migrated = False
+                Story._update_feed_publish_stats(feed, new_story_objects)
                 Story._update_feed_monthly_story_count(feed, new_story_objects)
                 Story._update_feed_story_dt_published_total_storys(feed, total_storys=offset)
             return modified_story_objects
 
     @staticmethod
-    def _update_feed_monthly_story_count(feed, new_story_objects):
-        monthly_story_count = MonthlyStoryCount.load(feed.monthly_story_count_data)
-        for story in new_story_objects:
-            if not story.dt_published:
-                continue
-            year, month = story.dt_published.year, story.dt_published.month
-            if not MonthlyStoryCount.is_valid_year_month(year, month):
-                continue
-            count = monthly_story_count.get(year, month)
-            monthly_story_count.put(year, month, count + 1)
-        feed.monthly_story_count = monthly_story_count
-        feed.save()
+    def _update_feed_publish_stats(feed, new_story_objects):
+        publish_stats = feed.publish_stats
+        dt_published_s = [story.dt_published for story in new_story_objects]
+        publish_stats.update(dt_published_s, now=timezone.now())
+        feed.publish_stats = publish_stats
+        # new storys change the prediction of next check
+        if feed.status in (FeedStatus.READY, FeedStatus.ERROR):
+            feed.dt_next_check = feed.compute_dt_next_check()
 
     @staticmethod
-    def refresh_feed_monthly_story_count(feed_id):
-        count_sql = """
-        SELECT
-            CAST(EXTRACT(YEAR FROM dt_published) AS INTEGER) AS year,
-            CAST(EXTRACT(MONTH FROM dt_published) AS INTEGER) AS month,
-            count(1) as count
-        FROM rssant_api_story
-        WHERE feed_id = %s AND dt_published IS NOT NULL
-        GROUP BY
-            CAST(EXTRACT(YEAR FROM dt_published) AS INTEGER),
-            CAST(EXTRACT(MONTH FROM dt_published) AS INTEGER);
-        """
-        with connection.cursor() as cursor:
-            cursor.execute(count_sql, [feed_id])
-            rows = list(cursor.fetchall())
-        items = []
-        for row in rows:
-            year, month, count = map(int, row)
-            if 1970 <= year <= 9999:
-                items.append((year, month, count))
-        monthly_story_count = MonthlyStoryCount(items)
-        with transaction.atomic():
-            feed = Feed.objects.filter(pk=feed_id).get()
-            feed.monthly_story_count = monthly_story_count
-            feed.save()
+    def _update_feed_monthly_story_count(feed, new_story_objects):
+        dt_published_s = [story.dt_published for story in new_story_objects]
+        FeedMonthlyStoryCount.incr(feed.id, dt_published_s)
+        # dryness will be refreshed by FeedFreezeTask
+        FeedFreezeTask.enqueue([feed.id])
 
     @staticmethod
     def _update_feed_story_dt_published_total_storys(feed, total_storys):
@@ -301,6 +281,36 @@ class Story(Model, ContentHashMixin):
         Story.objects.filter(pk=story_id)\
             .update(is_user_marked=is_user_marked)
 
+    @staticmethod
+    def batch_delete_by_retention_offset(retention_offsets: dict) -> int:
+        """
+        delete storys < retention_offset and not is_user_marked of many feeds
+        """
+        if not retention_offsets:
+            return 0
+        q = Q()
+        for feed_id, retention_offset in retention_offsets.items():
+            q |= Q(feed_id=feed_id, offset__lt=retention_offset)
+        n, __ = Story.objects.filter(q).exclude(is_user_marked=True).delete()
+        return n
+
+    @staticmethod
+    def delete_unreferenced_by_feed(feed_id) -> int:
+        """
+        Delete storys of feed which not referenced by UserStory, used after
+        storys migrated to StoryInfo.
+        """
+        sql = """
+        DELETE FROM rssant_api_story AS story
+        WHERE story.feed_id = %s AND NOT EXISTS (
+            SELECT 1 FROM rssant_api_userstory AS userstory
+            WHERE userstory.story_id = story.id
+        )
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [feed_id])
+            return cursor.rowcount
+
     @staticmethod
     def delete_by_retention_offset(feed_id, retention_offset):
         """
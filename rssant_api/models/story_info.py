@@ -1,5 +1,6 @@
 import typing
 from django.utils import timezone
+from django.db.models import Q
 from rssant_common.detail import Detail
 from .helper import models, SealableModel, VersionedMixin, VersionField, optional
 from .story_storage import StoryId
@@ -38,6 +39,10 @@ class StoryInfo(VersionedMixin, SealableModel):
     content_hash_base64 = models.CharField(
         max_length=200, **optional, help_text='base64 hash value of content')
     sentence_count = models.IntegerField(**optional, help_text='sentence count')
+    text_length = models.IntegerField(**optional, help_text='length of content text')
+    link_count = models.IntegerField(**optional, help_text='link count of content')
+    image_count = models.IntegerField(**optional, help_text='image count of content')
+    url_count = models.IntegerField(**optional, help_text='url count of content')
 
     @property
     def feed_id(self) -> int:
@@ -73,6 +78,21 @@ class StoryInfo(VersionedMixin, SealableModel):
         q = q.defer(*cls._get_exclude_fields(detail))
         return list(q.seal().all())
 
+    @staticmethod
+    def batch_delete_by_retention_offset(retention_offsets: typing.Dict[int, int]) -> int:
+        """
+        delete storys < retention_offset and not is_user_marked of many feeds
+        """
+        if not retention_offsets:
+            return 0
+        q = Q()
+        for feed_id, retention_offset in retention_offsets.items():
+            begin_story_id = StoryId.encode(feed_id, 0)
+            retention_story_id = StoryId.encode(feed_id, retention_offset)
+            q |= Q(pk__gte=begin_story_id, pk__lt=retention_story_id)
+        n, __ = StoryInfo.objects.filter(q).exclude(is_user_marked=True).delete()
+        return n
+
     @staticmethod
     def delete_by_retention_offset(feed_id, retention_offset) -> int:
         """
@@ -1,15 +1,17 @@
 import logging
+import typing
 import time
 import datetime
 
 from django.utils import timezone
-from django.db import transaction
+from django.db import connection, transaction
 from validr import T, asdict, modelclass, fields, Invalid
 
 from rssant_common.detail import Detail
 from rssant_common.validator import compiler
 from rssant_config import CONFIG
-from .story import Story, StoryDetailSchema
+from rssant_feedlib.fulltext import StoryContentInfo
+from .story import Story, StoryDetailSchema, UserStory
 from .story_info import StoryInfo, StoryId
 from .feed import Feed
 from .feed_story_stat import FeedStoryStat
@@ -19,6 +21,44 @@ from .story_storage import PostgresClient, PostgresStoryStorage
 
 LOG = logging.getLogger(__name__)
 
+# CommonStory fields which not exists in legacy Story model
+STORY_INFO_ONLY_FIELDS = (
+    'content_length',
+    'text_length',
+    'link_count',
+    'image_count',
+    'url_count',
+)
+
+# story fields in both StoryInfo and legacy Story table
+_PAGE_COMMON_FIELDS = (
+    'unique_id',
+    'title',
+    'link',
+    'author',
+    'image_url',
+    'audio_url',
+    'iframe_url',
+    'has_mathjax',
+    'dt_published',
+    'dt_updated',
+    'dt_created',
+    'dt_synced',
+    'summary',
+    'sentence_count',
+    'content_hash_base64',
+)
+_PAGE_USER_STORY_FIELDS = (
+    'id',
+    'user_feed_id',
+    'story_id',
+    'is_watched',
+    'dt_watched',
+    'is_favorited',
+    'dt_favorited',
+    'dt_created',
+)
+
 
 @modelclass(compiler=compiler)
 class CommonStory:
@@ -40,11 +80,29 @@ class CommonStory:
     content: str = T.str.optional
     sentence_count: int = T.int.min(0).optional
     content_length: int = T.int.min(0).optional
+    text_length: int = T.int.min(0).optional
+    link_count: int = T.int.min(0).optional
+    image_count: int = T.int.min(0).optional
+    url_count: int = T.int.min(0).optional
     content_hash_base64: str = T.str.optional
 
     def to_dict(self):
         return asdict(self)
 
+    def get_content_info(self) -> StoryContentInfo:
+        """
+        Content info use stored metrics, only compute missing metrics.
+        """
+        return StoryContentInfo(
+            self.content,
+            length=self.content_length,
+            text_length=self.text_length,
+            link_count=self.link_count,
+            image_count=self.image_count,
+            url_count=self.url_count,
+            sentence_count=self.sentence_count,
+        )
+
     def __repr__(self):
         base = f'{type(self).__name__}#{self.feed_id},{self.offset}'
         return f'<{base} unique_id={self.unique_id!r} title={self.title!r}>'
@@ -76,7 +134,10 @@ class StoryService:
         detail = Detail.from_schema(detail, StoryDetailSchema)
         return 'content' in detail.include_fields
 
-    def get_by_offset(self, feed_id, offset, detail=False) -> CommonStory:
+    def get_by_offset(self, feed_id, offset, detail=False, legacy=True) -> CommonStory:
+        """
+        legacy: fallback to legacy Story table, not need if feed.is_story_migrated
+        """
         story_info = StoryInfo.get(feed_id, offset, detail=detail)
         if story_info:
             story = self.to_common(story_info)
@@ -85,12 +146,110 @@ class StoryService:
                 content = self._storage.get_content(feed_id, offset)
                 story.content = content
             return story
+        if not legacy:
+            return None
         try:
             story = Story.get_by_offset(feed_id, offset, detail=detail)
         except Story.DoesNotExist:
             return None
         return self.to_common(story)
 
+    @staticmethod
+    def _sql_query_page(detail) -> typing.Tuple[str, typing.List[str]]:
+        detail = Detail.from_schema(detail, StoryDetailSchema)
+        exclude_fields = set(detail.exclude_fields)
+        story_fields = [x for x in _PAGE_COMMON_FIELDS if x not in exclude_fields]
+        info_fields = list(story_fields) + list(STORY_INFO_ONLY_FIELDS)
+        legacy_fields = list(story_fields) + [f'NULL::integer AS {x}' for x in STORY_INFO_ONLY_FIELDS]
+        include_content = 'content' in detail.include_fields
+        # content of StoryInfo is stored in story volume
+        info_fields.append('NULL::text AS content')
+        legacy_fields.append('content' if include_content else 'NULL::text AS content')
+        page_fields = story_fields + list(STORY_INFO_ONLY_FIELDS) + ['content']
+        user_story_fields = ', '.join(f'us.{x}' for x in _PAGE_USER_STORY_FIELDS)
+        sql = f"""
+        WITH info AS (
+            SELECT TRUE AS is_info, ((id >> 4) & 268435455)::integer AS "offset",
+                {', '.join(info_fields)}
+            FROM rssant_api_storyinfo
+            WHERE id >= %(begin_id)s AND id < %(end_id)s
+        ), page AS (
+            SELECT * FROM info
+            UNION ALL
+            SELECT FALSE AS is_info, "offset", {', '.join(legacy_fields)}
+            FROM rssant_api_story
+            WHERE %(legacy)s AND feed_id = %(feed_id)s
+                AND "offset" >= %(offset)s AND "offset" < %(end_offset)s
+                AND (SELECT COUNT(1) FROM info) < %(size)s
+                AND "offset" NOT IN (SELECT "offset" FROM info)
+        )
+        SELECT page.is_info, page."offset", {', '.join(f'page.{x}' for x in page_fields)},
+            {user_story_fields}
+        FROM page
+        LEFT OUTER JOIN rssant_api_userstory AS us
+            ON us.user_id = %(user_id)s AND us.feed_id = %(feed_id)s AND us."offset" = page."offset"
+            AND (us.is_watched OR us.is_favorited)
+        ORDER BY page."offset"
+        """
+        return sql, page_fields
+
+    def query_page(
+        self, feed_id, offset, size, user_id, detail=False, legacy=True,
+    ) -> typing.Tuple[typing.List[CommonStory], typing.List[UserStory]]:
+        """
+        Query storys of offsets [offset, offset + size) and user storys of them,
+        StoryInfo, legacy Story and UserStory in one query, content in one
+        range query of story volume.
+        legacy: fallback to legacy Story table, not need if feed.is_story_migrated
+        """
+        if size <= 0:
+            return [], []
+        sql, page_fields = self._sql_query_page(detail)
+        params = dict(
+            feed_id=feed_id,
+            user_id=user_id,
+            offset=offset,
+            end_offset=offset + size,
+            size=size,
+            legacy=bool(legacy),
+            begin_id=StoryId.encode(feed_id, offset),
+            end_id=StoryId.encode(feed_id, offset + size),
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+        storys = []
+        info_storys = {}
+        user_storys = []
+        num_page_fields = 2 + len(page_fields)
+        for row in rows:
+            is_info, story_offset = row[:2]
+            d = dict(feed_id=feed_id, offset=story_offset)
+            for key, value in zip(page_fields, row[2:num_page_fields]):
+                if value is not None:
+                    d[key] = value
+            if not d.get('unique_id'):
+                d['unique_id'] = d.get('link') or f'{feed_id}-{story_offset}'
+            if d.get('content') and 'content_length' not in d:
+                d['content_length'] = len(d['content'])
+            story = CommonStory(d)
+            storys.append(story)
+            if is_info:
+                info_storys[story_offset] = story
+            user_story_values = row[num_page_fields:]
+            if user_story_values[0] is not None:
+                user_story_d = dict(zip(_PAGE_USER_STORY_FIELDS, user_story_values))
+                user_storys.append(UserStory(
+                    user_id=user_id, feed_id=feed_id, offset=story_offset, **user_story_d))
+        if info_storys and self._is_include_content(detail):
+            begin_offset = min(info_storys)
+            end_offset = max(info_storys) + 1
+            for (_, story_offset), content in self._storage.get_range(feed_id, begin_offset, end_offset):
+                story = info_storys.get(story_offset)
+                if story is not None:
+                    story.content = content
+        return storys, user_storys
+
     def set_user_marked(self, feed_id, offset, is_user_marked=True) -> Story:
         try:
             story = Story.get_by_offset(feed_id, offset)
@@ -99,7 +258,8 @@ class StoryService:
         if (not story) and is_user_marked:
             common_story = self.get_by_offset(feed_id, offset, detail=True)
             d = asdict(common_story)
-            d.pop('content_length', None)
+            for key in STORY_INFO_ONLY_FIELDS:
+                d.pop(key, None)
             story = Story(**d)
             story.is_user_marked = is_user_marked
             story.save()
@@ -125,15 +285,15 @@ class StoryService:
 
     def update_story(self, feed_id, offset, data: dict):
         data = {k: v for k, v in data.items() if v is not None}
-        keys = set(data.keys())
-        if keys == {'content'}:
-            self._storage.save_content(feed_id, offset, data['content'])
-            return
         # assume StoryInfo already created when bulk_save_by_feed
         update_params = self._validate_update_story_params(data)
         content = update_params.pop('content', None)
         if content:
             self._storage.save_content(feed_id, offset, content)
+            # content_length is used by get_content_info, keep it consistent with content
+            update_params['content_length'] = len(content)
+        if not update_params:
+            return
         story_id = StoryId.encode(feed_id, offset)
         with transaction.atomic():
             updated = StoryInfo.objects\
@@ -199,10 +359,12 @@ class StoryService:
         storys = Story.batch_get_by_offset(keys, detail=detail)
         return storys
 
-    def _query_old_story_objects(self, feed_id, old_storys_map):
+    def _query_old_story_objects(self, feed_id, old_storys_map, legacy=True):
         old_story_infos = self._query_story_infos(feed_id, old_storys_map.keys())
         remain_offsets = set(old_storys_map.keys()) - {x.offset for x in old_story_infos}
-        old_story_objects = self._query_story_objects(feed_id, remain_offsets)
+        old_story_objects = []
+        if legacy and remain_offsets:
+            old_story_objects = self._query_story_objects(feed_id, remain_offsets)
         old_story_objects_map = {}
         for story_info in old_story_infos:
             old_story_objects_map[story_info.offset] = (True, story_info)
@@ -210,8 +372,8 @@ class StoryService:
             old_story_objects_map[story_object.offset] = (False, story_object)
         return old_story_objects_map
 
-    def _compute_modified_storys(self, feed_id, old_storys_map, new_storys, is_refresh):
-        old_story_objects_map = self._query_old_story_objects(feed_id, old_storys_map)
+    def _compute_modified_storys(self, feed_id, old_storys_map, new_storys, is_refresh, legacy=True):
+        old_story_objects_map = self._query_old_story_objects(feed_id, old_storys_map, legacy=legacy)
         modified_story_objects = {}
         new_storys = list(new_storys)
         for offset, story in old_storys_map.items():
@@ -322,6 +484,7 @@ class StoryService:
 
         new_storys, modified_story_objects = self._compute_modified_storys(
             feed_id, old_storys_map, new_storys, is_refresh=is_refresh,
+            legacy=not feed.is_story_migrated,
         )
         new_storys = Story._dedup_sort_storys(new_storys)
         new_total_storys = feed.total_storys + len(new_storys)
@@ -357,6 +520,7 @@ class StoryService:
                 StoryInfo.objects.bulk_create(new_story_infos, batch_size=batch_size)
             if new_common_storys:
                 FeedStoryStat.save_unique_ids_data(feed_id, unique_ids_data)
+                Story._update_feed_publish_stats(feed, new_common_storys)
                 Story._update_feed_monthly_story_count(feed, new_common_storys)
                 feed.total_storys = new_total_storys
                 if feed.dt_first_story_published is None:
@@ -366,11 +530,15 @@ class StoryService:
 
         return modified_common_storys
 
-    def _delete_content_by_retention(self, feed_id, begin_offset, end_offset):
-        keys = []
-        for offset in range(begin_offset, end_offset, 1):
-            keys.append((feed_id, offset))
-        self._storage.batch_delete_content(keys)
+    def _delete_content_by_retention(self, ranges: dict):
+        self._storage.batch_delete_range([
+            (feed_id, begin_offset, end_offset)
+            for feed_id, (begin_offset, end_offset) in ranges.items()
+        ])
+
+    def delete_content_by_feeds(self, feed_ids):
+        """delete all story contents of feeds, eg: feeds deleted"""
+        self._storage.batch_delete_range([(feed_id, 0, None) for feed_id in feed_ids])
 
     def delete_by_retention(self, feed_id, retention=3000, limit=1000):
         """
@@ -379,20 +547,141 @@ class StoryService:
             retention: num storys to keep
             limit: delete at most limit rows
         """
-        feed = Feed.get_by_pk(feed_id)
-        offset = feed.retention_offset or 0
-        # delete at most limit rows, avoid out of memory and timeout
-        new_offset = min(offset + limit, feed.total_storys - retention)
-        if new_offset <= offset:
+        return self.batch_delete_by_retention([feed_id], retention=retention, limit=limit)
+
+    def batch_delete_by_retention(self, feed_ids, retention=3000, limit=1000, budget=None):
+        """
+        Delete storys of many feeds in one pass, content of all feeds deleted
+        by one statement per volume.
+
+        Params:
+            feed_ids: feed IDs
+            retention: num storys to keep
+            limit: delete at most limit rows per feed
+            budget: delete at most budget rows in total, None means no limit
+        """
+        q = Feed.objects.filter(id__in=list(feed_ids))\
+            .only('_version', 'id', 'total_storys', 'retention_offset')\
+            .order_by('id')
+        # feed_id -> (offset, new_offset)
+        ranges = {}
+        for feed in q.all():
+            offset = feed.retention_offset or 0
+            # delete at most limit rows, avoid out of memory and timeout
+            new_offset = min(offset + limit, (feed.total_storys or 0) - retention)
+            if budget is not None:
+                new_offset = min(new_offset, offset + budget)
+            if new_offset <= offset:
+                continue
+            ranges[feed.id] = (offset, new_offset)
+            if budget is not None:
+                budget -= new_offset - offset
+                if budget <= 0:
+                    break
+        if not ranges:
             return 0
-        self._delete_content_by_retention(feed_id, offset, new_offset)
+        self._delete_content_by_retention(ranges)
+        retention_offsets = {feed_id: end for feed_id, (_, end) in ranges.items()}
+        with transaction.atomic():
+            n = StoryInfo.batch_delete_by_retention_offset(retention_offsets)
+            m = Story.batch_delete_by_retention_offset(retention_offsets)
+            Feed.bulk_set_retention_offset(retention_offsets)
+        return n + m
+
+    @staticmethod
+    def _count_legacy_storys_not_migrated(feed_id, begin_offset) -> int:
+        sql = """
+        SELECT COUNT(1) FROM rssant_api_story AS story
+        WHERE story.feed_id = %(feed_id)s AND story."offset" >= %(begin_offset)s
+            AND NOT EXISTS (
+                SELECT 1 FROM rssant_api_storyinfo AS info
+                WHERE info.id = (%(feed_id)s::bigint << 32) + (story."offset"::bigint << 4)
+            )
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(sql, dict(feed_id=feed_id, begin_offset=begin_offset))
+            return cursor.fetchone()[0]
+
+    def _migrate_legacy_story_batch(self, feed_id, storys) -> int:
+        keys = [(feed_id, x.offset) for x in storys]
+        exists_offsets = {x.offset for x in StoryInfo.batch_get(keys)}
+        story_infos = []
+        save_story_contents = []
+        for story in storys:
+            if story.offset in exists_offsets:
+                continue
+            try:
+                common_story = self.to_common(story)
+            except Invalid as ex:
+                LOG.warning(f'legacy story#{feed_id},{story.offset} invalid: {ex}')
+                continue
+            story_info = StoryInfo(id=StoryId.encode(feed_id, story.offset))
+            update_params = common_story.to_dict()
+            update_params.pop('content', None)
+            update_params.pop('feed_id', None)
+            update_params.pop('offset', None)
+            for k, v in update_params.items():
+                setattr(story_info, k, v)
+            story_info.is_user_marked = story.is_user_marked
+            story_infos.append(story_info)
+            if common_story.content:
+                save_story_contents.append(((feed_id, story.offset), common_story.content))
+        # save content first, StoryInfo visible means content ready
+        self._storage.batch_save_content(save_story_contents)
+        StoryInfo.objects.bulk_create(story_infos, ignore_conflicts=True)
+        return len(story_infos)
+
+    def _ensure_unique_ids_data(self, feed_id, total_storys):
+        if total_storys <= 0 or self._get_unique_ids_by_stat(feed_id) is not None:
+            return
+        unique_ids_map = self._get_unique_ids_by_story(
+            feed_id, max(0, total_storys - 300), total_storys)
+        unique_ids_data = self._compute_new_unique_ids_data(
+            feed_id, total_storys, [], unique_ids_map)
+        if unique_ids_data:
+            FeedStoryStat.save_unique_ids_data(feed_id, unique_ids_data)
+
+    def migrate_legacy_storys(self, feed_id, batch_size=100, sleep=0, delete_legacy=False):
+        """
+        Copy legacy storys of feed to StoryInfo and story volumes, then mark
+        feed.is_story_migrated so reads skip fallback to legacy Story table.
+        It's idempotent and can resume after interrupted.
+
+        Params:
+            feed_id: feed ID
+            batch_size: num storys per batch
+            sleep: seconds to sleep between batches, throttle database load
+            delete_legacy: delete legacy storys not referenced by UserStory
+        Returns:
+            (num_migrated, is_migrated)
+        """
+        feed = Feed.objects\
+            .only('_version', 'id', 'total_storys', 'retention_offset')\
+            .get(pk=feed_id)
+        begin_offset = feed.retention_offset or 0
+        offset = begin_offset
+        num_migrated = 0
+        while True:
+            q = Story.objects.filter(feed_id=feed_id, offset__gte=offset)\
+                .order_by('offset')[:batch_size]
+            storys = list(q.seal().all())
+            if storys:
+                num_migrated += self._migrate_legacy_story_batch(feed_id, storys)
+                offset = storys[-1].offset + 1
+            if len(storys) < batch_size:
+                break
+            if sleep > 0:
+                time.sleep(sleep)
+        num_remain = self._count_legacy_storys_not_migrated(feed_id, begin_offset)
+        if num_remain > 0:
+            LOG.warning('feed#%s has %d legacy storys not migrated', feed_id, num_remain)
+            return num_migrated, False
+        self._ensure_unique_ids_data(feed_id, feed.total_storys or 0)
         with transaction.atomic():
-            n = StoryInfo.delete_by_retention_offset(feed_id, new_offset)
-            m = Story.delete_by_retention_offset(feed_id, new_offset)
-            feed.retention_offset = new_offset
-            feed.save()
-            return n + m
-        return 0
+            Feed.objects.filter(pk=feed_id).update(is_story_migrated=True)
+            if delete_legacy:
+                Story.delete_unreferenced_by_feed(feed_id)
+        return num_migrated, True
 
 
 POSTGRES_CLIENT = PostgresClient(CONFIG.pg_story_volumes_parsed)
@@ -1,4 +1,4 @@
-from typing import List, Tuple, Dict
+from typing import List, Tuple, Dict, Iterator, Optional
 from collections import defaultdict
 
 from sqlalchemy.sql import text as sql
@@ -10,6 +10,8 @@ from .postgres_sharding import sharding_for
 
 
 _KEY = Tuple[int, int]
+# (feed_id, begin_offset, end_offset), end_offset None means to the end of feed
+_RANGE = Tuple[int, int, Optional[int]]
 
 
 class PostgresStoryStorage:
@@ -49,6 +51,31 @@ class PostgresStoryStorage:
     def _to_id_tuple(keys: List[_KEY]) -> tuple:
         return tuple(StoryId.encode(feed_id, offset) for feed_id, offset in keys)
 
+    @staticmethod
+    def _to_id_range(feed_id: int, begin_offset: int, end_offset: int = None) -> Tuple[int, int]:
+        """
+        story ids of one feed are contiguous, offsets [begin_offset, end_offset)
+        map to story ids [begin_id, end_id)
+        """
+        begin_id = StoryId.encode(feed_id, begin_offset)
+        if end_offset is None:
+            end_id = StoryId.encode(feed_id, 0) + (1 << 32)
+        else:
+            end_id = StoryId.encode(feed_id, end_offset)
+        return begin_id, end_id
+
+    @staticmethod
+    def _decode_rows(rows) -> List[Tuple[_KEY, str]]:
+        result = []
+        for story_id, content_data in rows:
+            key = StoryId.decode(story_id)
+            if content_data:
+                content = StoryData.decode_text(content_data)
+            else:
+                content = None
+            result.append((key, content))
+        return result
+
     def batch_get_content(self, keys: List[_KEY]) -> List[Tuple[_KEY, str]]:
         result = []
         if not keys:
@@ -65,15 +92,39 @@ class PostgresStoryStorage:
         id_tuple = self._to_id_tuple(keys)
         with self._client.get_engine(volume).connect() as conn:
             rows = list(conn.execute(q, id_tuple=id_tuple).fetchall())
-        result = []
-        for story_id, content_data in rows:
-            key = StoryId.decode(story_id)
-            if content_data:
-                content = StoryData.decode_text(content_data)
-            else:
-                content = None
-            result.append((key, content))
-        return result
+        return self._decode_rows(rows)
+
+    def get_range(
+        self, feed_id: int, begin_offset: int, end_offset: int = None, limit: int = None,
+    ) -> List[Tuple[_KEY, str]]:
+        """get contents of offsets [begin_offset, end_offset), order by offset"""
+        volume = sharding_for(feed_id)
+        limit_sql = 'LIMIT :limit' if limit is not None else ''
+        q = sql("""
+        SELECT id, content FROM {table}
+        WHERE id >= :begin_id AND id < :end_id
+        ORDER BY id {limit_sql}
+        """.format(table=self._client.get_table(volume), limit_sql=limit_sql))
+        begin_id, end_id = self._to_id_range(feed_id, begin_offset, end_offset)
+        params = dict(begin_id=begin_id, end_id=end_id)
+        if limit is not None:
+            params.update(limit=limit)
+        with self._client.get_engine(volume).connect() as conn:
+            rows = list(conn.execute(q, **params).fetchall())
+        return self._decode_rows(rows)
+
+    def scan_feed(
+        self, feed_id: int, begin_offset: int = 0, batch_size: int = 100,
+    ) -> Iterator[Tuple[_KEY, str]]:
+        """iterate contents of the feed by offset, query batch_size rows at a time"""
+        offset = begin_offset
+        while True:
+            items = self.get_range(feed_id, offset, limit=batch_size)
+            yield from items
+            if len(items) < batch_size:
+                break
+            (_, last_offset), _ = items[-1]
+            offset = last_offset + 1
 
     def batch_delete_content(self, keys: List[_KEY]) -> None:
         if not keys:
@@ -91,6 +142,35 @@ class PostgresStoryStorage:
             with conn.begin():
                 conn.execute(q, id_tuple=id_tuple)
 
+    def delete_range(self, feed_id: int, begin_offset: int, end_offset: int = None) -> None:
+        """delete contents of offsets [begin_offset, end_offset)"""
+        self.batch_delete_range([(feed_id, begin_offset, end_offset)])
+
+    def batch_delete_range(self, ranges: List[_RANGE]) -> None:
+        """delete contents of many ranges, one statement per volume"""
+        if not ranges:
+            return
+        groups = self._split_by(ranges, lambda x: sharding_for(x[0]))
+        for volume, group_ranges in groups.items():
+            self._batch_delete_range(volume, group_ranges)
+
+    def _batch_delete_range(self, volume: int, ranges: List[_RANGE]) -> None:
+        q = sql("""
+        DELETE FROM {table} AS story
+        USING unnest(CAST(:begin_ids AS BIGINT[]), CAST(:end_ids AS BIGINT[]))
+            AS r(begin_id, end_id)
+        WHERE story.id >= r.begin_id AND story.id < r.end_id
+        """.format(table=self._client.get_table(volume)))
+        begin_ids = []
+        end_ids = []
+        for feed_id, begin_offset, end_offset in ranges:
+            begin_id, end_id = self._to_id_range(feed_id, begin_offset, end_offset)
+            begin_ids.append(begin_id)
+            end_ids.append(end_id)
+        with self._client.get_engine(volume).connect() as conn:
+            with conn.begin():
+                conn.execute(q, begin_ids=begin_ids, end_ids=end_ids)
+
     def batch_save_content(self, items: List[Tuple[_KEY, str]]) -> None:
         if not items:
             return
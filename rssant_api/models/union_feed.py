@@ -20,6 +20,9 @@ from .feed import (
     UserFeed,
 )
 from .feed_creation import FeedCreateResult, FeedCreation, FeedUrlMap
+from .feed_freeze_task import FeedFreezeTask
+from .story_service import STORY_SERVICE
+from .user_activity import UserActivity
 
 FeedImportItem = namedtuple('FeedImportItem', 'url, title, group')
 
@@ -218,7 +221,9 @@ class UnionFeed:
 
     @staticmethod
     def bulk_delete(feed_ids):
-        return Feed.objects.filter(id__in=list(feed_ids)).delete()
+        feed_ids = list(feed_ids)
+        STORY_SERVICE.delete_content_by_feeds(feed_ids)
+        return Feed.objects.filter(id__in=feed_ids).delete()
 
     @staticmethod
     def _merge_user_feeds(user_feeds, detail=False):
@@ -286,6 +291,14 @@ class UnionFeed:
         except UserFeed.DoesNotExist as ex:
             raise FeedNotFoundError(str(ex)) from ex
         user_feed.delete()
+        UserActivity.on_unsubscribe(user_id, [feed_id])
+        FeedFreezeTask.enqueue([feed_id])
+
+    @staticmethod
+    def _on_user_activity(user_id):
+        """Refresh freeze level of user's feeds if the user become active"""
+        if UserActivity.touch(user_id):
+            FeedFreezeTask.enqueue_by_user(user_id)
 
     @staticmethod
     def set_story_offset(feed_unionid, offset):
@@ -302,6 +315,7 @@ class UnionFeed:
             user_feed.story_offset = offset
             user_feed.dt_updated = timezone.now()
             user_feed.save()
+            UnionFeed._on_user_activity(user_feed.user_id)
         return union_feed
 
     @classmethod
@@ -324,6 +338,7 @@ class UnionFeed:
             setattr(user_feed, key, value)
         user_feed.dt_updated = timezone.now()
         user_feed.save()
+        UnionFeed._on_user_activity(user_feed.user_id)
         return union_feed
 
     @staticmethod
@@ -331,10 +346,13 @@ class UnionFeed:
         q = UserFeed.objects.filter(user_id=user_id).filter(
             feed_id__in=feed_ids
         )
-        return q.update(
+        num_updated = q.update(
             group=group,
             dt_updated=timezone.now(),
         )
+        if num_updated > 0:
+            UnionFeed._on_user_activity(user_id)
+        return num_updated
 
     @staticmethod
     def set_all_readed_by_user(user_id, ids=None) -> int:
@@ -358,6 +376,8 @@ class UnionFeed:
         with transaction.atomic():
             for user_feed in updates:
                 user_feed.save()
+        if updates:
+            UnionFeed._on_user_activity(user_id)
         return len(updates)
 
     @staticmethod
@@ -369,7 +389,10 @@ class UnionFeed:
             feed_ids = [x.feed_id for x in ids]
             q = q.filter(feed_id__in=feed_ids)
         q = q.only('_version', 'id')
+        feed_ids = list(q.values_list('feed_id', flat=True))
         num_deleted, details = q.delete()
+        UserActivity.on_unsubscribe(user_id, feed_ids)
+        FeedFreezeTask.enqueue(feed_ids)
         return num_deleted
 
     @staticmethod
@@ -387,6 +410,7 @@ class UnionFeed:
             user_feed = UserFeed(user_id=user_id, feed=feed)
             feed.unfreeze()
             user_feed.save()
+            UserActivity.on_subscribe(user_id, [feed.id])
             return UnionFeed(feed, user_feed), None
         else:
             feed_creation = FeedCreation(user_id=user_id, url=url)
@@ -484,11 +508,10 @@ class UnionFeed:
         feed_creations = feed_creations[:free_count]
         # 执行写入数据
         UserFeed.objects.bulk_create(new_user_feeds, batch_size=batch_size)
+        UserActivity.on_subscribe(user_id, [x.feed_id for x in new_user_feeds])
         FeedCreation.objects.bulk_create(feed_creations, batch_size=batch_size)
         if unfreeze_feed_ids:
-            Feed.objects.filter(pk__in=unfreeze_feed_ids).update(
-                freeze_level=1
-            )
+            Feed.unfreeze_by_ids(unfreeze_feed_ids)
         existed_feeds = UnionFeed._merge_user_feeds(user_feed_map.values())
         union_feeds = UnionFeed._merge_user_feeds(new_user_feeds)
         return FeedCreateResult(
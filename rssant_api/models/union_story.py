@@ -8,9 +8,9 @@ from rssant_common.validator import FeedUnionId, StoryUnionId
 from rssant_feedlib.processor import story_html_to_text
 
 from .errors import FeedNotFoundError, StoryNotFoundError
-from .feed import UserFeed
+from .feed import Feed, UserFeed
 from .story import USER_STORY_DETAIL_FEILDS, Story, StoryDetailSchema, UserStory
-from .story_info import STORY_INFO_DETAIL_FEILDS, StoryId, StoryInfo
+from .story_info import StoryInfo
 from .story_service import STORY_SERVICE
 
 # 旧的数据里有些 summary 是 html 格式，需要转成 text 给页面展示
@@ -157,20 +157,21 @@ class UnionStory:
     @staticmethod
     def _check_user_feed_by_story_unionid(story_unionid):
         user_id, feed_id, offset = story_unionid
-        q = UserFeed.objects.only('id').filter(
-            user_id=user_id, feed_id=feed_id
-        )
+        q = UserFeed.objects.select_related('feed')
+        q = q.only('id', 'feed_id', 'feed__id', 'feed__is_story_migrated')
+        q = q.filter(user_id=user_id, feed_id=feed_id)
         try:
             user_feed = q.get()
         except UserFeed.DoesNotExist:
             raise StoryNotFoundError()
-        return user_feed.id
+        return user_feed
 
     @staticmethod
     def get_by_id(story_unionid, detail=False):
-        user_feed_id = UnionStory._check_user_feed_by_story_unionid(
+        user_feed = UnionStory._check_user_feed_by_story_unionid(
             story_unionid
         )
+        user_feed_id = user_feed.id
         user_id, feed_id, offset = story_unionid
         q = UserStory.objects.select_related('story')
         q = q.filter(user_id=user_id, feed_id=feed_id, offset=offset)
@@ -180,7 +181,12 @@ class UnionStory:
             user_story = q.get()
         except UserStory.DoesNotExist:
             user_story = None
-            story = STORY_SERVICE.get_by_offset(feed_id, offset, detail=detail)
+            story = STORY_SERVICE.get_by_offset(
+                feed_id,
+                offset,
+                detail=detail,
+                legacy=not user_feed.feed.is_story_migrated,
+            )
             if not story:
                 raise StoryNotFoundError()
         else:
@@ -230,50 +236,6 @@ class UnionStory:
             )
         return ret
 
-    @classmethod
-    def _query_storys_by_feed(cls, feed_id, offset, size, detail):
-        q = Story.objects.filter(feed_id=feed_id, offset__gte=offset)
-        detail = Detail.from_schema(detail, StoryDetailSchema)
-        q = q.defer(*detail.exclude_fields)
-        q = q.order_by('offset')[:size]
-        storys = list(q.all())
-        return storys
-
-    @classmethod
-    def _query_storys_by_story_service(cls, feed_id, offset, size, detail):
-        begin_id = StoryId.encode(feed_id, offset)
-        end_id = StoryId.encode(feed_id, offset + size - 1)
-        q = StoryInfo.objects.filter(pk__gte=begin_id, pk__lte=end_id)
-        if not detail:
-            q = q.defer(*STORY_INFO_DETAIL_FEILDS)
-        story_info_s = list(q.all())
-        storys = [STORY_SERVICE.to_common(x) for x in story_info_s]
-        return storys
-
-    @classmethod
-    def _query_user_storys_by_offset(cls, user_id, feed_id, offset_s):
-        q = UserStory.objects.filter(
-            user_id=user_id, feed_id=feed_id, offset__in=offset_s
-        )
-        q = q.exclude(is_favorited=False, is_watched=False)
-        user_storys = list(q.all())
-        return user_storys
-
-    @classmethod
-    def _query_storys(cls, feed_id, offset, size, detail):
-        storys = cls._query_storys_by_story_service(
-            feed_id, offset, size, detail=detail
-        )
-        got_offset_s = set(x.offset for x in storys)
-        if len(storys) < size:
-            for story in cls._query_storys_by_feed(
-                feed_id, offset, size, detail=detail
-            ):
-                if story.offset not in got_offset_s:
-                    storys.append(story)
-        storys = list(sorted(storys, key=lambda x: x.offset))
-        return storys
-
     @classmethod
     def query_by_feed(
         cls,
@@ -289,7 +251,12 @@ class UnionStory:
         if only_publish:
             q = q.filter(is_publish=True)
         q = q.only(
-            'id', 'story_offset', 'feed_id', 'feed__id', 'feed__total_storys'
+            'id',
+            'story_offset',
+            'feed_id',
+            'feed__id',
+            'feed__total_storys',
+            'feed__is_story_migrated',
         )
         try:
             user_feed = q.get()
@@ -298,12 +265,15 @@ class UnionStory:
         total = user_feed.feed.total_storys
         if offset is None:
             offset = user_feed.story_offset
-        if offset + size > total:
-            size = total - offset
-        storys = cls._query_storys(feed_id, offset, size, detail=detail)
-        offset_s = [x.offset for x in storys]
-        user_storys = cls._query_user_storys_by_offset(
-            user_id, feed_id, offset_s
+        # storys may be missing in the range, eg: deleted by retention
+        size = max(0, min(size, total - offset))
+        storys, user_storys = STORY_SERVICE.query_page(
+            feed_id,
+            offset,
+            size,
+            user_id=user_id,
+            detail=detail,
+            legacy=not user_feed.feed.is_story_migrated,
         )
         ret = UnionStory._merge_storys(
             storys,
@@ -312,7 +282,7 @@ class UnionStory:
             user_id=user_id,
             detail=detail,
         )
-        return total, offset, ret
+        return total, offset, size, ret
 
     @classmethod
     def query_recent_by_user(
@@ -401,6 +371,16 @@ class UnionStory:
         verified_story_keys = list(sorted(verified_story_keys))
         return verified_story_keys
 
+    @staticmethod
+    def _exclude_story_migrated(story_keys):
+        """exclude storys of feeds which not need fallback to legacy Story"""
+        if not story_keys:
+            return []
+        feed_ids = list(set(x[0] for x in story_keys))
+        q = Feed.objects.filter(id__in=feed_ids, is_story_migrated=True)
+        migrated_feed_ids = set(q.values_list('id', flat=True))
+        return [x for x in story_keys if x[0] not in migrated_feed_ids]
+
     @classmethod
     def _batch_get_story_infos(cls, story_keys, detail):
         story_info_s = StoryInfo.batch_get(story_keys, detail=detail)
@@ -418,6 +398,7 @@ class UnionStory:
         storys = cls._batch_get_story_infos(story_keys, detail=detail)
         finish_story_keys = set((x.feed_id, x.offset) for x in storys)
         remain_story_keys = list(sorted(set(story_keys) - finish_story_keys))
+        remain_story_keys = cls._exclude_story_migrated(remain_story_keys)
         if remain_story_keys:
             storys.extend(
                 Story.batch_get_by_offset(remain_story_keys, detail=detail)
@@ -0,0 +1,229 @@
+import typing
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .helper import Model, models, optional
+
+# user is active if has reading record in these days
+USER_ACTIVE_DAYS = 90
+# not update dt_last_active more often than this
+_TOUCH_INTERVAL = timezone.timedelta(hours=1)
+
+
+class UserActivity(Model):
+    """
+    user_id -> last activity, maintained on UnionFeed write paths
+    """
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['dt_last_active'],
+                condition=models.Q(is_active=True),
+                name='rssant_api_user_active',
+            ),
+        ]
+
+    id = models.PositiveIntegerField(primary_key=True, help_text='user id')
+    dt_last_active = models.DateTimeField(**optional, help_text="last read or edit time")
+    is_active = models.BooleanField(default=False, help_text="active in USER_ACTIVE_DAYS")
+    feed_count = models.IntegerField(default=0, help_text="number of subscribed feeds")
+
+    @staticmethod
+    def touch(user_id: int, now: timezone.datetime = None) -> bool:
+        """Record user activity, return True if the user become active"""
+        if now is None:
+            now = timezone.now()
+        sql = """
+        WITH prev AS (
+            SELECT id, is_active FROM rssant_api_useractivity
+            WHERE id = %(user_id)s FOR UPDATE
+        ), upsert AS (
+            INSERT INTO rssant_api_useractivity AS ua
+                (id, dt_last_active, is_active, feed_count, _version, _created, _updated)
+            VALUES (%(user_id)s, %(now)s, TRUE, 0, 1, NOW(), NOW())
+            ON CONFLICT (id) DO UPDATE
+            SET dt_last_active = EXCLUDED.dt_last_active, is_active = TRUE,
+                _version = ua._version + 1, _updated = NOW()
+            WHERE NOT ua.is_active OR ua.dt_last_active IS NULL
+                OR ua.dt_last_active < %(dt_touch)s
+        )
+        SELECT is_active FROM prev
+        """
+        params = dict(user_id=user_id, now=now, dt_touch=now - _TOUCH_INTERVAL)
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(sql, params)
+                row = cursor.fetchone()
+                is_become_active = not (row and row[0])
+                if is_become_active:
+                    FeedSubscriberStat.incr_active_by_user(user_id, 1)
+        return is_become_active
+
+    @staticmethod
+    def _incr_feed_count(user_id: int, delta: int) -> bool:
+        """Update feed_count, return whether the user is active"""
+        sql = """
+        INSERT INTO rssant_api_useractivity AS ua
+            (id, dt_last_active, is_active, feed_count, _version, _created, _updated)
+        VALUES (%(user_id)s, NULL, FALSE, GREATEST(%(delta)s, 0), 1, NOW(), NOW())
+        ON CONFLICT (id) DO UPDATE
+        SET feed_count = GREATEST(ua.feed_count + %(delta)s, 0),
+            _version = ua._version + 1, _updated = NOW()
+        RETURNING is_active
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(sql, dict(user_id=user_id, delta=delta))
+            return bool(cursor.fetchone()[0])
+
+    @classmethod
+    def on_subscribe(cls, user_id: int, feed_ids: typing.List[int]):
+        feed_ids = list(feed_ids)
+        if not feed_ids:
+            return
+        with transaction.atomic():
+            is_active = cls._incr_feed_count(user_id, len(feed_ids))
+            FeedSubscriberStat.incr(feed_ids, 1, 1 if is_active else 0)
+
+    @classmethod
+    def on_unsubscribe(cls, user_id: int, feed_ids: typing.List[int]):
+        feed_ids = list(feed_ids)
+        if not feed_ids:
+            return
+        with transaction.atomic():
+            is_active = cls._incr_feed_count(user_id, -len(feed_ids))
+            FeedSubscriberStat.incr(feed_ids, -1, -1 if is_active else 0)
+
+    @staticmethod
+    def on_feed_merge(feed_id: int, other_feed_id: int, user_ids: typing.List[int]):
+        """Move subscribers of other feed to the feed, feed_count not changed"""
+        user_ids = list(user_ids)
+        if not user_ids:
+            return
+        num_active = UserActivity.objects\
+            .filter(id__in=user_ids, is_active=True).count()
+        with transaction.atomic():
+            FeedSubscriberStat.incr([feed_id], len(user_ids), num_active)
+            FeedSubscriberStat.incr([other_feed_id], -len(user_ids), -num_active)
+
+    @staticmethod
+    def expire_inactive() -> typing.List[int]:
+        """Mark users inactive after USER_ACTIVE_DAYS, return affected feed ids"""
+        sql = f"""
+        WITH expired AS (
+            UPDATE rssant_api_useractivity
+            SET is_active = FALSE, _version = _version + 1, _updated = NOW()
+            WHERE is_active AND dt_last_active < NOW() - INTERVAL '{USER_ACTIVE_DAYS} days'
+            RETURNING id
+        ), t AS (
+            SELECT feed_id, COUNT(1) AS num_users
+            FROM rssant_api_userfeed
+            WHERE user_id IN (SELECT id FROM expired)
+            GROUP BY feed_id
+        )
+        UPDATE rssant_api_feedsubscriberstat AS stat
+        SET active_user_count = GREATEST(stat.active_user_count - t.num_users, 0),
+            _version = stat._version + 1, _updated = NOW()
+        FROM t
+        WHERE stat.id = t.feed_id
+        RETURNING stat.id
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(sql)
+            return [x[0] for x in cursor.fetchall()]
+
+    @staticmethod
+    def rebuild():
+        """Rebuild user activity and feed subscriber stat from userfeed"""
+        sql_user = f"""
+        WITH t AS (
+            SELECT user_id, MAX(dt_updated) AS dt_last_active, COUNT(1) AS feed_count
+            FROM rssant_api_userfeed GROUP BY user_id
+        )
+        INSERT INTO rssant_api_useractivity AS ua
+            (id, dt_last_active, is_active, feed_count, _version, _created, _updated)
+        SELECT user_id, dt_last_active,
+            COALESCE(dt_last_active >= NOW() - INTERVAL '{USER_ACTIVE_DAYS} days', FALSE),
+            feed_count, 1, NOW(), NOW()
+        FROM t
+        ON CONFLICT (id) DO UPDATE
+        SET dt_last_active = GREATEST(ua.dt_last_active, EXCLUDED.dt_last_active),
+            is_active = COALESCE(GREATEST(ua.dt_last_active, EXCLUDED.dt_last_active)
+                >= NOW() - INTERVAL '{USER_ACTIVE_DAYS} days', FALSE),
+            feed_count = EXCLUDED.feed_count,
+            _version = ua._version + 1, _updated = NOW()
+        """
+        sql_user_empty = """
+        UPDATE rssant_api_useractivity AS ua
+        SET feed_count = 0, _version = ua._version + 1, _updated = NOW()
+        WHERE ua.feed_count != 0 AND NOT EXISTS (
+            SELECT 1 FROM rssant_api_userfeed WHERE user_id = ua.id
+        )
+        """
+        sql_feed = """
+        WITH t AS (
+            SELECT feed_id, COUNT(1) AS user_count,
+                SUM(CASE WHEN ua.is_active THEN 1 ELSE 0 END) AS active_user_count
+            FROM rssant_api_userfeed AS userfeed
+            LEFT OUTER JOIN rssant_api_useractivity AS ua ON ua.id = userfeed.user_id
+            GROUP BY feed_id
+        )
+        INSERT INTO rssant_api_feedsubscriberstat AS stat
+            (id, user_count, active_user_count, _version, _created, _updated)
+        SELECT feed_id, user_count, active_user_count, 1, NOW(), NOW()
+        FROM t
+        ON CONFLICT (id) DO UPDATE
+        SET user_count = EXCLUDED.user_count,
+            active_user_count = EXCLUDED.active_user_count,
+            _version = stat._version + 1, _updated = NOW()
+        """
+        sql_feed_empty = """
+        DELETE FROM rssant_api_feedsubscriberstat AS stat
+        WHERE NOT EXISTS (
+            SELECT 1 FROM rssant_api_userfeed WHERE feed_id = stat.id
+        )
+        """
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                for sql in [sql_user, sql_user_empty, sql_feed, sql_feed_empty]:
+                    cursor.execute(sql)
+
+
+class FeedSubscriberStat(Model):
+    """
+    feed_id -> subscriber count, maintained on UnionFeed write paths
+    """
+
+    id = models.PositiveIntegerField(primary_key=True, help_text='feed id')
+    user_count = models.IntegerField(default=0, help_text="number of subscribers")
+    active_user_count = models.IntegerField(default=0, help_text="number of active subscribers")
+
+    @staticmethod
+    def incr(feed_ids: typing.List[int], user_delta: int, active_delta: int):
+        sql = """
+        INSERT INTO rssant_api_feedsubscriberstat AS stat
+            (id, user_count, active_user_count, _version, _created, _updated)
+        SELECT id, GREATEST(%(user_delta)s, 0), GREATEST(%(active_delta)s, 0), 1, NOW(), NOW()
+        FROM unnest(%(feed_ids)s::integer[]) AS id
+        ON CONFLICT (id) DO UPDATE
+        SET user_count = GREATEST(stat.user_count + %(user_delta)s, 0),
+            active_user_count = GREATEST(stat.active_user_count + %(active_delta)s, 0),
+            _version = stat._version + 1, _updated = NOW()
+        """
+        params = dict(feed_ids=list(feed_ids), user_delta=user_delta, active_delta=active_delta)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+    @staticmethod
+    def incr_active_by_user(user_id: int, active_delta: int):
+        """Update active_user_count of all feeds subscribed by the user"""
+        sql = """
+        UPDATE rssant_api_feedsubscriberstat AS stat
+        SET active_user_count = GREATEST(stat.active_user_count + %(active_delta)s, 0),
+            _version = stat._version + 1, _updated = NOW()
+        FROM rssant_api_userfeed AS userfeed
+        WHERE userfeed.user_id = %(user_id)s AND stat.id = userfeed.feed_id
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(sql, dict(user_id=user_id, active_delta=active_delta))
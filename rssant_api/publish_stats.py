@@ -0,0 +1,171 @@
+import datetime
+import struct
+import typing
+
+# stories published before this window not count, eg: history of new feed
+_WINDOW_SECONDS = 90 * 24 * 60 * 60
+# bounds of a sample of interval between two stories
+_MIN_INTERVAL = 60
+_MAX_INTERVAL = 30 * 24 * 60 * 60
+# weight of new interval sample in exponential moving average
+_ALPHA = 0.3
+# min number of interval samples to predict
+_MIN_SAMPLES = 3
+# check about 4 times per expected interval
+_CHECKS_PER_INTERVAL = 4
+# hour of day counters are halved when any of them exceed this value
+_MAX_HOUR_COUNT = 255
+# feed is considered publish at specific hours if active hours not exceed it
+_MAX_ACTIVE_HOURS = 16
+_MAX_COUNT = 65535
+
+
+class PublishStats:
+    """
+    Publication history of a feed, used to predict when to check next.
+
+    +---------+---------------+---------------+--------------+-------------+
+    | 1 byte  |   24 * 1 byte |    4 byte     |    4 byte    |   2 byte    |
+    +---------+---------------+---------------+--------------+-------------+
+    | version | hour counts   | ewma interval | last publish | num samples |
+    +---------+---------------+---------------+--------------+-------------+
+
+    Hours are in UTC, interval and timestamp are seconds.
+
+    >>> stats = PublishStats()
+    >>> base = datetime.datetime(2020, 1, 1, 8, 0, tzinfo=datetime.timezone.utc)
+    >>> stats.update([base + datetime.timedelta(days=i) for i in range(7)], now=base + datetime.timedelta(days=7))
+    >>> stats.interval
+    86400
+    >>> now = base + datetime.timedelta(days=7, hours=2)
+    >>> stats.predict_check_seconds(now, check_seconds=1800, max_seconds=86400)
+    75600
+    >>> now = base + datetime.timedelta(days=7, minutes=10)
+    >>> stats.predict_check_seconds(now, check_seconds=1800, max_seconds=86400)
+    1800
+    >>> PublishStats.load(stats.dump()) == stats
+    True
+    """
+
+    _FORMAT = struct.Struct('>B24BIIH')
+    _VERSION = 1
+
+    __slots__ = ('hours', 'interval', 'last_published', 'num_samples')
+
+    def __init__(self):
+        self.hours = [0] * 24
+        self.interval = 0
+        self.last_published = 0
+        self.num_samples = 0
+
+    def __eq__(self, other):
+        return isinstance(other, PublishStats) and self._values() == other._values()
+
+    def __repr__(self):
+        return '<{} interval={} samples={} active_hours={}>'.format(
+            type(self).__name__, self.interval, self.num_samples, self._active_hours())
+
+    def _values(self) -> tuple:
+        return (*self.hours, self.interval, self.last_published, self.num_samples)
+
+    def dump(self) -> bytes:
+        return self._FORMAT.pack(self._VERSION, *self._values())
+
+    @classmethod
+    def load(cls, data: bytes) -> "PublishStats":
+        """Load from dumped data, return empty stats if data invalid"""
+        stats = cls()
+        if not data:
+            return stats
+        # BinaryField value may be memoryview
+        data = bytes(data)
+        if len(data) != cls._FORMAT.size or data[0] != cls._VERSION:
+            return stats
+        values = cls._FORMAT.unpack(data)[1:]
+        stats.hours = list(values[:24])
+        stats.interval, stats.last_published, stats.num_samples = values[24:]
+        return stats
+
+    def _add_hour(self, hour: int):
+        if self.hours[hour] >= _MAX_HOUR_COUNT:
+            # decay old history
+            self.hours = [x // 2 for x in self.hours]
+        self.hours[hour] += 1
+
+    def _add_interval(self, seconds: float):
+        seconds = min(max(seconds, _MIN_INTERVAL), _MAX_INTERVAL)
+        if self.num_samples <= 0:
+            interval = seconds
+        else:
+            interval = _ALPHA * seconds + (1 - _ALPHA) * self.interval
+        self.interval = round(interval)
+        self.num_samples = min(_MAX_COUNT, self.num_samples + 1)
+
+    def update(self, dt_published_s: typing.List[datetime.datetime], now: datetime.datetime):
+        """Update by publish time of new stories"""
+        now_ts = now.timestamp()
+        begin_ts = now_ts - _WINDOW_SECONDS
+        timestamps = []
+        for dt in dt_published_s:
+            if dt is None:
+                continue
+            ts = int(dt.timestamp())
+            if begin_ts <= ts <= now_ts + _MIN_INTERVAL:
+                timestamps.append(ts)
+        for ts in sorted(timestamps):
+            # stories published earlier than the latest one are out of order
+            if ts <= self.last_published:
+                continue
+            hour = datetime.datetime.fromtimestamp(ts, tz=datetime.timezone.utc).hour
+            self._add_hour(hour)
+            if self.last_published > 0:
+                self._add_interval(ts - self.last_published)
+            self.last_published = ts
+
+    def _active_hours(self) -> typing.Set[int]:
+        """Hours which published stories, and their neighbors"""
+        active = set()
+        for hour, count in enumerate(self.hours):
+            if count > 0:
+                active.update(((hour - 1) % 24, hour, (hour + 1) % 24))
+        return active
+
+    @staticmethod
+    def _seconds_until_hour(now: datetime.datetime, active: typing.Set[int]) -> int:
+        now = now.astimezone(datetime.timezone.utc)
+        hour_begin = now.replace(minute=0, second=0, microsecond=0)
+        for i in range(1, 25):
+            if (now.hour + i) % 24 in active:
+                target = hour_begin + datetime.timedelta(hours=i)
+                return int((target - now).total_seconds())
+        return 0
+
+    def predict_check_seconds(
+        self,
+        now: datetime.datetime,
+        check_seconds: int,
+        min_seconds: int = None,
+        max_seconds: int = None,
+    ) -> typing.Optional[int]:
+        """
+        Predict seconds to next check, or None if not enough history.
+        """
+        if self.num_samples < _MIN_SAMPLES or self.interval <= 0:
+            return None
+        if min_seconds is None:
+            min_seconds = check_seconds // 6
+        if max_seconds is None:
+            max_seconds = check_seconds * 48
+        seconds = self.interval / _CHECKS_PER_INTERVAL
+        # the feed is slower than history, back off
+        elapsed = now.timestamp() - self.last_published
+        if elapsed > 2 * self.interval:
+            seconds *= elapsed / (2 * self.interval)
+        active = self._active_hours()
+        if len(active) <= _MAX_ACTIVE_HOURS:
+            now_hour = now.astimezone(datetime.timezone.utc).hour
+            if now_hour in active:
+                seconds = min(seconds, check_seconds)
+            else:
+                seconds = self._seconds_until_hour(now, active)
+        return round(min(max(seconds, min_seconds), max_seconds))
@@ -3,7 +3,12 @@ from django.utils import timezone
 from django.test import TestCase
 from django.contrib.auth.models import User
 
-from rssant_api.models import Feed, FeedStatus, UnionFeed, FeedUrlMap, FeedCreation, FeedImportItem, UserFeed
+from rssant_api.models.feed import CHECK_FEED_SECONDS
+from rssant_api.publish_stats import PublishStats
+from rssant_api.models import (
+    Feed, FeedStatus, UnionFeed, FeedUrlMap, FeedCreation, FeedImportItem, UserFeed, FeedFreezeTask,
+    UserActivity, FeedSubscriberStat,
+)
 from rssant_api.feed_helper import render_opml
 from rssant_feedlib.importer import import_feed_from_text
 
@@ -34,6 +39,134 @@ class FeedSimpleTestCase(TestCase):
         outdated2 = Feed.take_outdated_feeds()
         self.assertEqual(len(outdated2), 0)
 
+    def test_find_duplicate_feeds(self):
+        found, dedup_keys = Feed.find_duplicate_feeds()
+        self.assertEqual(found, [])
+        self.assertEqual(dedup_keys, {self._feed.id: 'com.example.blog!/feed.xml'})
+        Feed.save_dedup_keys(dedup_keys)
+        self.assertEqual(Feed.find_duplicate_feeds(), ([], {}))
+        feed_ids = []
+        for url in ['http://blog.example.com/feed.xml', 'https://blog.example.com:8443/feed.xml']:
+            feed = Feed(url=url, status=FeedStatus.READY, dt_updated=timezone.now())
+            feed.save()
+            feed_ids.append(feed.id)
+        found, dedup_keys = Feed.find_duplicate_feeds(limit=1)
+        self.assertEqual(found, [(self._feed.id, feed_ids[0])])
+        Feed.save_dedup_keys(dedup_keys)
+        found, dedup_keys = Feed.find_duplicate_feeds()
+        self.assertEqual(found, [])
+        self.assertEqual(dedup_keys, {feed_ids[1]: ''})
+
+    def test_dt_next_check(self):
+        Feed.take_outdated_feeds(timeout_seconds=600)
+        feed = Feed.get_by_pk(self._feed.id)
+        self.assertEqual(feed.status, FeedStatus.PENDING)
+        self.assertEqual(feed.dt_next_check - feed.dt_checked, timezone.timedelta(seconds=600))
+        feed.status = FeedStatus.READY
+        feed.freeze_level = 4
+        feed.fetch_interval_factor = 2
+        feed.dt_next_check = feed.compute_dt_next_check(check_seconds=60)
+        feed.save()
+        delta = (feed.dt_next_check - feed.dt_checked).total_seconds()
+        self.assertTrue(480 <= delta <= 480 * 1.1)
+        Feed.unfreeze_by_ids([feed.id], check_seconds=60)
+        feed = Feed.get_by_pk(self._feed.id)
+        self.assertEqual(feed.freeze_level, 1)
+        delta = (feed.dt_next_check - feed.dt_checked).total_seconds()
+        self.assertTrue(120 <= delta <= 120 * 1.1)
+        Feed.refresh_freeze_level()
+        feed = Feed.get_by_pk(self._feed.id)
+        # no subscriber, freeze_level is 31 * 24
+        self.assertEqual(feed.freeze_level, 31 * 24)
+        delta = (feed.dt_next_check - feed.dt_checked).total_seconds()
+        self.assertTrue(delta >= 31 * 24 * 2 * CHECK_FEED_SECONDS)
+        self.assertEqual(len(Feed.take_outdated_feeds()), 0)
+
+    def test_freeze_task(self):
+        feed_id = self._feed.id
+        FeedFreezeTask.enqueue([feed_id, feed_id])
+        FeedFreezeTask.enqueue([feed_id])
+        self.assertEqual(FeedFreezeTask.take(), [feed_id])
+        self.assertEqual(FeedFreezeTask.take(), [])
+        Feed.refresh_freeze_level([feed_id])
+        self.assertEqual(Feed.get_by_pk(feed_id).freeze_level, 31 * 24)
+        user = User.objects.create_user('tester', email=None, password='test123456')
+        UserFeed(user=user, feed=self._feed).save()
+        UserActivity.on_subscribe(user.id, [feed_id])
+        Feed.refresh_freeze_level([feed_id])
+        # subscribed by inactive user
+        self.assertEqual(Feed.get_by_pk(feed_id).freeze_level, 3 * 24)
+        self.assertTrue(UserActivity.touch(user.id))
+        self.assertFalse(UserActivity.touch(user.id))
+        FeedFreezeTask.enqueue_by_user(user.id)
+        feed_ids = FeedFreezeTask.take()
+        self.assertEqual(feed_ids, [feed_id])
+        Feed.refresh_freeze_level(feed_ids)
+        self.assertEqual(Feed.get_by_pk(feed_id).freeze_level, 1)
+        Feed.refresh_freeze_level([])
+
+    def test_user_activity(self):
+        feed_id = self._feed.id
+        user = User.objects.create_user('tester', email=None, password='test123456')
+        UserFeed(user=user, feed=self._feed).save()
+        UserActivity.on_subscribe(user.id, [feed_id])
+        UserActivity.touch(user.id, now=timezone.now() - timezone.timedelta(days=100))
+        stat = FeedSubscriberStat.objects.get(pk=feed_id)
+        self.assertEqual((stat.user_count, stat.active_user_count), (1, 1))
+        self.assertEqual(UserActivity.expire_inactive(), [feed_id])
+        self.assertEqual(UserActivity.expire_inactive(), [])
+        stat = FeedSubscriberStat.objects.get(pk=feed_id)
+        self.assertEqual((stat.user_count, stat.active_user_count), (1, 0))
+        UserFeed.objects.filter(user=user).delete()
+        UserActivity.on_unsubscribe(user.id, [feed_id])
+        stat = FeedSubscriberStat.objects.get(pk=feed_id)
+        self.assertEqual((stat.user_count, stat.active_user_count), (0, 0))
+        self.assertEqual(UserActivity.objects.get(pk=user.id).feed_count, 0)
+        UserActivity.rebuild()
+        self.assertFalse(FeedSubscriberStat.objects.filter(pk=feed_id).exists())
+        self.assertFalse(UserActivity.objects.get(pk=user.id).is_active)
+
+    def test_merge_subscriber_stat(self):
+        feed_id = self._feed.id
+        other = Feed(
+            title='test feed',
+            url='https://blog.example.com/feed.atom',
+            status=FeedStatus.READY,
+            dt_updated=timezone.now(),
+        )
+        other.save()
+        user = User.objects.create_user('tester', email=None, password='test123456')
+        UserFeed(user=user, feed=other).save()
+        UserActivity.on_subscribe(user.id, [other.id])
+        UserActivity.touch(user.id)
+        user_ids = Feed.get_by_pk(feed_id).merge(other)
+        self.assertEqual(user_ids, [user.id])
+        UserActivity.on_feed_merge(feed_id, other.id, user_ids)
+        stat = FeedSubscriberStat.objects.get(pk=feed_id)
+        self.assertEqual((stat.user_count, stat.active_user_count), (1, 1))
+        stat = FeedSubscriberStat.objects.get(pk=other.id)
+        self.assertEqual((stat.user_count, stat.active_user_count), (0, 0))
+        self.assertEqual(UserFeed.objects.get(user=user).feed_id, feed_id)
+
+    def test_predict_dt_next_check(self):
+        feed = Feed.get_by_pk(self._feed.id)
+        feed.dt_checked = timezone.now()
+        stats = PublishStats()
+        dt_published_s = [feed.dt_checked - timezone.timedelta(minutes=20 * i) for i in range(10)]
+        stats.update(dt_published_s, now=feed.dt_checked)
+        feed.publish_stats = stats
+        feed.save()
+        feed = Feed.get_by_pk(self._feed.id)
+        self.assertEqual(feed.publish_stats.interval, 20 * 60)
+        # publish every 20 minutes, check every 5 minutes
+        feed.freeze_level = 4
+        delta = (feed.compute_dt_next_check(check_seconds=1800) - feed.dt_checked).total_seconds()
+        self.assertTrue(300 <= delta <= 300 * 1.1)
+        # no active users, ignore publish stats
+        feed.freeze_level = 31 * 24
+        delta = (feed.compute_dt_next_check(check_seconds=60) - feed.dt_checked).total_seconds()
+        self.assertTrue(delta >= 31 * 24 * 60)
+
 
 @pytest.mark.dbtest
 class FeedImportTestCase(TestCase):
@@ -46,3 +46,18 @@ class PostgresStoryStorageTestCase(TestCase):
         storage.delete_content(feed_id, 234)
         got = storage.get_content(feed_id, 234)
         assert got is None
+
+    def test_story_storage_range(self):
+        storage = PostgresStoryStorage(self.client)
+        for feed_id in FEED_IDS:
+            items = [((feed_id, offset), f'content {offset}') for offset in range(10)]
+            storage.batch_save_content(items)
+            storage.save_content(feed_id + 1, 0, 'next feed')
+            assert storage.get_range(feed_id, 3, 6) == items[3:6]
+            assert storage.get_range(feed_id, 3, limit=2) == items[3:5]
+            assert list(storage.scan_feed(feed_id, batch_size=3)) == items
+            storage.batch_delete_range([(feed_id, 0, 3), (feed_id, 8, None)])
+            assert list(storage.scan_feed(feed_id, batch_size=5)) == items[3:8]
+            storage.delete_range(feed_id, 0)
+            assert storage.get_range(feed_id, 0) == []
+            assert storage.get_content(feed_id + 1, 0) == 'next feed'
@@ -1,11 +1,12 @@
 import pytest
 from django.utils import timezone
 from django.test import TransactionTestCase
+from django.contrib.auth.models import User
 from validr import T
 
 from rssant_common.validator import compiler
-from rssant_api.models import Feed, FeedStatus
-from rssant_api.models import STORY_SERVICE, Story, StoryInfo
+from rssant_api.models import Feed, FeedStatus, UserFeed, UserStory, FeedFreezeTask, FeedMonthlyStoryCount
+from rssant_api.models import STORY_SERVICE, Story, StoryInfo, UnionStory
 from rssant.helper.content_hash import compute_hash_base64
 
 
@@ -124,6 +125,58 @@ class StoryTestCase(TransactionTestCase):
         self.assert_feed_total_storys(60)
         self.assert_total_story_infos(50)
 
+    def test_query_page(self):
+        Story.bulk_save_by_feed(self.feed_id, self.storys[:30], batch_size=10)
+        STORY_SERVICE.bulk_save_by_feed(self.feed_id, self.updated_storys[10:50], batch_size=10)
+        user = User.objects.create_user('tester', email=None, password='test123456')
+        user_feed = UserFeed(user=user, feed_id=self.feed_id)
+        user_feed.save()
+        story = Story.get_by_offset(self.feed_id, 12)
+        UserStory(
+            user=user, story=story, feed_id=self.feed_id, user_feed=user_feed,
+            offset=12, is_favorited=True,
+        ).save()
+        storys, user_storys = STORY_SERVICE.query_page(
+            self.feed_id, 5, 10, user_id=user.id, detail=True)
+        self.assertEqual([x.offset for x in storys], list(range(5, 15)))
+        self.assertEqual(storys[0].content, self.storys[5]['content'])
+        self.assertEqual(storys[7].content, self.updated_storys[12]['content'])
+        self.assertEqual([(x.offset, x.is_favorited) for x in user_storys], [(12, True)])
+        storys, user_storys = STORY_SERVICE.query_page(
+            self.feed_id, 40, 20, user_id=user.id)
+        self.assertEqual([x.offset for x in storys], list(range(40, 50)))
+        self.assertFalse(storys[0].content)
+        self.assertEqual(user_storys, [])
+
+    def test_migrate_legacy_storys(self):
+        Story.bulk_save_by_feed(self.feed_id, self.storys[:30], batch_size=10)
+        STORY_SERVICE.bulk_save_by_feed(self.feed_id, self.updated_storys[20:40], batch_size=10)
+        self.assertFalse(Feed.get_by_pk(self.feed_id).is_story_migrated)
+        self.assert_total_story_infos(20)
+        result = STORY_SERVICE.migrate_legacy_storys(self.feed_id, batch_size=7, delete_legacy=True)
+        self.assertEqual(result, (20, True))
+        self.assertTrue(Feed.get_by_pk(self.feed_id).is_story_migrated)
+        self.assert_total_story_infos(40)
+        self.assertEqual(Story.objects.filter(feed_id=self.feed_id).count(), 0)
+        story = STORY_SERVICE.get_by_offset(self.feed_id, 6, detail=True, legacy=False)
+        self.assertEqual(story.content, self.storys[6]['content'])
+        self.assertEqual(STORY_SERVICE.migrate_legacy_storys(self.feed_id), (0, True))
+
+    def test_feed_monthly_story_count(self):
+        STORY_SERVICE.bulk_save_by_feed(self.feed_id, self.storys[:30], batch_size=10)
+        Story.bulk_save_by_feed(self.feed_id, self.storys[30:50], batch_size=10)
+        counts = FeedMonthlyStoryCount.batch_get([self.feed_id])[self.feed_id]
+        self.assertEqual(str(counts), '202006:50')
+        self.assertEqual(FeedFreezeTask.take(), [self.feed_id])
+        FeedMonthlyStoryCount.refresh_dryness([self.feed_id])
+        feed = Feed.get_by_pk(self.feed_id)
+        self.assertEqual(feed.dryness, counts.dryness())
+        self.assertEqual(feed.monthly_story_count.get(2020, 6), 50)
+        FeedMonthlyStoryCount.rebuild(self.feed_id, legacy=False)
+        self.assertEqual(Feed.get_by_pk(self.feed_id).monthly_story_count.get(2020, 6), 30)
+        FeedMonthlyStoryCount.rebuild(self.feed_id)
+        self.assertEqual(Feed.get_by_pk(self.feed_id).monthly_story_count.get(2020, 6), 50)
+
     def test_bulk_save_by_feed_refresh(self):
         storys_0_20 = self.storys[:20]
         modified = STORY_SERVICE.bulk_save_by_feed(
@@ -155,8 +208,38 @@ class StoryTestCase(TransactionTestCase):
         story_10 = self.updated_storys[10]
         data = {k: story_10[k] for k in ['content', 'summary', 'dt_published']}
         STORY_SERVICE.update_story(self.feed_id, 10, data)
-        content_data = {'content': data['content']}
+        content_data = {'content': data['content'] + 'x' * 3000}
         STORY_SERVICE.update_story(self.feed_id, 10, content_data)
+        story = STORY_SERVICE.get_by_offset(self.feed_id, 10, detail=True)
+        assert story.content_length == len(content_data['content'])
+        assert story.get_content_info().length == len(content_data['content'])
+
+        metrics = {'text_length': 100, 'link_count': 2, 'sentence_count': 5}
+        STORY_SERVICE.update_story(self.feed_id, 10, metrics)
+        story = STORY_SERVICE.get_by_offset(self.feed_id, 10, detail=True)
+        content_info = story.get_content_info()
+        assert content_info.get_metrics() == dict(
+            text_length=100, link_count=2, sentence_count=5,
+            image_count=0, url_count=0,
+        )
+
+    def test_query_by_feed_below_retention(self):
+        STORY_SERVICE.bulk_save_by_feed(self.feed_id, self.storys[:50], batch_size=10)
+        STORY_SERVICE.batch_delete_by_retention([self.feed_id], retention=10, budget=100)
+        self.assertEqual(Feed.get_by_pk(self.feed_id).retention_offset, 40)
+        user = User.objects.create_user('tester', email=None, password='test123456')
+        UserFeed(user=user, feed_id=self.feed_id).save()
+        feed_unionid = (user.id, self.feed_id)
+        # page all below retention_offset
+        total, offset, size, storys = UnionStory.query_by_feed(feed_unionid, offset=0, size=10)
+        self.assertEqual((total, offset, size, storys), (50, 0, 10, []))
+        # page partly below retention_offset
+        total, offset, size, storys = UnionStory.query_by_feed(feed_unionid, offset=35, size=10)
+        self.assertEqual((offset, size), (35, 10))
+        self.assertEqual([x.offset for x in storys], list(range(40, 45)))
+        # page past total
+        total, offset, size, storys = UnionStory.query_by_feed(feed_unionid, offset=60, size=10)
+        self.assertEqual((size, storys), (0, []))
 
     def test_delete_by_retention(self):
         storys_0_30 = self.storys[:30]
@@ -183,6 +266,22 @@ class StoryTestCase(TransactionTestCase):
         self.assert_feed_total_storys(50)
         self.assert_total_story_infos(10)
 
+    def test_batch_delete_by_retention(self):
+        modified = STORY_SERVICE.bulk_save_by_feed(
+            self.feed_id, self.storys[:50], batch_size=10)
+        self.assertEqual(len(modified), 50)
+        self.assertEqual(Feed.take_retention_feeds(retention=10, limit=10)[0]['feed_id'], self.feed_id)
+
+        n = STORY_SERVICE.batch_delete_by_retention([self.feed_id], retention=10, budget=15)
+        self.assertEqual(n, 15)
+        self.assert_total_story_infos(35)
+        self.assertEqual(Feed.get_by_pk(self.feed_id).retention_offset, 15)
+
+        n = STORY_SERVICE.batch_delete_by_retention([self.feed_id], retention=10, budget=100)
+        self.assertEqual(n, 25)
+        self.assert_total_story_infos(10)
+        self.assertEqual(Feed.take_retention_feeds(retention=10, limit=10), [])
+
     def test_story_dt_and_content_length(self):
         dt = timezone.datetime(2019, 6, 1, 12, 12, 12, tzinfo=timezone.utc)
         story = {
@@ -60,6 +60,7 @@ StoryResultSchema = T.dict(
     total=T.int.optional,
     size=T.int.optional,
     offset=T.int.optional,
+    next_offset=T.int.optional,
     storys=T.list(StorySchema).maxlen(5000),
 )
 
@@ -83,7 +84,7 @@ def story_query_by_feed(
     user = require_publish_user(request)
     check_unionid(user, feed_id)
     try:
-        total, offset, storys = UnionStory.query_by_feed(
+        total, offset, query_size, storys = UnionStory.query_by_feed(
             feed_unionid=feed_id,
             offset=offset,
             size=size,
@@ -93,9 +94,12 @@ def story_query_by_feed(
     except FeedNotFoundError:
         return Response({"message": "feed does not exist"}, status=400)
     storys = [x.to_dict() for x in storys]
+    # next of the queried range, not of storys which may have gaps
+    next_offset = offset + query_size
     return dict(
         total=total,
         offset=offset,
+        next_offset=next_offset if next_offset < total else None,
         size=len(storys),
         storys=storys,
     )
@@ -4,6 +4,7 @@ from rssant_config import CONFIG
 from rssant_common.logger import configure_logging
 
 from .views import routes
+from .image_proxy import setup_image_proxy
 
 
 def create_app():
@@ -12,4 +13,5 @@ def create_app():
     api.router.add_routes(routes)
     app = web.Application()
     app.add_subapp('/api/v1', api)
+    setup_image_proxy(app)
     return app
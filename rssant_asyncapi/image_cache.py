@@ -0,0 +1,293 @@
+"""
+Content addressed disk cache for image proxy.
+
+Files layout, key is hash of image url:
+    {cache_dir}/{key[:2]}/{key}         image body
+    {cache_dir}/{key[:2]}/{key}.json    status, headers and expires time
+
+Index of all entries is kept in memory as LRU, files are removed when
+total size exceeds the byte budget. Methods which touch files are blocking,
+caller should run them in executor, index methods must run in event loop.
+"""
+import hashlib
+import json
+import logging
+import os
+import time
+import typing
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+
+LOG = logging.getLogger(__name__)
+
+# heuristic freshness for response without explicit expires, see RFC 7234 4.2.2
+_HEURISTIC_FRESHNESS_RATIO = 0.1
+_MAX_HEURISTIC_FRESHNESS = 24 * 60 * 60
+
+_META_SUFFIX = '.json'
+_TEMP_SUFFIX = '.tmp'
+
+
+def parse_cache_control(value: str) -> dict:
+    """
+    >>> parse_cache_control('public, max-age=3600, no-transform')
+    {'public': None, 'max-age': '3600', 'no-transform': None}
+    >>> parse_cache_control(None)
+    {}
+    """
+    result = {}
+    for part in (value or '').split(','):
+        name, sep, arg = part.strip().partition('=')
+        name = name.strip().lower()
+        if name:
+            result[name] = arg.strip().strip('"') if sep else None
+    return result
+
+
+def _parse_int(value) -> typing.Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_http_date(value) -> typing.Optional[float]:
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def is_vary_cacheable(vary: str) -> bool:
+    """
+    The cache is keyed by url only, response varies by request headers can not
+    be cached, except Accept-Encoding because encoded response is not cached.
+
+    >>> is_vary_cacheable(None)
+    True
+    >>> is_vary_cacheable('accept-encoding')
+    True
+    >>> is_vary_cacheable('Accept, Accept-Encoding')
+    False
+    >>> is_vary_cacheable('*')
+    False
+    """
+    for name in (vary or '').split(','):
+        name = name.strip().lower()
+        if name and name != 'accept-encoding':
+            return False
+    return True
+
+
+def get_expires_at(headers, now: float = None) -> typing.Optional[float]:
+    """
+    Get expires timestamp of response, return None if response can not be cached.
+
+    >>> get_expires_at({'Cache-Control': 'max-age=60'}, now=100)
+    160
+    >>> get_expires_at({'Cache-Control': 'max-age=60', 'Age': '10'}, now=100)
+    150
+    >>> get_expires_at({'Cache-Control': 'no-cache'}, now=100)
+    100
+    >>> get_expires_at({'Cache-Control': 'private'}, now=100) is None
+    True
+    >>> get_expires_at({'Cache-Control': 'max-age=60', 'Vary': 'Accept'}, now=100) is None
+    True
+    >>> get_expires_at({'Expires': 'Thu, 01 Jan 1970 00:01:40 GMT'}, now=0)
+    100.0
+    >>> get_expires_at({'Last-Modified': 'Thu, 01 Jan 1970 00:00:00 GMT'}, now=100)
+    110.0
+    """
+    if now is None:
+        now = time.time()
+    if not is_vary_cacheable(headers.get('Vary')):
+        return None
+    cache_control = parse_cache_control(headers.get('Cache-Control'))
+    if 'no-store' in cache_control or 'private' in cache_control:
+        return None
+    if 'no-cache' in cache_control:
+        return now
+    age = _parse_int(headers.get('Age')) or 0
+    max_age = _parse_int(cache_control.get('s-maxage'))
+    if max_age is None:
+        max_age = _parse_int(cache_control.get('max-age'))
+    if max_age is not None:
+        return now + max_age - age
+    expires = _parse_http_date(headers.get('Expires'))
+    if expires is not None:
+        return expires
+    last_modified = _parse_http_date(headers.get('Last-Modified'))
+    if last_modified is not None and last_modified < now:
+        freshness = (now - last_modified) * _HEURISTIC_FRESHNESS_RATIO
+        return now + min(freshness, _MAX_HEURISTIC_FRESHNESS)
+    return now
+
+
+class ImageCacheEntry:
+
+    __slots__ = ('key', 'url', 'size', 'expires_at', 'headers', 'filepath')
+
+    def __init__(self, key, url, size, expires_at, headers, filepath):
+        self.key = key
+        self.url = url
+        self.size = size
+        self.expires_at = expires_at
+        self.headers = headers
+        self.filepath = filepath
+
+    def __repr__(self):
+        return '<{} {} size={}>'.format(type(self).__name__, self.key, self.size)
+
+    def is_fresh(self, now: float = None) -> bool:
+        if now is None:
+            now = time.time()
+        return self.expires_at > now
+
+    def validator_headers(self) -> dict:
+        headers = {}
+        if self.headers.get('ETag'):
+            headers['If-None-Match'] = self.headers['ETag']
+        if self.headers.get('Last-Modified'):
+            headers['If-Modified-Since'] = self.headers['Last-Modified']
+        return headers
+
+    def to_meta(self) -> dict:
+        return dict(url=self.url, size=self.size,
+                    expires_at=self.expires_at, headers=self.headers)
+
+
+def _write_file(filepath, data: bytes):
+    temp_filepath = filepath + _TEMP_SUFFIX
+    with open(temp_filepath, 'wb') as f:
+        f.write(data)
+    os.replace(temp_filepath, filepath)
+
+
+def _remove_file(filepath):
+    try:
+        os.remove(filepath)
+    except FileNotFoundError:
+        pass
+
+
+class ImageDiskCache:
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+
+    def __repr__(self):
+        return '<{} {} size={} bytes={}>'.format(
+            type(self).__name__, self.cache_dir, self.size(), self._total_bytes)
+
+    def size(self) -> int:
+        return len(self._entries)
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    @staticmethod
+    def key_of(url: str) -> str:
+        return hashlib.blake2b(url.encode('utf-8'), digest_size=16).hexdigest()
+
+    def _filepath_of(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def _add(self, entry: ImageCacheEntry):
+        old = self._entries.pop(entry.key, None)
+        if old is not None:
+            self._total_bytes -= old.size
+        self._entries[entry.key] = entry
+        self._total_bytes += entry.size
+
+    def load(self):
+        """Rebuild index from cache dir, least recently written first. Blocking."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        items = []
+        for dirpath, __, filenames in os.walk(self.cache_dir):
+            filenames = set(filenames)
+            for filename in filenames:
+                filepath = os.path.join(dirpath, filename)
+                if filename.endswith(_TEMP_SUFFIX):
+                    _remove_file(filepath)
+                    continue
+                if filename.endswith(_META_SUFFIX):
+                    continue
+                meta_filepath = filepath + _META_SUFFIX
+                try:
+                    mtime = os.stat(meta_filepath).st_mtime
+                    with open(meta_filepath) as f:
+                        meta = json.load(f)
+                except (OSError, ValueError) as ex:
+                    LOG.info('remove broken image cache %s: %s', filepath, ex)
+                    _remove_file(filepath)
+                    _remove_file(meta_filepath)
+                    continue
+                entry = ImageCacheEntry(key=filename, filepath=filepath, **meta)
+                items.append((mtime, entry))
+            for filename in filenames:
+                if filename.endswith(_META_SUFFIX) and filename[:-len(_META_SUFFIX)] not in filenames:
+                    _remove_file(os.path.join(dirpath, filename))
+        items.sort(key=lambda x: x[0])
+        for __, entry in items:
+            self._add(entry)
+        for entry in self.evict():
+            self.remove_files(entry)
+        LOG.info('loaded %r', self)
+
+    def get(self, url: str) -> typing.Optional[ImageCacheEntry]:
+        key = self.key_of(url)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def discard(self, entry: ImageCacheEntry):
+        """Remove entry from index, files should be removed by remove_files"""
+        old = self._entries.get(entry.key)
+        if old is entry:
+            self._entries.pop(entry.key)
+            self._total_bytes -= entry.size
+
+    def add(self, entry: ImageCacheEntry) -> typing.List[ImageCacheEntry]:
+        """Add entry to index, return evicted entries which files should be removed"""
+        self._add(entry)
+        return self.evict()
+
+    def evict(self) -> typing.List[ImageCacheEntry]:
+        evicted = []
+        while self._entries and self._total_bytes > self.max_bytes:
+            __, entry = self._entries.popitem(last=False)
+            self._total_bytes -= entry.size
+            evicted.append(entry)
+        return evicted
+
+    def write_files(self, url: str, body: bytes, headers: dict, expires_at: float) -> ImageCacheEntry:
+        """Save image body and meta, return entry not added to index. Blocking."""
+        key = self.key_of(url)
+        filepath = self._filepath_of(key)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        entry = ImageCacheEntry(
+            key=key, url=url, size=len(body), expires_at=expires_at,
+            headers=headers, filepath=filepath)
+        _write_file(filepath, body)
+        # file modified time is used as Last-Modified when serve cached file
+        last_modified = _parse_http_date(headers.get('Last-Modified'))
+        if last_modified is not None:
+            os.utime(filepath, (last_modified, last_modified))
+        self.write_meta(entry)
+        return entry
+
+    def write_meta(self, entry: ImageCacheEntry):
+        """Save entry meta, eg: after revalidated. Blocking."""
+        data = json.dumps(entry.to_meta(), ensure_ascii=False).encode('utf-8')
+        _write_file(entry.filepath + _META_SUFFIX, data)
+
+    def remove_files(self, entry: ImageCacheEntry):
+        """Blocking"""
+        _remove_file(entry.filepath + _META_SUFFIX)
+        _remove_file(entry.filepath)
@@ -0,0 +1,139 @@
+"""
+Single flight for image proxy, concurrent requests of the same image url
+share one upstream fetch.
+
+The leader fetch from origin in background task and feed chunks into flight
+buffer, requests wait for response head then read chunks from the buffer. Buffered
+bytes of all flights are bounded, when exceeded, new flights will not be
+started and the overflowed flight will not accept new followers, the
+requests fallback to independent fetches.
+"""
+import asyncio
+import logging
+import typing
+
+LOG = logging.getLogger(__name__)
+
+
+class ImageFlightAborted(Exception):
+    """Leader not fetched image body, eg: served from cache, follower should fetch by self"""
+
+
+class ImageFlight:
+    def __init__(self, group: "ImageFlightGroup", key: typing.Hashable):
+        self._group = group
+        self.key = key
+        self.head = None
+        self.size = 0
+        self.num_followers = 0
+        self.is_done = False
+        self.is_complete = False
+        self._error = None
+        self._chunks = []
+        self._waiter = asyncio.get_event_loop().create_future()
+
+    def __repr__(self):
+        return '<{} {} size={} followers={}>'.format(
+            type(self).__name__, self.key, self.size, self.num_followers)
+
+    def _notify(self):
+        waiter = self._waiter
+        self._waiter = asyncio.get_event_loop().create_future()
+        if not waiter.done():
+            waiter.set_result(None)
+
+    async def _wait(self):
+        # shield waiter, it's shared by all followers
+        await asyncio.shield(self._waiter)
+
+    def set_head(self, head):
+        self.head = head
+        self._notify()
+
+    def feed(self, chunk: bytes):
+        self._chunks.append(chunk)
+        self.size += len(chunk)
+        self._group._on_feed(self, len(chunk))
+        self._notify()
+
+    def finish(self, error: Exception = None, is_complete: bool = False):
+        """
+        Finish the flight, error will be raised to followers if head not set,
+        the response of followers is complete only if is_complete.
+        """
+        if self.is_done:
+            return
+        self.is_done = True
+        self.is_complete = is_complete
+        if self.head is None:
+            self._error = error or ImageFlightAborted()
+        self._group._on_finish(self)
+        self._notify()
+
+    def iter_buffer(self) -> typing.Iterator[bytes]:
+        return iter(self._chunks)
+
+    async def wait_head(self):
+        while self.head is None:
+            if self._error is not None:
+                raise self._error
+            await self._wait()
+        return self.head
+
+    async def iter_chunks(self) -> typing.AsyncIterator[bytes]:
+        index = 0
+        while True:
+            while index < len(self._chunks):
+                yield self._chunks[index]
+                index += 1
+            if self.is_done:
+                break
+            await self._wait()
+
+
+class ImageFlightGroup:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._flights = {}
+        self._total_bytes = 0
+
+    def __repr__(self):
+        return '<{} size={} bytes={}>'.format(
+            type(self).__name__, len(self._flights), self._total_bytes)
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def join(self, key: typing.Hashable) -> typing.Optional[ImageFlight]:
+        """Join in-flight fetch as follower, return None if not exists"""
+        flight = self._flights.get(key)
+        if flight is not None:
+            flight.num_followers += 1
+        return flight
+
+    def start(self, key: typing.Hashable) -> typing.Optional[ImageFlight]:
+        """Start a flight as leader, return None if memory exceeded"""
+        if key in self._flights:
+            return None
+        if self._total_bytes >= self.max_bytes:
+            return None
+        flight = ImageFlight(self, key)
+        self._flights[key] = flight
+        return flight
+
+    def _detach(self, flight: ImageFlight):
+        if self._flights.get(flight.key) is flight:
+            self._flights.pop(flight.key)
+            self._total_bytes -= flight.size
+
+    def _on_feed(self, flight: ImageFlight, size: int):
+        if self._flights.get(flight.key) is not flight:
+            return
+        self._total_bytes += size
+        if self._total_bytes > self.max_bytes:
+            LOG.info('image flight buffer exceeded, detach %r', flight)
+            self._detach(flight)
+
+    def _on_finish(self, flight: ImageFlight):
+        self._detach(flight)
@@ -1,8 +1,12 @@
 import logging
 import asyncio
+import os
+import time
+from collections import namedtuple
+from urllib.parse import urlsplit
 
 import aiohttp
-from aiohttp.web import StreamResponse, json_response
+from aiohttp.web import FileResponse, StreamResponse, json_response
 from aiohttp import HttpVersion11
 
 from rssant_common.dns_service import DNS_SERVICE, PrivateAddressError
@@ -11,6 +15,15 @@ from rssant_common.useragent import DEFAULT_USER_AGENT
 from rssant_common.blacklist import compile_url_blacklist
 from rssant_config.env import CONFIG
 
+from .image_cache import ImageDiskCache, get_expires_at, is_vary_cacheable
+from .image_flight import ImageFlightAborted, ImageFlightGroup
+from .referer_strategy import (
+    RefererStrategyTable,
+    STRATEGY_REFERER,
+    STRATEGY_NO_REFERER,
+    STRATEGY_ORIGIN_REFERER,
+)
+
 
 LOG = logging.getLogger(__name__)
 
@@ -36,8 +49,21 @@ PROXY_RESPONSE_HEADERS = [
 ]
 
 
+# headers saved in image cache, Content-Encoding response will not be cached
+CACHE_RESPONSE_HEADERS = [
+    'Content-Type',
+    'Cache-Control', 'ETag', 'Last-Modified', 'Expires',
+    'Pragma', 'Server',
+]
+
+CONDITIONAL_REQUEST_HEADERS = ['If-None-Match', 'If-Modified-Since']
+
+
 MAX_IMAGE_SIZE = int(2 * 1024 * 1024)
 
+# max buffered bytes of all single flight fetches
+MAX_FLIGHT_BUFFER_SIZE = int(64 * 1024 * 1024)
+
 
 class ImageProxyError(Exception):
     def __init__(self, message, status=400):
@@ -60,36 +86,150 @@ async def get_response(session, url, headers):
     try:
         response = await session.get(url, headers=headers)
     except PrivateAddressError:
-        await session.close()
         raise ImageProxyError('private address not allowed')
     except _IMAGE_NETWORK_ERROR_S as ex:
-        await session.close()
         msg = '{}: {}'.format(type(ex).__name__, ex)
         LOG.info('image request failed %s, url=%r', msg, url)
         status = 504 if isinstance(ex, _IMAGE_TIMEOUT_ERROR_S) else 502
         raise ImageProxyError(msg, status=status)
-    except Exception:
-        await session.close()
-        raise
     return response
 
 
 REFERER_DENY_STATUS = {401, 403}
 
 
+# connection pool of image proxy session, image hosts are few but hot,
+# keep connections alive to avoid TCP/TLS handshake for each image
+IMAGE_PROXY_CONNECTOR_OPTIONS = dict(
+    limit=200,
+    limit_per_host=20,
+    keepalive_timeout=60,
+)
+
+IMAGE_PROXY_SESSION_KEY = 'image_proxy_session'
+IMAGE_PROXY_CACHE_KEY = 'image_proxy_cache'
+IMAGE_PROXY_FLIGHTS_KEY = 'image_proxy_flights'
+IMAGE_PROXY_REFERER_STRATEGY_KEY = 'image_proxy_referer_strategy'
+
+REFERER_STRATEGY_FILENAME = 'referer_strategy.json'
+
+
 def _create_aiohttp_client_session():
     loop = asyncio.get_event_loop()
     resolver = DNS_SERVICE.aiohttp_resolver(loop=loop)
     request_timeout = 30
     session = aiohttp_client_session(
-        resolver=resolver, timeout=request_timeout, auto_decompress=False)
+        resolver=resolver, timeout=request_timeout, auto_decompress=False,
+        connector_options=IMAGE_PROXY_CONNECTOR_OPTIONS)
     return session
 
 
+async def _setup_image_proxy_session(app):
+    app[IMAGE_PROXY_SESSION_KEY] = _create_aiohttp_client_session()
+
+
+async def _setup_image_proxy_cache(app):
+    if not CONFIG.image_proxy_cache_dir:
+        return
+    max_bytes = CONFIG.image_proxy_cache_size * 1024 * 1024
+    cache = ImageDiskCache(CONFIG.image_proxy_cache_dir, max_bytes=max_bytes)
+    loop = asyncio.get_event_loop()
+    await loop.run_in_executor(None, cache.load)
+    app[IMAGE_PROXY_CACHE_KEY] = cache
+
+
+async def _setup_image_proxy_flights(app):
+    app[IMAGE_PROXY_FLIGHTS_KEY] = ImageFlightGroup(max_bytes=MAX_FLIGHT_BUFFER_SIZE)
+
+
+def _get_referer_strategy_filepath():
+    if not CONFIG.image_proxy_cache_dir:
+        return None
+    return os.path.join(CONFIG.image_proxy_cache_dir, REFERER_STRATEGY_FILENAME)
+
+
+async def _setup_image_proxy_referer_strategy(app):
+    table = RefererStrategyTable()
+    filepath = _get_referer_strategy_filepath()
+    if filepath:
+        table.load_file(filepath)
+    app[IMAGE_PROXY_REFERER_STRATEGY_KEY] = table
+
+
+async def _cleanup_image_proxy_referer_strategy(app):
+    table = app.get(IMAGE_PROXY_REFERER_STRATEGY_KEY)
+    filepath = _get_referer_strategy_filepath()
+    if table is not None and filepath:
+        try:
+            table.save_file(filepath)
+        except OSError as ex:
+            LOG.warning('save referer strategy failed: %s', ex)
+
+
+async def _cleanup_image_proxy_session(app):
+    session = app.get(IMAGE_PROXY_SESSION_KEY)
+    if session is not None:
+        await session.close()
+
+
+def setup_image_proxy(app):
+    """
+    Share one client session, disk cache and single flights in app lifetime,
+    ie: one per gunicorn worker, cache size limit is also per worker.
+    """
+    app.on_startup.append(_setup_image_proxy_session)
+    app.on_startup.append(_setup_image_proxy_cache)
+    app.on_startup.append(_setup_image_proxy_flights)
+    app.on_startup.append(_setup_image_proxy_referer_strategy)
+    app.on_cleanup.append(_cleanup_image_proxy_session)
+    app.on_cleanup.append(_cleanup_image_proxy_referer_strategy)
+
+
 def _is_chunked_response(response) -> bool:
     return response.headers.get('Transfer-Encoding', '').lower() == 'chunked'
 
 
+ImageResponseHead = namedtuple(
+    'ImageResponseHead', 'status, headers, content_length, content_type, is_chunked')
+
+
+def _get_response_head(response) -> ImageResponseHead:
+    content_length = None
+    if response.headers.get('Content-Length'):
+        content_length = int(response.headers['Content-Length'])
+        if content_length > MAX_IMAGE_SIZE:
+            message = 'image too large, size={}'.format(content_length)
+            raise ImageProxyError(message, status=413)
+    headers = {}
+    for h in PROXY_RESPONSE_HEADERS:
+        if h in response.headers:
+            headers[h] = response.headers[h]
+    return ImageResponseHead(
+        status=response.status,
+        headers=headers,
+        content_length=content_length,
+        content_type=response.headers.get('Content-Type'),
+        is_chunked=_is_chunked_response(response),
+    )
+
+
+def _create_my_response(head: ImageResponseHead) -> StreamResponse:
+    my_response = StreamResponse(status=head.status)
+    # 'Content-Length', 'Content-Type', 'Transfer-Encoding'
+    if head.is_chunked:
+        my_response.enable_chunked_encoding()
+    if head.content_length is not None:
+        my_response.content_length = head.content_length
+    if head.content_type:
+        my_response.content_type = head.content_type
+    my_response.headers.update(head.headers)
+    return my_response
+
+
+# keep reference of background fetch tasks, avoid garbage collected
+_FLIGHT_TASKS = set()
+
+
 async def image_proxy(request, url, referer=None):
     if not CONFIG.image_proxy_enable:
         return json_response({'message': '404 Not Found / disabled'}, status=404)
@@ -101,19 +241,35 @@ class ImageProxyHandler:
     def __init__(self, request, url, referer=None):
         self.request = request
         self.url = url
-        if not referer or is_referer_force_url(url):
+        self.is_referer_force = is_referer_force_url(url)
+        if not referer or self.is_referer_force:
             referer = get_referer_of_url(url)
         self.referer = referer
+        self.referer_strategy = request.config_dict.get(IMAGE_PROXY_REFERER_STRATEGY_KEY)
         self.session = None
+        self.is_own_session = False
         self.response = None
+        self.cache = request.config_dict.get(IMAGE_PROXY_CACHE_KEY)
+        self.cache_expires_at = None
+        self.flights = request.config_dict.get(IMAGE_PROXY_FLIGHTS_KEY)
+        self.is_too_large = False
+
+    def _get_session(self):
+        session = self.request.config_dict.get(IMAGE_PROXY_SESSION_KEY)
+        if session is None:
+            # app not setup image proxy, use a temporary session
+            session = _create_aiohttp_client_session()
+            self.is_own_session = True
+        return session
 
     async def do_cleanup(self):
         if self.response:
-            self.response.close()
-        if self.session:
+            # release connection to pool, it will be closed if body not consumed
+            self.response.release()
+        if self.session and self.is_own_session:
             await self.session.close()
 
-    async def send_proxy_request(self):
+    async def send_proxy_request(self, cache_entry=None):
         url = self.url
         referer = self.referer
         user_agent = DEFAULT_USER_AGENT
@@ -123,15 +279,12 @@ class ImageProxyHandler:
         for h in PROXY_REQUEST_HEADERS:
             if h in self.request.headers:
                 headers[h] = self.request.headers[h]
-        referer_headers = dict(headers)
-        referer_headers['Referer'] = referer
-        # 先尝试发带Referer的请求，不行再尝试不带Referer
-        response = await get_response(self.session, url, referer_headers)
-        if response.status in REFERER_DENY_STATUS:
-            LOG.info(f'proxy image {url!r} referer={referer!r} '
-                     f'failed {response.status}, will try without referer')
-            response.close()
-            response = await get_response(self.session, response.url, headers)
+        if cache_entry is not None:
+            # revalidate cached image, client conditions are handled by cached response
+            for h in CONDITIONAL_REQUEST_HEADERS:
+                headers.pop(h, None)
+            headers.update(cache_entry.validator_headers())
+        response = await self._send_referer_requests(headers)
         is_chunked = _is_chunked_response(response)
         # using chunked encoding is forbidden for HTTP/1.0
         if is_chunked and self.request.version < HttpVersion11:
@@ -142,47 +295,248 @@ class ImageProxyHandler:
             raise ImageProxyError(error_msg)
         return response
 
+    def _get_referer_strategies(self, host):
+        """Return list of (strategy, referer), the learned working strategy first"""
+        if self.is_referer_force:
+            return [(STRATEGY_ORIGIN_REFERER, self.referer)]
+        strategy_referers = {
+            STRATEGY_REFERER: self.referer,
+            STRATEGY_NO_REFERER: None,
+            STRATEGY_ORIGIN_REFERER: get_referer_of_url(self.url),
+        }
+        if self.referer_strategy is None:
+            strategies = [STRATEGY_REFERER, STRATEGY_NO_REFERER]
+        else:
+            strategies = self.referer_strategy.get_strategies(host)
+        result = []
+        referers = set()
+        for strategy in strategies:
+            referer = strategy_referers[strategy]
+            if referer not in referers:
+                referers.add(referer)
+                result.append((strategy, referer))
+        return result
+
+    async def _send_referer_requests(self, headers):
+        # 图片的Referer可能被拒绝，按学习到的策略顺序尝试
+        url = self.url
+        host = urlsplit(url).hostname
+        strategies = self._get_referer_strategies(host)
+        for i, (strategy, referer) in enumerate(strategies):
+            referer_headers = dict(headers)
+            if referer:
+                referer_headers['Referer'] = referer
+            response = await get_response(self.session, url, referer_headers)
+            is_deny = response.status in REFERER_DENY_STATUS
+            if self.referer_strategy is not None and (is_deny or response.status < 400):
+                self.referer_strategy.record(host, strategy, is_ok=not is_deny)
+            if not is_deny or i == len(strategies) - 1:
+                break
+            LOG.info(f'proxy image {url!r} referer={referer!r} '
+                     f'failed {response.status}, will try next referer strategy')
+            response.release()
+            url = response.url
+        return response
+
+    def _get_cache_expires_at(self, response):
+        if self.cache is None or response.status != 200:
+            return None
+        content_encoding = response.headers.get('Content-Encoding', 'identity')
+        if content_encoding.lower() != 'identity':
+            return None
+        expires_at = get_expires_at(response.headers)
+        if expires_at is None:
+            return None
+        # expired response is useful only if it can be revalidated
+        has_validator = response.headers.get('ETag') or response.headers.get('Last-Modified')
+        if expires_at <= time.time() and not has_validator:
+            return None
+        return expires_at
+
+    def get_cached_response(self, cache_entry):
+        # the entry is most recently used after cache.get, it will not be evicted
+        # before file sent, but the file may be removed by other process
+        if not os.path.exists(cache_entry.filepath):
+            LOG.info(f'image cache {cache_entry!r} not found, url={self.url!r}')
+            self.cache.discard(cache_entry)
+            return None
+        return FileResponse(cache_entry.filepath, headers=cache_entry.headers)
+
+    async def refresh_cache(self, cache_entry):
+        loop = asyncio.get_event_loop()
+        if not is_vary_cacheable(self.response.headers.get('Vary')):
+            # the cached image may be negotiated for other clients, drop it
+            self.cache.discard(cache_entry)
+            await loop.run_in_executor(None, self.cache.remove_files, cache_entry)
+            return
+        expires_at = get_expires_at(self.response.headers)
+        if expires_at is None:
+            expires_at = time.time()
+        cache_entry.expires_at = expires_at
+        await loop.run_in_executor(None, self.cache.write_meta, cache_entry)
+
+    async def save_cache(self, body: bytes):
+        headers = {}
+        for h in CACHE_RESPONSE_HEADERS:
+            if h in self.response.headers:
+                headers[h] = self.response.headers[h]
+        loop = asyncio.get_event_loop()
+        try:
+            entry = await loop.run_in_executor(
+                None, self.cache.write_files, self.url, body, headers, self.cache_expires_at)
+        except OSError as ex:
+            LOG.warning(f'save image cache failed: {ex}, url={self.url!r}')
+            return
+        evicted = self.cache.add(entry)
+        for item in evicted:
+            await loop.run_in_executor(None, self.cache.remove_files, item)
+
     async def prepare_my_response(self):
-        response = self.response
-        my_response = StreamResponse(status=response.status)
-        # 'Content-Length', 'Content-Type', 'Transfer-Encoding'
-        if _is_chunked_response(response):
-            my_response.enable_chunked_encoding()
-        if response.headers.get('Content-Length'):
-            content_length = int(response.headers['Content-Length'])
-            if content_length > MAX_IMAGE_SIZE:
-                message = 'image too large, size={}'.format(content_length)
-                raise ImageProxyError(message, status=413)
-            my_response.content_length = content_length
-        if response.headers.get('Content-Type'):
-            my_response.content_type = response.headers['Content-Type']
-        for h in PROXY_RESPONSE_HEADERS:
-            if h in response.headers:
-                my_response.headers[h] = response.headers[h]
+        head = _get_response_head(self.response)
+        my_response = _create_my_response(head)
+        self.cache_expires_at = self._get_cache_expires_at(self.response)
         await my_response.prepare(self.request)
         return my_response
 
+    async def _iter_image_chunks(self):
+        content_length = 0
+        async for chunk in self.response.content.iter_chunked(8 * 1024):
+            content_length += len(chunk)
+            if content_length > MAX_IMAGE_SIZE:
+                LOG.warning(f'image too large, abort the response, url={self.url!r}')
+                self.is_too_large = True
+                break
+            yield chunk
+
     async def write_my_response(self, my_response):
+        is_cacheable = self.cache_expires_at is not None
+        chunks = []
         try:
-            content_length = 0
-            async for chunk in self.response.content.iter_chunked(8 * 1024):
-                content_length += len(chunk)
-                if content_length > MAX_IMAGE_SIZE:
-                    LOG.warning(f'image too large, abort the response, url={self.url!r}')
-                    break
+            async for chunk in self._iter_image_chunks():
+                if is_cacheable:
+                    chunks.append(chunk)
                 await my_response.write(chunk)
             await my_response.write_eof()
+            if is_cacheable and not self.is_too_large:
+                await self.save_cache(b''.join(chunks))
         except _IMAGE_NETWORK_ERROR_S as ex:
             msg = "image proxy failed {}: {} url={!r}".format(type(ex).__name__, ex, self.url)
             LOG.warning(msg)
+            my_response.force_close()
+
+    def _get_flight_key(self):
+        # leader forwards its Accept and Accept-Encoding, only share negotiated response
+        headers = self.request.headers
+        return (self.url, headers.get('Accept'), headers.get('Accept-Encoding'))
+
+    def _is_shareable_request(self) -> bool:
+        if self.flights is None or self.request.version < HttpVersion11:
+            return False
+        for h in CONDITIONAL_REQUEST_HEADERS:
+            if h in self.request.headers:
+                return False
+        return True
+
+    def _start_flight(self, cache_entry):
+        """Start background fetch as flight leader, return None if not able to start"""
+        flight = self.flights.start(self._get_flight_key())
+        if flight is None:
+            return None
+        fetcher = ImageProxyHandler(self.request, url=self.url, referer=self.referer)
+        task = asyncio.ensure_future(fetcher.fetch_flight(flight, cache_entry))
+        _FLIGHT_TASKS.add(task)
+        task.add_done_callback(_FLIGHT_TASKS.discard)
+        return flight
+
+    async def fetch_flight(self, flight, cache_entry=None):
+        """
+        Fetch image and feed to flight, run in background task,
+        so it will not be cancelled by disconnected client.
+        """
+        self.session = self._get_session()
+        try:
+            self.response = await self.send_proxy_request(cache_entry)
+            if cache_entry is not None and self.response.status == 304:
+                await self.refresh_cache(cache_entry)
+                return
+            head = _get_response_head(self.response)
+            self.cache_expires_at = self._get_cache_expires_at(self.response)
+            flight.set_head(head)
+            async for chunk in self._iter_image_chunks():
+                flight.feed(chunk)
+            # image too large is aborted, followers should not end the response normally
+            flight.finish(is_complete=not self.is_too_large)
+            if self.cache_expires_at is not None and not self.is_too_large:
+                await self.save_cache(b''.join(flight.iter_buffer()))
+        except ImageProxyError as ex:
+            flight.finish(error=ex)
+        except _IMAGE_NETWORK_ERROR_S as ex:
+            msg = "image proxy failed {}: {} url={!r}".format(type(ex).__name__, ex, self.url)
+            LOG.warning(msg)
+            flight.finish(error=ImageProxyError(msg, status=502))
+        except Exception as ex:
+            LOG.exception(f'image proxy fetch failed, url={self.url!r}')
+            flight.finish(error=ex)
         finally:
+            flight.finish()
+            await self.do_cleanup()
+
+    async def follow_flight(self, flight):
+        """Response with flight buffer, return None if flight aborted"""
+        try:
+            head = await flight.wait_head()
+        except ImageFlightAborted:
+            return None
+        my_response = _create_my_response(head)
+        await my_response.prepare(self.request)
+        try:
+            async for chunk in flight.iter_chunks():
+                await my_response.write(chunk)
+            if flight.is_complete:
+                await my_response.write_eof()
+            else:
+                my_response.force_close()
+        except _IMAGE_NETWORK_ERROR_S as ex:
+            msg = "image proxy failed {}: {} url={!r}".format(type(ex).__name__, ex, self.url)
+            LOG.warning(msg)
             my_response.force_close()
+        return my_response
+
+    def _get_fresh_cached_response(self):
+        if self.cache is None:
+            return None, None
+        cache_entry = self.cache.get(self.url)
+        if cache_entry is not None and cache_entry.is_fresh():
+            return cache_entry, self.get_cached_response(cache_entry)
+        return cache_entry, None
 
     async def proxy(self):
         LOG.info(f'proxy image {self.url} referer={self.referer}')
-        self.session = _create_aiohttp_client_session()
+        self.session = self._get_session()
         try:
-            self.response = await self.send_proxy_request()
+            cache_entry, my_response = self._get_fresh_cached_response()
+            if my_response is not None:
+                return my_response
+            if self._is_shareable_request():
+                flight = self.flights.join(self._get_flight_key())
+                if flight is None:
+                    flight = self._start_flight(cache_entry)
+                if flight is not None:
+                    my_response = await self.follow_flight(flight)
+                    if my_response is not None:
+                        return my_response
+                    # flight aborted, the cache may be revalidated
+                    cache_entry, my_response = self._get_fresh_cached_response()
+                    if my_response is not None:
+                        return my_response
+            self.response = await self.send_proxy_request(cache_entry)
+            if cache_entry is not None and self.response.status == 304:
+                await self.refresh_cache(cache_entry)
+                my_response = self.get_cached_response(cache_entry)
+                if my_response is not None:
+                    return my_response
+                self.response.release()
+                self.response = await self.send_proxy_request()
             my_response = await self.prepare_my_response()
             await self.write_my_response(my_response)
             return my_response
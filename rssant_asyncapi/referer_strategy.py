@@ -0,0 +1,114 @@
+"""
+Learned Referer strategy of image hosts.
+
+Image hosts may reject the Referer we send (eg: anti hotlinking), try
+another strategy costs an extra round trip. The table records outcome of
+each strategy per host, scores decay over time, so the proxy can send the
+working strategy first.
+"""
+import json
+import logging
+import os
+import time
+import typing
+
+from cachetools import LRUCache
+
+LOG = logging.getLogger(__name__)
+
+# send the Referer of story page
+STRATEGY_REFERER = 'referer'
+# send without Referer
+STRATEGY_NO_REFERER = 'no_referer'
+# send the origin of image url as Referer
+STRATEGY_ORIGIN_REFERER = 'origin_referer'
+
+DEFAULT_STRATEGIES = (STRATEGY_REFERER, STRATEGY_NO_REFERER, STRATEGY_ORIGIN_REFERER)
+
+# bound scores so a long history not outweighs recent outcomes
+MAX_SCORE = 5
+
+
+class RefererStrategyTable:
+    """
+    >>> table = RefererStrategyTable()
+    >>> table.get_strategies('example.com')
+    ['referer', 'no_referer', 'origin_referer']
+    >>> table.record('example.com', 'referer', is_ok=False)
+    >>> table.record('example.com', 'no_referer', is_ok=True)
+    >>> table.get_strategies('example.com')
+    ['no_referer', 'origin_referer', 'referer']
+    """
+
+    def __init__(self, maxsize: int = 10000, half_life: float = 24 * 60 * 60):
+        self.half_life = half_life
+        # host -> {strategy: [score, updated_at]}
+        self._hosts = LRUCache(maxsize=maxsize)
+
+    def __repr__(self):
+        return '<{} size={}>'.format(type(self).__name__, self.size())
+
+    def size(self) -> int:
+        return len(self._hosts)
+
+    def _decay(self, score: float, updated_at: float, now: float) -> float:
+        elapsed = max(0, now - updated_at)
+        return score * 0.5 ** (elapsed / self.half_life)
+
+    def get_score(self, host: str, strategy: str, now: float = None) -> float:
+        if now is None:
+            now = time.time()
+        scores = self._hosts.get(host)
+        if not scores or strategy not in scores:
+            return 0
+        score, updated_at = scores[strategy]
+        return self._decay(score, updated_at, now)
+
+    def get_strategies(self, host: str, strategies=DEFAULT_STRATEGIES) -> typing.List[str]:
+        """Sort strategies by score, the order of strategies is used for equal scores"""
+        if host not in self._hosts:
+            return list(strategies)
+        now = time.time()
+        return sorted(strategies, key=lambda x: -self.get_score(host, x, now=now))
+
+    def record(self, host: str, strategy: str, is_ok: bool, now: float = None):
+        if now is None:
+            now = time.time()
+        score = self.get_score(host, strategy, now=now)
+        score += 1 if is_ok else -1
+        score = min(max(score, -MAX_SCORE), MAX_SCORE)
+        scores = self._hosts.get(host)
+        if scores is None:
+            scores = self._hosts[host] = {}
+        scores[strategy] = [score, now]
+
+    def dump(self) -> dict:
+        return dict(self._hosts.items())
+
+    def load(self, data: dict):
+        for host, scores in data.items():
+            self._hosts[host] = {k: list(v) for k, v in scores.items()}
+
+    def save_file(self, filepath: str):
+        # workers save the same file, use per process temp file then atomic rename
+        temp_filepath = '{}.{}.tmp'.format(filepath, os.getpid())
+        try:
+            with open(temp_filepath, 'w') as f:
+                json.dump(self.dump(), f)
+            os.replace(temp_filepath, filepath)
+        except BaseException:
+            if os.path.exists(temp_filepath):
+                os.remove(temp_filepath)
+            raise
+
+    def load_file(self, filepath: str):
+        try:
+            with open(filepath) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except ValueError as ex:
+            LOG.warning('invalid referer strategy file %s: %s', filepath, ex)
+            return
+        self.load(data)
+        LOG.info('loaded %r from %s', self, filepath)
@@ -17,14 +17,12 @@ User = namedtuple('User', 'id,username,email,dt_joined,feed_count,dt_last_visit'
 
 def query_users(dt_gte: timezone.datetime = None, dt_lt: timezone.datetime = None) -> typing.List[User]:
     sql_template = '''
-    SELECT id, username, email, date_joined,
-        COALESCE(feed_count, 0) AS feed_count,
-        COALESCE(dt_last_visit, last_login) AS dt_last_visit
-    FROM auth_user LEFT OUTER JOIN (
-        SELECT user_id, count(1) AS feed_count, MAX(dt_updated) AS dt_last_visit
-        FROM rssant_api_userfeed GROUP BY user_id
-    ) t1 ON auth_user.id=t1.user_id
-    {where} ORDER BY id;
+    SELECT auth_user.id, username, email, date_joined,
+        COALESCE(ua.feed_count, 0) AS feed_count,
+        COALESCE(ua.dt_last_active, last_login) AS dt_last_visit
+    FROM auth_user LEFT OUTER JOIN rssant_api_useractivity AS ua
+    ON auth_user.id=ua.id
+    {where} ORDER BY auth_user.id;
     '''
     params = []
     where = []
@@ -10,13 +10,22 @@ from django.utils import timezone
 
 import rssant_common.django_setup  # noqa:F401
 from rssant_api.helper import reverse_url
-from rssant_api.models import Feed, Story, UnionFeed, UserFeed, UserStory
+from rssant_api.models import (
+    STORY_SERVICE,
+    Feed,
+    FeedMonthlyStoryCount,
+    Story,
+    UnionFeed,
+    UserFeed,
+    UserStory,
+)
 from rssant_api.models.worker_task import WorkerTask, WorkerTaskPriority
 from rssant_common import _proxy_helper, unionid
 from rssant_common.helper import format_table, pretty_format_json
 from rssant_config import CONFIG
 from rssant_feedlib import processor
 from rssant_feedlib.reader import FeedReader, FeedResponseStatus
+from rssant_harbor.pg_count import pg_count_estimate, pg_count_limit
 
 LOG = logging.getLogger(__name__)
 
@@ -87,26 +96,19 @@ def update_feed_monthly_story_count(feeds=None):
     feed_ids = _get_feed_ids(feeds)
     LOG.info('total %s feeds', len(feed_ids))
     for feed_id in tqdm.tqdm(feed_ids, ncols=80, ascii=True):
-        with transaction.atomic():
-            Story.refresh_feed_monthly_story_count(feed_id)
+        feed = Feed.objects.only('id', 'is_story_migrated').get(pk=feed_id)
+        FeedMonthlyStoryCount.rebuild(feed_id, legacy=not feed.is_story_migrated)
 
 
 @main.command()
 @click.option('--feeds', help="feed ids, separate by ','")
-def update_feed_dryness(feeds=None):
+@click.option('--batch-size', type=int, default=1000)
+def update_feed_dryness(feeds=None, batch_size=1000):
     feed_ids = _get_feed_ids(feeds)
     LOG.info('total %s feeds', len(feed_ids))
-    for feed_id in tqdm.tqdm(feed_ids, ncols=80, ascii=True):
-        with transaction.atomic():
-            feed = Feed.get_by_pk(feed_id)
-            if feed.total_storys <= 0:
-                continue
-            cnt = feed.monthly_story_count
-            if not cnt:
-                Story.refresh_feed_monthly_story_count(feed_id)
-            feed.refresh_from_db()
-            feed.dryness = feed.monthly_story_count.dryness()
-            feed.save()
+    batches = [feed_ids[i:i + batch_size] for i in range(0, len(feed_ids), batch_size)]
+    for batch_feed_ids in tqdm.tqdm(batches, ncols=80, ascii=True):
+        FeedMonthlyStoryCount.refresh_dryness(batch_feed_ids)
 
 
 @main.command()
@@ -352,6 +354,7 @@ def delete_feed(key):
         print(f'not found feed like {key}')
         return
     if click.confirm(f'delete {feed} ?'):
+        STORY_SERVICE.delete_content_by_feeds([feed.id])
         feed.delete()
 
 
@@ -401,5 +404,42 @@ def update_feed_reverse_url(feeds):
         feed.save()
 
 
+def _log_legacy_story_count():
+    tables = ['rssant_api_story', 'rssant_api_storyinfo']
+    result = pg_count_limit(tables, limit=10000)
+    result.update(pg_count_estimate(list(set(tables) - set(result))))
+    for table in tables:
+        LOG.info('%s count=%s', table, result.get(table))
+
+
+@main.command()
+@click.option('--feeds', help="feed ids, separate by ',', default all feeds not migrated")
+@click.option('--limit', type=int, default=1000, help="max number of feeds")
+@click.option('--batch-size', type=int, default=100, help="storys per batch")
+@click.option('--sleep', type=float, default=0.1, help="seconds to sleep between batches")
+@click.option('--delete-legacy', is_flag=True, help="delete legacy storys not referenced by user storys")
+def migrate_legacy_storys(feeds=None, limit=1000, batch_size=100, sleep=0.1, delete_legacy=False):
+    """Copy legacy storys to StoryInfo and story volumes, can run again to resume"""
+    if feeds:
+        feed_ids = _decode_feed_ids(feeds)
+    else:
+        q = Feed.objects.filter(Q(is_story_migrated=False) | Q(is_story_migrated__isnull=True))
+        feed_ids = list(q.order_by('id').values_list('id', flat=True)[:limit])
+    LOG.info('total %s feeds', len(feed_ids))
+    _log_legacy_story_count()
+    num_storys = 0
+    failed_feed_ids = []
+    for feed_id in tqdm.tqdm(feed_ids, ncols=80, ascii=True):
+        num_migrated, is_migrated = STORY_SERVICE.migrate_legacy_storys(
+            feed_id, batch_size=batch_size, sleep=sleep, delete_legacy=delete_legacy)
+        num_storys += num_migrated
+        if not is_migrated:
+            failed_feed_ids.append(feed_id)
+    LOG.info('migrated %s storys, %s feeds failed', num_storys, len(failed_feed_ids))
+    if failed_feed_ids:
+        LOG.info('failed feeds: %s', ','.join(map(str, failed_feed_ids)))
+    _log_legacy_story_count()
+
+
 if __name__ == "__main__":
     main()
@@ -4,11 +4,15 @@ import logging
 import random
 import socket
 import ssl
-from collections import OrderedDict, defaultdict
-from typing import Any, Callable, Dict, List
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict
+from typing import Any, Callable, Dict, List, Optional, Tuple
 from urllib.parse import urlparse
 
+import aiodns
 import aiohttp
+import pycares
 import requests.adapters
 import yarl
 
@@ -58,6 +62,112 @@ class NameNotResolvedError(DNSError):
     """Name not resolved Error"""
 
 
+class DNSCache:
+    """
+    Thread safe LRU cache of resolved IP list with per host expires.
+    Empty IP list means the host not exists, ie: negative cache.
+
+    >>> cache = DNSCache(maxsize=2)
+    >>> cache.set('a.com', ['1.1.1.1'], ttl=10, now=0)
+    >>> cache.get('a.com', now=0)
+    ['1.1.1.1']
+    >>> cache.get('a.com', now=cache.min_ttl + 1) is None
+    True
+    >>> cache.set('b.com', [], now=0)
+    >>> cache.get('b.com', now=0)
+    []
+    >>> cache.set('c.com', ['1.1.1.1'], now=0)
+    >>> cache.get('a.com', now=0) is None
+    True
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 10000,
+        min_ttl: int = 60,
+        max_ttl: int = 3600,
+        negative_ttl: int = 60,
+    ):
+        self.maxsize = maxsize
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        self._lock = threading.Lock()
+        # host -> (ip_list, expires_at)
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, host: str, now: float = None) -> Optional[list]:
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(host)
+            if entry is None:
+                return None
+            ip_list, expires_at = entry
+            if expires_at <= now:
+                self._entries.pop(host, None)
+                return None
+            self._entries.move_to_end(host)
+            return list(ip_list)
+
+    def set(self, host: str, ip_list: list, ttl: int = None, now: float = None):
+        if now is None:
+            now = time.monotonic()
+        if not ip_list:
+            ttl = self.negative_ttl
+        elif ttl is None:
+            ttl = self.max_ttl
+        else:
+            ttl = min(max(ttl, self.min_ttl), self.max_ttl)
+        with self._lock:
+            self._entries.pop(host, None)
+            self._entries[host] = (tuple(ip_list), now + ttl)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# getaddrinfo and hosts file has no TTL info, use a short one
+_SYNC_RESOLVE_TTL = 300
+
+# error codes of host not exists, will be negative cached
+_NOT_FOUND_GAI_ERRORS = {
+    getattr(socket, name) for name in ['EAI_NONAME', 'EAI_NODATA']
+    if hasattr(socket, name)
+}
+_NOT_FOUND_ARES_ERRORS = {pycares.errno.ARES_ENOTFOUND, pycares.errno.ARES_ENODATA}
+
+# refresh pinned records by record TTL, bounded by min and max
+_RECORD_MIN_TTL = 10 * 60
+_RECORD_MAX_TTL = 4 * 60 * 60
+# retry failed query after a while
+_RECORD_RETRY_TTL = 10 * 60
+# max concurrent DNS over HTTPS queries and IP verifications
+_REFRESH_CONCURRENCY = 10
+# pin records of most used hosts besides static hosts
+_REFRESH_TOP_HOSTS = 100
+# usage counter size, least used hosts will be discarded
+_USAGE_COUNTER_SIZE = 1000
+
+
+_CLOUDFLARE_DNS_URL = 'https://cloudflare-dns.com/dns-query?name={name}&type=A'
+_GOOGLE_DNS_URL = 'https://dns.google.com/resolve?name={name}&type=A'
+
+
+def _is_ip_address(value) -> bool:
+    try:
+        ipaddress.ip_address(value)
+    except ValueError:
+        return False
+    return True
+
+
 def _is_public_ipv4(value):
     try:
         ip = ipaddress.ip_address(value)
@@ -72,12 +182,26 @@ class DNSService:
         get_client: Callable,
         records: dict = None,
         allow_private_address: bool = False,
+        cache: DNSCache = None,
     ):
         self.hosts = list(records or {})
         self.update(records or {})
         self._client: RSSProxyClient = None
         self.get_client = get_client
         self.allow_private_address = allow_private_address
+        self.cache = cache if cache is not None else DNSCache()
+        # coalesce concurrent lookups of the same host
+        self._sync_pending_lock = threading.Lock()
+        self._sync_pending: Dict[str, threading.Event] = {}
+        self._async_pending: Dict[tuple, asyncio.Future] = {}
+        # host -> monotonic time of next refresh
+        self._refresh_at: Dict[str, float] = {}
+        # host -> verified ip set, only changed IPs need verify
+        self._verified: Dict[str, set] = {}
+        # resolve count of hosts, decayed at each refresh
+        self._usage = Counter()
+        # resolver threads update usage while refresh iterate it
+        self._usage_lock = threading.Lock()
 
     @property
     def client(self) -> RSSProxyClient:
@@ -116,6 +240,21 @@ class DNSService:
             new_records[host].update(ip_set)
         self.records = new_records
 
+    def _update_host(self, host: str, ip_set: set):
+        # copy on write, readers in other threads see old or new records
+        new_records = defaultdict(set)
+        for key, value in self.records.items():
+            new_records[key] = value
+        if ip_set:
+            new_records[host] = set(ip_set)
+        else:
+            new_records.pop(host, None)
+        self.records = new_records
+
+    def _record_usage(self, host: str):
+        with self._usage_lock:
+            self._usage[host] += 1
+
     def is_resolved_host(self, host) -> bool:
         return bool(self.records.get(host))
 
@@ -137,6 +276,83 @@ class DNSService:
         ip_set = self.records.get(host)
         return list(ip_set) if ip_set else []
 
+    def _sync_resolve_and_cache(self, host) -> list:
+        try:
+            ip_list = list(set(self._sync_resolve(host)))
+        except socket.gaierror as ex:
+            if ex.errno in _NOT_FOUND_GAI_ERRORS:
+                self.cache.set(host, [])
+            raise
+        self.cache.set(host, ip_list, ttl=_SYNC_RESOLVE_TTL)
+        return ip_list
+
+    def _sync_resolve_cached(self, host) -> list:
+        ip_list = self.cache.get(host)
+        if ip_list is None:
+            with self._sync_pending_lock:
+                event = self._sync_pending.get(host)
+                is_leader = event is None
+                if is_leader:
+                    event = self._sync_pending[host] = threading.Event()
+            if is_leader:
+                try:
+                    return self._sync_resolve_and_cache(host)
+                finally:
+                    with self._sync_pending_lock:
+                        self._sync_pending.pop(host, None)
+                    event.set()
+            event.wait(timeout=30)
+            ip_list = self.cache.get(host)
+            if ip_list is None:
+                # the leader failed with error which not cached
+                return self._sync_resolve_and_cache(host)
+        if not ip_list:
+            raise socket.gaierror(socket.EAI_NONAME, f'Name or service not known (cached): {host}')
+        return ip_list
+
+    async def _async_resolve_and_cache(self, resolver: aiodns.DNSResolver, host) -> list:
+        try:
+            try:
+                # query DNS server directly to get record TTL
+                result = await resolver.query(host, 'A')
+                ip_list = list(set(item.host for item in result))
+                ttl = min((item.ttl for item in result), default=None)
+            except aiodns.error.DNSError as ex:
+                if not (ex.args and ex.args[0] in _NOT_FOUND_ARES_ERRORS):
+                    raise
+                # fallback to lookup hosts file, eg: localhost
+                result = await resolver.gethostbyname(host, socket.AF_INET)
+                ip_list = list(set(result.addresses))
+                ttl = _SYNC_RESOLVE_TTL
+        except aiodns.error.DNSError as ex:
+            if ex.args and ex.args[0] in _NOT_FOUND_ARES_ERRORS:
+                self.cache.set(host, [])
+            msg = ex.args[1] if len(ex.args) >= 2 else 'DNS lookup failed'
+            raise OSError(msg) from ex
+        self.cache.set(host, ip_list, ttl=ttl)
+        return ip_list
+
+    def _on_async_resolve_done(self, key, task: asyncio.Future):
+        self._async_pending.pop(key, None)
+        if not task.cancelled():
+            # mark exception retrieved, all callers may be cancelled
+            task.exception()
+
+    async def _async_resolve_cached(self, resolver: aiodns.DNSResolver, host) -> list:
+        ip_list = self.cache.get(host)
+        if ip_list is None:
+            key = (asyncio.get_event_loop(), host)
+            task = self._async_pending.get(key)
+            if task is None:
+                # lookup in task, cancelled caller will not cancel other callers
+                task = asyncio.ensure_future(self._async_resolve_and_cache(resolver, host))
+                self._async_pending[key] = task
+                task.add_done_callback(lambda t: self._on_async_resolve_done(key, t))
+            ip_list = await asyncio.shield(task)
+        if not ip_list:
+            raise OSError(f'Domain name not found (cached): {host}')
+        return ip_list
+
     def _select_ip(self, ip_set: list, *, host: str) -> list:
         # Discard private and prefer ipv4
         groups = OrderedDict(
@@ -167,9 +383,10 @@ class DNSService:
         raise NameNotResolvedError(host)
 
     def resolve_urllib3(self, host) -> str:
+        self._record_usage(host)
         ip_set = self._local_resolve(host)
         if not ip_set:
-            ip_set = list(set(self._sync_resolve(host)))
+            ip_set = self._sync_resolve_cached(host)
         LOG.debug('resolve_urllib3 %s to %s', host, ip_set)
         ip = self._select_ip(ip_set, host=host)
         return ip
@@ -181,19 +398,125 @@ class DNSService:
         return RssantHttpAdapter(dns_service=self, **kwargs)
 
     def refresh(self):
-        records = defaultdict(set)
-        for host, ip_set in self.query_from_cloudflare().items():
-            records[host].update(ip_set)
-        LOG.info('resolved from cloudflare: %r', dict(records))
+        """Refresh all hosts, blocking"""
+        loop = get_or_create_event_loop()
+        loop.run_until_complete(self.refresh_async(force=True))
+
+    def _get_pinned_hosts(self) -> List[str]:
+        """Static hosts and most used hosts"""
+        hosts = list(self.hosts)
+        with self._usage_lock:
+            usage = Counter(self._usage)
+        for host, __ in usage.most_common(_REFRESH_TOP_HOSTS):
+            if host not in hosts and not _is_ip_address(host):
+                hosts.append(host)
+        return hosts
+
+    def _get_refresh_hosts(self, pinned: List[str], now: float, force: bool = False) -> List[str]:
+        """Pinned hosts which records expired"""
+        if force:
+            return list(pinned)
+        return [x for x in pinned if self._refresh_at.get(x, 0) <= now]
+
+    def _evict_unpinned(self, pinned: List[str]):
+        """
+        Evict records of hosts which fall out of most used hosts, they will
+        not be refreshed anymore, resolve them by DNS cache instead.
+        """
+        pinned = set(pinned)
+        evicted = [x for x in self.records if x not in pinned]
+        if not evicted:
+            return
+        LOG.info('evict records of %d hosts', len(evicted))
+        # copy on write, readers in other threads see old or new records
+        new_records = defaultdict(set)
+        for key, value in self.records.items():
+            if key in pinned:
+                new_records[key] = value
+        self.records = new_records
+        for host in evicted:
+            self._refresh_at.pop(host, None)
+            self._verified.pop(host, None)
+
+    def _decay_usage(self):
+        usage = Counter()
+        with self._usage_lock:
+            for host, count in self._usage.most_common(_USAGE_COUNTER_SIZE):
+                if count // 2 > 0:
+                    usage[host] = count // 2
+            self._usage = usage
+
+    async def refresh_async(self, force: bool = False):
+        """
+        Refresh records of hosts which TTL expired, query DNS over HTTPS
+        and verify new IPs concurrently, hosts are updated individually.
+        Records of hosts no longer pinned are evicted.
+        """
+        now = time.monotonic()
+        pinned = self._get_pinned_hosts()
+        self._evict_unpinned(pinned)
+        hosts = self._get_refresh_hosts(pinned, now, force=force)
+        self._decay_usage()
+        if not hosts:
+            return
+        LOG.info('refresh records of %d hosts', len(hosts))
+        semaphore = asyncio.Semaphore(_REFRESH_CONCURRENCY)
+        tasks = [self._refresh_host_task(host, semaphore) for host in hosts]
+        await asyncio.gather(*tasks)
+
+    async def _refresh_host_task(self, host: str, semaphore: asyncio.Semaphore):
+        try:
+            ip_set, ttl = await self._query_host(host, semaphore)
+        except Exception as ex:
+            LOG.warning(f'query records of {host} failed: {type(ex).__name__}: {ex}')
+            self._refresh_at[host] = time.monotonic() + _RECORD_RETRY_TTL
+            return
+        verified = self._verified.get(host) or set()
+        new_ip_set = ip_set - verified
+        tasks = [self._verify_record_task(host, ip, semaphore) for ip in new_ip_set]
+        valid_ip_set = ip_set & verified
+        for __, ip, ok in await asyncio.gather(*tasks):
+            if ok:
+                valid_ip_set.add(ip)
+        if valid_ip_set != self._local_resolve_set(host):
+            LOG.info('refresh records of %s: %r', host, valid_ip_set)
+        self._verified[host] = valid_ip_set
+        self._update_host(host, valid_ip_set)
+        ttl = min(max(ttl or 0, _RECORD_MIN_TTL), _RECORD_MAX_TTL)
+        self._refresh_at[host] = time.monotonic() + ttl
+
+    def _local_resolve_set(self, host) -> set:
+        return set(self.records.get(host) or ())
+
+    async def _query_host(self, host: str, semaphore: asyncio.Semaphore) -> Tuple[set, int]:
+        """Query host from DNS over HTTPS servers, return ip set and min TTL"""
+        url_templates = [_CLOUDFLARE_DNS_URL]
         if self.client.has_proxy:
-            for host, ip_set in self.query_from_google().items():
-                records[host].update(ip_set)
-            LOG.info('resolved from google: %r', dict(records))
-        records = self.validate_records(records)
-        LOG.info('refresh records: %r', dict(records))
-        self.update(records)
-
-    async def _verify_record_task(self, host, ip):
+            url_templates.append(_GOOGLE_DNS_URL)
+        loop = asyncio.get_event_loop()
+        ip_set = set()
+        ttl_s = []
+        errors = []
+        for url_template in url_templates:
+            # the proxy client is blocking, run it in executor
+            async with semaphore:
+                try:
+                    answer = await loop.run_in_executor(
+                        None, self._query_host_dns_over_https, url_template, host)
+                except Exception as ex:
+                    errors.append(ex)
+                    continue
+            for ip, ttl in answer:
+                ip_set.add(ip)
+                ttl_s.append(ttl)
+        if len(errors) >= len(url_templates):
+            raise errors[0]
+        return ip_set, min(ttl_s, default=None)
+
+    async def _verify_record_task(self, host, ip, semaphore=None):
+        if semaphore is not None:
+            async with semaphore:
+                return await self._verify_record_task(host, ip)
         _NetworkErrors = (
             socket.timeout,
             TimeoutError,
@@ -241,32 +564,38 @@ class DNSService:
         valid_records = loop.run_until_complete(self._validate_records(records))
         return valid_records
 
-    def query_from_dns_over_tls(self, url_template: str) -> dict:
+    def _query_host_dns_over_https(self, url_template: str, host: str) -> List[Tuple[str, int]]:
+        """Return list of (ip, ttl), raise error if query failed"""
         headers = {'accept': 'application/dns-json'}
+        url = url_template.format(name=host)
+        LOG.info(f'query {url}')
+        response = self.client.request('GET', url, headers=headers)
+        response.raise_for_status()
+        answer = []
+        for item in response.json().get('Answer') or []:
+            if item['type'] == 1:  # ipv4
+                ip = item['data']
+                if ip and _is_public_ipv4(ip):
+                    answer.append((ip, item.get('TTL')))
+        return answer
+
+    def query_from_dns_over_tls(self, url_template: str) -> dict:
         records = defaultdict(set)
         for host in self.hosts:
-            url = url_template.format(name=host)
-            LOG.info(f'query {url}')
             try:
-                response = self.client.request('GET', url, headers=headers)
-                response.raise_for_status()
+                answer = self._query_host_dns_over_https(url_template, host)
             except Exception as ex:
                 LOG.warning(f'{type(ex).__name__}: {ex}')
                 continue
-            for item in response.json()['Answer']:
-                if item['type'] == 1:  # ipv4
-                    ip = item['data']
-                    if ip and _is_public_ipv4(ip):
-                        records[host].add(ip)
+            for ip, __ in answer:
+                records[host].add(ip)
         return records
 
     def query_from_cloudflare(self):
-        url_template = 'https://cloudflare-dns.com/dns-query?name={name}&type=A'
-        return self.query_from_dns_over_tls(url_template)
+        return self.query_from_dns_over_tls(_CLOUDFLARE_DNS_URL)
 
     def query_from_google(self):
-        url_template = 'https://dns.google.com/resolve?name={name}&type=A'
-        return self.query_from_dns_over_tls(url_template)
+        return self.query_from_dns_over_tls(_GOOGLE_DNS_URL)
 
 
 class RssantAsyncResolver(aiohttp.AsyncResolver):
@@ -275,12 +604,12 @@ class RssantAsyncResolver(aiohttp.AsyncResolver):
         super().__init__(*args, **kwargs)
 
     async def _async_resolve(self, hostname) -> list:
-        hosts = await super().resolve(hostname, family=socket.AF_INET)
-        return list(set(item['host'] for item in hosts))
+        return await self._dns_service._async_resolve_cached(self._resolver, hostname)
 
     async def resolve(
         self, host: str, port: int = 0, family: int = socket.AF_INET
     ) -> List[Dict[str, Any]]:
+        self._dns_service._record_usage(host)
         ip_set = self._dns_service._local_resolve(host)
         if not ip_set:
             ip_set = await self._async_resolve(host)
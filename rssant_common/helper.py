@@ -88,8 +88,13 @@ def aiohttp_raise_for_status(response: aiohttp.ClientResponse):
         )
 
 
-def aiohttp_client_session(*, timeout=None, resolver=None, proxy_url=None, **kwargs):
-    """use aiodns and support number timeout"""
+def aiohttp_client_session(
+    *, timeout=None, resolver=None, proxy_url=None, connector_options=None, **kwargs,
+):
+    """
+    use aiodns and support number timeout,
+    connector_options: extra TCPConnector params, eg: limit_per_host, keepalive_timeout
+    """
     if timeout is None:
         timeout = 30
     if isinstance(timeout, (int, float)):
@@ -98,6 +103,8 @@ def aiohttp_client_session(*, timeout=None, resolver=None, proxy_url=None, **kwa
         resolver = aiohttp.AsyncResolver()
     # Fix: No route to host. https://github.com/saghul/aiodns/issues/22
     conn_params = dict(resolver=resolver, family=socket.AF_INET)
+    if connector_options:
+        conn_params.update(connector_options)
     if proxy_url:
         connector = ProxyConnector.from_url(proxy_url, **conn_params)
     else:
@@ -0,0 +1,314 @@
+"""
+Per host token bucket rate limiter of feed and story fetches.
+
+Each host has a bucket of `burst` tokens refilled at `rate` tokens per second,
+a request takes one token, the bucket may go negative which means the token
+is reserved and the caller should sleep before sending request. Retry-After of
+429/503 responses blocks the host by moving bucket update time to future.
+
+Buckets are stored by backend, MemoryRateLimitBackend for single process,
+SharedFileRateLimitBackend keep buckets in a mmap file so worker processes
+on the same machine share the same limits.
+"""
+import asyncio
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import typing
+from email.utils import parsedate_to_datetime
+from http import HTTPStatus
+from urllib.parse import urlparse
+
+from cachetools import LRUCache
+
+from rssant_config import CONFIG
+
+LOG = logging.getLogger(__name__)
+
+# the default block seconds of 429 response without Retry-After
+_DEFAULT_RETRY_AFTER = 60
+_MAX_RETRY_AFTER = 60 * 60
+
+_RETRY_AFTER_STATUS = {
+    HTTPStatus.TOO_MANY_REQUESTS.value,
+    HTTPStatus.SERVICE_UNAVAILABLE.value,
+}
+
+# bucket state: (tokens, updated_at), updated_at is 0 for new bucket
+BucketState = typing.Tuple[float, float]
+_NEW_BUCKET = (0.0, 0.0)
+
+
+def parse_retry_after(value, now: float = None) -> typing.Optional[float]:
+    """
+    Parse Retry-After header to seconds, see RFC 7231 7.1.3
+
+    >>> parse_retry_after('120')
+    120.0
+    >>> parse_retry_after('Thu, 01 Jan 1970 00:01:40 GMT', now=40)
+    60.0
+    >>> parse_retry_after('Thu, 01 Jan 1970 00:01:40 GMT', now=200)
+    0
+    >>> parse_retry_after('xxx') is None
+    True
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+    if now is None:
+        now = time.time()
+    return max(0, retry_at - now)
+
+
+def get_url_host(url: str) -> typing.Optional[str]:
+    """
+    >>> get_url_host('https://Blog.Example.com:8080/feed.xml')
+    'blog.example.com'
+    >>> get_url_host('/feed.xml') is None
+    True
+    """
+    try:
+        return urlparse(url).hostname or None
+    except ValueError:
+        return None
+
+
+class MemoryRateLimitBackend:
+    """Keep buckets in process memory"""
+
+    def __init__(self, maxsize: int = 10000):
+        self._buckets = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+
+    def modify(self, host: str, fn: typing.Callable[[BucketState], tuple]):
+        """
+        Atomic update bucket of host, fn receive current state and
+        return (new_state, result), the result will be returned.
+        """
+        with self._lock:
+            state, result = fn(self._buckets.get(host, _NEW_BUCKET))
+            self._buckets[host] = state
+        return result
+
+
+class SharedFileRateLimitBackend:
+    """
+    Keep buckets in a fixed size open addressing hash table of a mmap file,
+    guarded by fcntl record lock between processes and thread lock between
+    threads. Slot: (host hash, tokens, updated_at), when probe window is
+    full the least recently updated slot is reused.
+    """
+
+    _SLOT = struct.Struct('<Qdd')
+    _PROBE_SIZE = 8
+
+    def __init__(self, filepath: str, num_slots: int = 4096):
+        self.filepath = filepath
+        self.num_slots = num_slots
+        self._size = self._SLOT.size * num_slots
+        self._pid = None
+        self._fd = None
+        self._mmap = None
+        self._lock = None
+
+    def __repr__(self):
+        return '<{} {} slots={}>'.format(type(self).__name__, self.filepath, self.num_slots)
+
+    def _open(self):
+        # reopen after fork, record lock and thread lock are per process
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        fd = os.open(self.filepath, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.lockf(fd, fcntl.LOCK_EX)
+            if os.fstat(fd).st_size < self._size:
+                os.ftruncate(fd, self._size)
+            fcntl.lockf(fd, fcntl.LOCK_UN)
+            self._mmap = mmap.mmap(fd, self._size)
+        except BaseException:
+            os.close(fd)
+            raise
+        self._fd = fd
+        self._lock = threading.Lock()
+        self._pid = pid
+
+    def close(self):
+        if self._pid != os.getpid():
+            return
+        self._mmap.close()
+        os.close(self._fd)
+        self._pid = self._fd = self._mmap = None
+
+    @staticmethod
+    def _hash_of(host: str) -> int:
+        digest = hashlib.blake2b(host.encode('utf-8'), digest_size=8).digest()
+        # zero is used for empty slot
+        return int.from_bytes(digest, 'little') or 1
+
+    def _find_slot(self, key: int) -> typing.Tuple[int, BucketState]:
+        start = key % self.num_slots
+        victim = None
+        victim_updated_at = None
+        for i in range(self._PROBE_SIZE):
+            index = (start + i) % self.num_slots
+            slot_key, tokens, updated_at = self._SLOT.unpack_from(
+                self._mmap, index * self._SLOT.size)
+            if slot_key == key:
+                return index, (tokens, updated_at)
+            if slot_key == 0:
+                return index, _NEW_BUCKET
+            if victim is None or updated_at < victim_updated_at:
+                victim, victim_updated_at = index, updated_at
+        return victim, _NEW_BUCKET
+
+    def modify(self, host: str, fn: typing.Callable[[BucketState], tuple]):
+        self._open()
+        key = self._hash_of(host)
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX)
+            try:
+                index, state = self._find_slot(key)
+                state, result = fn(state)
+                self._SLOT.pack_into(self._mmap, index * self._SLOT.size, key, *state)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN)
+        return result
+
+
+class HostRateLimiter:
+    """
+    >>> limiter = HostRateLimiter(rate=1, burst=2)
+    >>> limiter.acquire('example.com', now=100)
+    0.0
+    >>> limiter.acquire('example.com', now=100)
+    0.0
+    >>> limiter.acquire('example.com', now=100)
+    1.0
+    >>> limiter.acquire('example.com', now=100, max_wait=1) is None
+    True
+    >>> limiter.block('example.com', 60, now=100)
+    >>> limiter.acquire('example.com', now=100, max_wait=120)
+    62.0
+    """
+
+    def __init__(self, rate: float = 1.0, burst: int = 5, max_wait: float = 10, backend=None):
+        self.rate = rate
+        self.burst = burst
+        self.max_wait = max_wait
+        if backend is None:
+            backend = MemoryRateLimitBackend()
+        self.backend = backend
+
+    def __repr__(self):
+        return '<{} rate={} burst={} backend={!r}>'.format(
+            type(self).__name__, self.rate, self.burst, self.backend)
+
+    @staticmethod
+    def create(
+        rate: float = None,
+        burst: int = None,
+        filepath: str = None,
+    ) -> "HostRateLimiter":
+        if rate is None:
+            rate = CONFIG.host_rate_limit_rate
+        if burst is None:
+            burst = CONFIG.host_rate_limit_burst
+        if filepath is None:
+            filepath = CONFIG.host_rate_limit_file
+        if filepath is None:
+            tmpdir = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+            filepath = os.path.join(tmpdir, 'rssant_host_rate_limit')
+        backend = SharedFileRateLimitBackend(filepath)
+        return HostRateLimiter(rate=rate, burst=burst, backend=backend)
+
+    def _refill(self, state: BucketState, now: float) -> BucketState:
+        tokens, updated_at = state
+        if updated_at <= 0:
+            return float(self.burst), now
+        if now > updated_at:
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            updated_at = now
+        return tokens, updated_at
+
+    def acquire(self, host: str, now: float = None, max_wait: float = None) -> typing.Optional[float]:
+        """
+        Take a token of host, return seconds the caller should wait before
+        send request, or None if need wait longer than max_wait, in which
+        case no token is taken.
+        """
+        if now is None:
+            now = time.time()
+        if max_wait is None:
+            max_wait = self.max_wait
+
+        def take(state):
+            tokens, updated_at = self._refill(state, now)
+            wait = (updated_at - now) + max(0, 1 - tokens) / self.rate
+            if wait > max_wait:
+                return (tokens, updated_at), None
+            return (tokens - 1, updated_at), wait
+
+        return self.backend.modify(host, take)
+
+    def block(self, host: str, seconds: float, now: float = None):
+        """Block host for seconds, eg: honour Retry-After"""
+        if now is None:
+            now = time.time()
+        seconds = min(seconds, _MAX_RETRY_AFTER)
+        block_until = now + seconds
+
+        def update(state):
+            tokens, updated_at = self._refill(state, now)
+            if block_until > updated_at:
+                # allow one request at block end, reserved tokens are kept
+                tokens, updated_at = min(tokens, 1), block_until
+            return (tokens, updated_at), None
+
+        self.backend.modify(host, update)
+
+    def on_response(self, host: str, status: int, headers=None):
+        """Block host by Retry-After of 429 and 503 responses"""
+        if status not in _RETRY_AFTER_STATUS:
+            return
+        retry_after = None
+        if headers:
+            retry_after = parse_retry_after(headers.get('Retry-After'))
+        if retry_after is None:
+            if status != HTTPStatus.TOO_MANY_REQUESTS:
+                return
+            retry_after = _DEFAULT_RETRY_AFTER
+        LOG.info('rate limit block host %s %d seconds, status=%s', host, retry_after, status)
+        self.block(host, retry_after)
+
+    def wait(self, host: str, max_wait: float = None) -> bool:
+        """Wait until host allow request, return False if wait too long"""
+        wait = self.acquire(host, max_wait=max_wait)
+        if wait is None:
+            return False
+        if wait > 0:
+            time.sleep(wait)
+        return True
+
+    async def async_wait(self, host: str, max_wait: float = None) -> bool:
+        wait = self.acquire(host, max_wait=max_wait)
+        if wait is None:
+            return False
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return True
+
+
+HOST_RATE_LIMITER = HostRateLimiter.create()
@@ -2,8 +2,7 @@ from validr import T
 from django.utils import timezone
 
 from rssant.helper.content_hash import compute_hash_base64
-from rssant_feedlib.fulltext import split_sentences
-from rssant_feedlib.processor import story_html_to_text
+from rssant_feedlib.fulltext import StoryContentInfo
 from rssant_common.validator import compiler
 
 
@@ -22,6 +21,10 @@ StorySchema = T.dict(
     summary=T.str.optional,
     content=T.str.optional,
     sentence_count=T.int.min(0).optional,
+    text_length=T.int.min(0).optional,
+    link_count=T.int.min(0).optional,
+    image_count=T.int.min(0).optional,
+    url_count=T.int.min(0).optional,
 )
 
 FeedSchema = T.dict(
@@ -66,7 +69,8 @@ def get_story_of_feed_entry(data, now=None):
     story['iframe_url'] = data['iframe_url']
     story['summary'] = summary
     story['content'] = content
-    story['sentence_count'] = _compute_sentence_count(content)
+    # compute content metrics once at ingest, later fulltext decisions use them
+    story.update(StoryContentInfo(content).get_metrics())
     content_hash_base64 = compute_hash_base64(content, summary, title)
     story['title'] = title
     story['content_hash_base64'] = content_hash_base64
@@ -77,7 +81,3 @@ def get_story_of_feed_entry(data, now=None):
     story['dt_published'] = min(dt_published or dt_updated or now, now)
     story['dt_updated'] = min(dt_updated or dt_published or now, now)
     return story
-
-
-def _compute_sentence_count(content: str) -> int:
-    return len(split_sentences(story_html_to_text(content)))
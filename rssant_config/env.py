@@ -46,10 +46,23 @@ class EnvConfig(ConfigModel):
     feed_story_retention: int = (
         T.int.min(1).default(5000).desc('max storys to keep per feed')
     )
+    feed_story_retention_budget: int = T.int.min(1).default(20000).desc(
+        'max storys deleted by retention per minute, avoid competing with ingest'
+    )
     pg_story_volumes: str = T.str.optional
     feed_reader_request_timeout: int = T.int.default(30).desc(
         'feed reader request timeout'
     )
+    feed_reader_http2_enable: bool = T.bool.default(False).desc(
+        'fetch story by HTTP/2 capable reader, which also decode brotli and zstd'
+    )
+    host_rate_limit_rate: float = T.float.min(0.001).default(1.0).desc(
+        'max requests per second to one host of feed and story fetches'
+    )
+    host_rate_limit_burst: int = T.int.min(1).default(5).desc('max burst requests to one host')
+    host_rate_limit_file: str = T.str.optional.desc(
+        'shared memory file of host rate limiter, shared by worker processes'
+    )
     # postgres database
     pg_host: str = T.str.default('localhost').desc('postgres host')
     pg_port: int = T.int.default(5432).desc('postgres port')
@@ -103,6 +116,8 @@ class EnvConfig(ConfigModel):
     image_proxy_enable: bool = T.bool.default(True)
     image_proxy_urls: bool = T.str.default('origin').desc('逗号分隔的URL列表')
     image_token_expires: float = T.timedelta.min('1s').default('30m')
+    image_proxy_cache_dir: str = T.str.optional.desc('image proxy disk cache dir, disabled if not set')
+    image_proxy_cache_size: int = T.int.min(1).default(1024).desc('image proxy disk cache size in MB')
     detect_story_image_enable: bool = T.bool.default(False)
     # hashid salt
     hashid_salt: str = T.str.default('rssant')
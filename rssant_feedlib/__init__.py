@@ -1,8 +1,10 @@
 from .parser import FeedParser, FeedResult
 from .raw_parser import RawFeedParser, RawFeedResult, FeedParserError
 from .feed_checksum import FeedChecksum
+from .fetch_stats import FeedFetchStats
 from .finder import FeedFinder
 from .reader import FeedReader
 from .async_reader import AsyncFeedReader
+from .http2_reader import Http2FeedReader
 from .response import FeedResponse, FeedContentType, FeedResponseStatus
 from .response_builder import FeedResponseBuilder
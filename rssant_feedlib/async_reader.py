@@ -9,6 +9,11 @@ from urllib.parse import unquote
 import aiodns
 import aiohttp
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 from rssant_common import _proxy_helper
 from rssant_common.dns_service import (
     DNS_SERVICE,
@@ -17,10 +22,12 @@ from rssant_common.dns_service import (
     PrivateAddressError,
 )
 from rssant_common.helper import aiohttp_client_session
+from rssant_common.rate_limiter import HostRateLimiter, get_url_host
 
 from . import cacert
 from .reader import (
-    ContentTooLargeError,
+    MAX_ERROR_CONTENT_LENGTH,
+    ContentBuffer,
     ContentTypeNotSupportError,
     FeedReaderError,
     RSSProxyError,
@@ -33,8 +40,15 @@ from .useragent import DEFAULT_USER_AGENT
 
 LOG = logging.getLogger(__name__)
 
+# aiohttp 3.7 only decode brotli by brotlipy, which Decompressor has decompress method
+_HAS_AIOHTTP_BROTLI = brotli is not None and hasattr(brotli.Decompressor, 'decompress')
+_ACCEPT_ENCODING = 'gzip, deflate, br' if _HAS_AIOHTTP_BROTLI else 'gzip, deflate'
+
 
 class AsyncFeedReader:
+
+    accept_encoding = _ACCEPT_ENCODING
+
     def __init__(
         self,
         user_agent=DEFAULT_USER_AGENT,
@@ -45,6 +59,8 @@ class AsyncFeedReader:
         rss_proxy_url=None,
         rss_proxy_token=None,
         dns_service: DNSService = DNS_SERVICE,
+        rate_limiter: HostRateLimiter = None,
+        rate_limit_max_wait: float = None,
     ):
         self.resolver: aiohttp.AsyncResolver = None
         self.user_agent = user_agent
@@ -56,6 +72,8 @@ class AsyncFeedReader:
         self.rss_proxy_token = rss_proxy_token
         self._use_rss_proxy = self._choice_proxy()
         self.dns_service = dns_service
+        self.rate_limiter = rate_limiter
+        self.rate_limit_max_wait = rate_limit_max_wait
         self._sslcontext = ssl.create_default_context(cafile=cacert.where())
 
     @property
@@ -93,26 +111,24 @@ class AsyncFeedReader:
                 f'content-type {content_type} not support'
             )
 
+    def _create_content_buffer(self, status: int, content_length=None) -> ContentBuffer:
+        if not is_ok_status(status):
+            return ContentBuffer(MAX_ERROR_CONTENT_LENGTH, truncate=True)
+        return ContentBuffer(
+            self.max_content_length,
+            content_length=content_length,
+            sniff=not self.allow_non_webpage,
+        )
+
     async def _read_content(self, response: aiohttp.ClientResponse):
-        content_length = response.headers.get('Content-Length')
-        if content_length:
-            content_length = int(content_length)
-            if content_length > self.max_content_length:
-                msg = 'content length {} larger than limit {}'.format(
-                    content_length, self.max_content_length
-                )
-                raise ContentTooLargeError(msg)
-        content_length = 0
-        content = bytearray()
+        buffer = self._create_content_buffer(
+            response.status,
+            content_length=response.headers.get('Content-Length'),
+        )
         async for chunk in response.content.iter_chunked(8 * 1024):
-            content_length += len(chunk)
-            if content_length > self.max_content_length:
-                msg = 'content length larger than limit {}'.format(
-                    self.max_content_length
-                )
-                raise ContentTooLargeError(msg)
-            content.extend(chunk)
-        return content
+            if not buffer.append(chunk):
+                break
+        return buffer.getvalue()
 
     async def _read_text(self, response: aiohttp.ClientResponse):
         content = await self._read_content(response)
@@ -127,9 +143,9 @@ class AsyncFeedReader:
             headers['User-Agent'] = self.user_agent(url)
         else:
             headers['User-Agent'] = self.user_agent
-        headers['Accept-Encoding'] = 'gzip, deflate'
+        headers['Accept-Encoding'] = self.accept_encoding
         if etag:
-            headers["ETag"] = etag
+            headers["If-None-Match"] = etag
         if last_modified:
             headers["If-Modified-Since"] = last_modified
         if referer:
@@ -236,6 +252,13 @@ class AsyncFeedReader:
     ) -> FeedResponse:
         proxy_msg = self._get_proxy_msg(use_proxy)
         LOG.info('read %s use_proxy=%s', unquote(url), proxy_msg)
+        host = get_url_host(url) if self.rate_limiter else None
+        if host and not await self.rate_limiter.async_wait(host, max_wait=self.rate_limit_max_wait):
+            LOG.info('read %s rate limited', unquote(url))
+            builder = FeedResponseBuilder(use_proxy=use_proxy)
+            builder.url(url)
+            builder.status(FeedResponseStatus.RATE_LIMITED.value)
+            return builder.build()
         headers = content = None
         try:
             if use_proxy:
@@ -293,6 +316,8 @@ class AsyncFeedReader:
             status = ex.status
         except (aiohttp.ClientError, aiohttp.InvalidURL):
             status = FeedResponseStatus.UNKNOWN_ERROR.value
+        if host:
+            self.rate_limiter.on_response(host, status, headers)
         builder = FeedResponseBuilder(use_proxy=use_proxy)
         builder.url(url)
         builder.status(status)
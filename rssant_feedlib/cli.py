@@ -1,10 +1,19 @@
+import asyncio
+import glob
+import gzip
 import logging
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
+import brotli
 import click
+from aiohttp import web
 import slugify
 from pyinstrument import Profiler
 
+from rssant_common.dns_service import DNSService
 from rssant_common.helper import pretty_format_json
 from rssant_api.helper import shorten
 
@@ -12,8 +21,12 @@ from .finder import FeedFinder
 from .raw_parser import RawFeedParser
 from .parser import FeedParser
 from .reader import FeedReader
+from .async_reader import AsyncFeedReader
+from .http2_reader import Http2FeedReader
 from .feed_checksum import FeedChecksum
 from .response_file import FeedResponseFile
+from .html_to_text import html_to_text
+from .content_extractor import story_extract_content, story_extract_content_legacy
 
 
 LOG = logging.getLogger(__name__)
@@ -212,5 +225,131 @@ def parse(
         )
 
 
+def _do_extract(filepath, story_link, printer):
+    with open(filepath) as f:
+        html = f.read()
+    t0 = time.monotonic()
+    legacy_content = story_extract_content_legacy(html, story_link)
+    t1 = time.monotonic()
+    content = story_extract_content(html, story_link)
+    t2 = time.monotonic()
+    legacy_text = html_to_text(legacy_content) if legacy_content else ''
+    text = html_to_text(content) if content else ''
+    ratio = len(text) / max(len(legacy_text), 1)
+    print('-> {} size={} legacy={:.1f}ms extract={:.1f}ms text={}/{} ratio={:.2f}'.format(
+        os.path.basename(filepath), len(html), (t1 - t0) * 1000, (t2 - t1) * 1000,
+        len(text), len(legacy_text), ratio))
+    printer(shorten(text, 300))
+    return t1 - t0, t2 - t1
+
+
+@cli.command()
+@click.argument('filepaths', nargs=-1, required=True)
+@click.option('--url', help='story link of the web pages')
+@click.option('--no-content', is_flag=True, help='Do not print extracted content')
+@click.option('--profile', is_flag=True, help='Run pyinstrument profile')
+def extract(filepaths, url=None, no_content=False, profile=False):
+    """
+    Benchmark content extractor against the legacy readability pipeline
+    on saved HTML files or directories of *.html files.
+    """
+    printer = Printer(profile or no_content)
+    files = []
+    for filepath in filepaths:
+        filepath = _normalize_path(filepath)
+        if os.path.isdir(filepath):
+            files.extend(sorted(glob.glob(os.path.join(filepath, '*.html'))))
+        else:
+            files.append(filepath)
+    total_legacy = total_extract = 0
+    with ProfilerContext(profile):
+        for filepath in files:
+            t_legacy, t_extract = _do_extract(filepath, url, printer=printer)
+            total_legacy += t_legacy
+            total_extract += t_extract
+    print('-> {} files, legacy={:.1f}ms extract={:.1f}ms'.format(
+        len(files), total_legacy * 1000, total_extract * 1000))
+
+
+def _start_bench_server(content: bytes, port: int = 0) -> str:
+    """Serve content in background thread, compressed by Accept-Encoding"""
+    bodies = {'br': brotli.compress(content), 'gzip': gzip.compress(content)}
+
+    async def handler(request):
+        accept_encoding = request.headers.get('Accept-Encoding', '')
+        headers = {'Content-Type': 'application/xml; charset=utf-8'}
+        for encoding in ['br', 'gzip']:
+            if encoding in accept_encoding:
+                headers['Content-Encoding'] = encoding
+                return web.Response(body=bodies[encoding], headers=headers)
+        return web.Response(body=content, headers=headers)
+
+    loop = asyncio.new_event_loop()
+    app = web.Application()
+    app.router.add_get('/feed', handler)
+    runner = web.AppRunner(app, access_log=None)
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, '127.0.0.1', port)
+    loop.run_until_complete(site.start())
+    port = site._server.sockets[0].getsockname()[1]
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return f'http://127.0.0.1:{port}/feed'
+
+
+def _bench_sync_reader(url, num, concurrency, **options):
+    with FeedReader(**options) as reader:
+        with ThreadPoolExecutor(concurrency) as executor:
+            return list(executor.map(lambda __: reader.read(url), range(num)))
+
+
+async def _bench_async_reader(reader_class, url, num, concurrency, **options):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def read(reader):
+        async with semaphore:
+            return await reader.read(url)
+
+    async with reader_class(**options) as reader:
+        return await asyncio.gather(*[read(reader) for __ in range(num)])
+
+
+def _do_bench_reader(name, bench, num):
+    t0 = time.monotonic()
+    responses = bench()
+    cost = time.monotonic() - t0
+    num_ok = sum(1 for x in responses if x.ok)
+    size = sum(len(x.content or b'') for x in responses)
+    print('-> {:<16} ok={}/{} cost={:.3f}s {:.1f}req/s size={}'.format(
+        name, num_ok, num, cost, num / cost, size))
+
+
+@cli.command()
+@click.option('--url', help='benchmark url, default serve file on local test server')
+@click.option('--file', 'filepath', help='content file of local test server')
+@click.option('-n', '--num', type=int, default=200, help='number of requests')
+@click.option('-c', '--concurrency', type=int, default=10, help='concurrent requests')
+def bench_reader(url=None, filepath=None, num=200, concurrency=10):
+    """
+    Benchmark FeedReader, AsyncFeedReader and Http2FeedReader. The local
+    test server is plain HTTP/1.1, use --url for HTTP/2 servers.
+    """
+    logging.getLogger('rssant_feedlib').setLevel(logging.WARNING)
+    logging.getLogger('urllib3').setLevel(logging.ERROR)
+    if not url:
+        if filepath:
+            with open(_normalize_path(filepath), 'rb') as f:
+                content = f.read()
+        else:
+            content = b'<rss><channel>' + b'<item>hello world</item>' * 5000 + b'</channel></rss>'
+        url = _start_bench_server(content)
+    options = dict(dns_service=DNSService.create(allow_private_address=True))
+    print(f'-> bench {url} num={num} concurrency={concurrency}')
+    _do_bench_reader('FeedReader', lambda: _bench_sync_reader(
+        url, num, concurrency, **options), num)
+    for reader_class in [AsyncFeedReader, Http2FeedReader]:
+        _do_bench_reader(reader_class.__name__, lambda: asyncio.run(_bench_async_reader(
+            reader_class, url, num, concurrency, **options)), num)
+
+
 if __name__ == "__main__":
     cli()
@@ -0,0 +1,185 @@
+"""
+Streaming decoders of HTTP Content-Encoding, output size is bounded so
+compressed bombs are rejected before fully decompressed.
+
+Brotli and zstd are supported if brotli and zstandard package installed.
+"""
+import typing
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from .reader import ContentDecodingError, ContentTooLargeError
+
+# brotli and zstd decompressors has no output limit, feed input by slices
+_DECODE_SLICE_SIZE = 1024
+
+
+def _decode_slices(decompress, data: bytes, max_length: typing.Optional[int]) -> bytes:
+    """
+    Decompress data slice by slice, stop once output larger than max_length,
+    so output size is bounded by max_length plus output of one slice.
+
+    >>> len(_decode_slices(lambda x: x * 2, b'x' * 3000, max_length=100))
+    2048
+    >>> len(_decode_slices(lambda x: x * 2, b'x' * 3000, max_length=None))
+    6000
+    """
+    if max_length is None:
+        return decompress(data)
+    output = []
+    length = 0
+    for i in range(0, len(data), _DECODE_SLICE_SIZE):
+        chunk = decompress(data[i:i + _DECODE_SLICE_SIZE])
+        output.append(chunk)
+        length += len(chunk)
+        # content too large, the rest input is useless
+        if length > max_length:
+            break
+    return b''.join(output)
+
+
+class _IdentityDecoder:
+    def decode(self, data: bytes, max_length: typing.Optional[int]) -> bytes:
+        return data
+
+    def flush(self) -> bytes:
+        return b''
+
+
+class _ZlibDecoder:
+    def __init__(self, wbits: int):
+        self._wbits = wbits
+        self._obj = None
+
+    def decode(self, data: bytes, max_length: typing.Optional[int]) -> bytes:
+        if self._obj is None:
+            wbits = self._wbits
+            # some servers send raw deflate stream without zlib header, see RFC 1950
+            if wbits == zlib.MAX_WBITS and data and data[0] & 0x0F != 8:
+                wbits = -zlib.MAX_WBITS
+            self._obj = zlib.decompressobj(wbits=wbits)
+        if max_length is None:
+            return self._obj.decompress(data)
+        # at most max_length + 1 bytes, enough to know content too large
+        return self._obj.decompress(data, max_length + 1)
+
+    def flush(self) -> bytes:
+        if self._obj is None:
+            return b''
+        return self._obj.flush()
+
+
+class _BrotliDecoder:
+    def __init__(self):
+        self._obj = brotli.Decompressor()
+        # brotlipy use decompress, google brotli use process
+        self._decompress = getattr(self._obj, 'decompress', None) or self._obj.process
+
+    def decode(self, data: bytes, max_length: typing.Optional[int]) -> bytes:
+        return _decode_slices(self._decompress, data, max_length)
+
+    def flush(self) -> bytes:
+        flush = getattr(self._obj, 'flush', None)
+        return flush() if flush else b''
+
+
+class _ZstdDecoder:
+    def __init__(self):
+        self._obj = zstandard.ZstdDecompressor().decompressobj()
+
+    def decode(self, data: bytes, max_length: typing.Optional[int]) -> bytes:
+        return _decode_slices(self._obj.decompress, data, max_length)
+
+    def flush(self) -> bytes:
+        return b''
+
+
+_DECODERS = {
+    'identity': _IdentityDecoder,
+    'gzip': lambda: _ZlibDecoder(16 + zlib.MAX_WBITS),
+    'x-gzip': lambda: _ZlibDecoder(16 + zlib.MAX_WBITS),
+    'deflate': lambda: _ZlibDecoder(zlib.MAX_WBITS),
+}
+if brotli is not None:
+    _DECODERS['br'] = _BrotliDecoder
+if zstandard is not None:
+    _DECODERS['zstd'] = _ZstdDecoder
+
+ACCEPT_ENCODING = ', '.join(x for x in ['gzip', 'deflate', 'br', 'zstd'] if x in _DECODERS)
+
+
+class ContentDecoder:
+    """
+    Decode chunks of response body, raise ContentTooLargeError if decoded
+    content larger than max_length.
+
+    >>> import gzip
+    >>> decoder = ContentDecoder('gzip', max_length=100)
+    >>> decoder.decode(gzip.compress(b'hello')) + decoder.flush()
+    b'hello'
+    >>> decoder = ContentDecoder('gzip', max_length=100)
+    >>> decoder.decode(gzip.compress(b'x' * 1000))
+    Traceback (most recent call last):
+    ...
+    rssant_feedlib.reader.ContentTooLargeError: content length larger than limit 100
+    >>> ContentDecoder('compress', max_length=100)
+    Traceback (most recent call last):
+    ...
+    rssant_feedlib.reader.ContentDecodingError: content-encoding 'compress' not support
+    """
+
+    def __init__(self, content_encoding: typing.Optional[str], max_length: int):
+        self.max_length = max_length
+        self.length = 0
+        self._decoders = []
+        encodings = (content_encoding or '').lower().split(',')
+        # the last applied encoding is listed last, decode in reverse order
+        for encoding in reversed(encodings):
+            encoding = encoding.strip()
+            if not encoding:
+                continue
+            decoder_class = _DECODERS.get(encoding)
+            if decoder_class is None:
+                raise ContentDecodingError(f'content-encoding {encoding!r} not support')
+            self._decoders.append(decoder_class())
+
+    def _check_length(self, data: bytes) -> bytes:
+        self.length += len(data)
+        if self.length > self.max_length:
+            raise ContentTooLargeError(f'content length larger than limit {self.max_length}')
+        return data
+
+    def _decode(self, decoder, data: bytes) -> bytes:
+        # only output of the last decoder is bounded
+        max_length = None
+        if decoder is self._decoders[-1]:
+            max_length = self.max_length - self.length
+        return decoder.decode(data, max_length)
+
+    def decode(self, data: bytes) -> bytes:
+        try:
+            for decoder in self._decoders:
+                data = self._decode(decoder, data)
+        except Exception as ex:
+            raise ContentDecodingError(f'{type(ex).__name__}: {ex}') from ex
+        return self._check_length(data)
+
+    def flush(self) -> bytes:
+        data = b''
+        try:
+            for decoder in self._decoders:
+                if data:
+                    data = self._decode(decoder, data)
+                data += decoder.flush()
+        except Exception as ex:
+            raise ContentDecodingError(f'{type(ex).__name__}: {ex}') from ex
+        return self._check_length(data)
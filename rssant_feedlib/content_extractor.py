@@ -0,0 +1,299 @@
+"""
+Single parse story content extractor.
+
+The previous pipeline (story_html_clean -> story_readability ->
+process_story_links) parse the web page three times, and python-readability
+compute text length and link density for each candidate by walking its
+whole subtree. Here the page is parsed once, text length, link text length,
+comma count and block flags of all elements are computed bottom-up in one
+pass, then candidates are scored with the same rules as python-readability.
+"""
+import logging
+import re
+
+import lxml.html
+import readability.cleaners
+from django.utils.html import escape as html_escape
+from readability.readability import REGEXES
+
+from .helper import LXMLError, lxml_call
+from .processor import (
+    lxml_story_html_cleaner,
+    process_story_dom_links,
+    process_story_links,
+    story_html_clean,
+    story_readability,
+)
+
+LOG = logging.getLogger(__name__)
+
+# the same as python-readability defaults
+_MIN_TEXT_LENGTH = 25
+_RETRY_LENGTH = 250
+
+# div which not contains these tags is treated as paragraph
+_BLOCK_TAGS = frozenset([
+    'a', 'blockquote', 'dl', 'div', 'img', 'ol', 'p', 'pre', 'table', 'ul',
+])
+_PARAGRAPH_TAGS = frozenset(['p', 'pre', 'td'])
+_KEEP_TAGS = frozenset(['html', 'body'])
+_CONDITIONAL_CLEAN_TAGS = frozenset(['table', 'ul', 'div', 'aside', 'form', 'nav'])
+_HEADER_TAGS = frozenset(['h1', 'h2', 'h3', 'h4', 'h5', 'h6'])
+
+_TAG_WEIGHTS = {}
+_TAG_WEIGHTS.update(dict.fromkeys(['div', 'article'], 5))
+_TAG_WEIGHTS.update(dict.fromkeys(['pre', 'td', 'blockquote'], 3))
+_TAG_WEIGHTS.update(dict.fromkeys([
+    'address', 'ol', 'ul', 'dl', 'dd', 'dt', 'li', 'form', 'aside'], -3))
+_TAG_WEIGHTS.update(dict.fromkeys([
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'th', 'header', 'footer', 'nav'], -5))
+
+RE_COMMA = re.compile(r'[,，]')
+RE_SENTENCE_END = re.compile(r'[.。]( |$)')
+
+
+def _class_weight(el) -> int:
+    weight = 0
+    for feature in (el.get('class'), el.get('id')):
+        if feature:
+            if REGEXES['negativeRe'].search(feature):
+                weight -= 25
+            if REGEXES['positiveRe'].search(feature):
+                weight += 25
+    return weight
+
+
+def _is_unlikely(el) -> bool:
+    if el.tag in _KEEP_TAGS:
+        return False
+    s = '{} {}'.format(el.get('class', ''), el.get('id', ''))
+    if len(s) < 2:
+        return False
+    return bool(
+        REGEXES['unlikelyCandidatesRe'].search(s)
+        and not REGEXES['okMaybeItsACandidateRe'].search(s)
+    )
+
+
+class _NodeStats:
+
+    __slots__ = ('text_length', 'link_length', 'comma_count', 'has_block')
+
+    def __init__(self):
+        self.text_length = 0
+        self.link_length = 0
+        self.comma_count = 0
+        self.has_block = False
+
+    @property
+    def link_density(self) -> float:
+        return self.link_length / max(self.text_length, 1)
+
+
+_EMPTY_STATS = _NodeStats()
+
+
+class _ContentScorer:
+    """Score elements of a cleaned lxml tree, see python-readability"""
+
+    def __init__(self, root):
+        self.root = root
+        # pre-order, ancestors always come before descendants
+        self._nodes = [x for x in root.iter() if isinstance(x.tag, str)]
+        self._unlikely = self._find_unlikely()
+        self.ruthless = True
+        self._stats = {}
+        self.candidates = {}
+
+    def _find_unlikely(self) -> set:
+        unlikely = set()
+        for el in self._nodes:
+            parent = el.getparent()
+            if parent in unlikely or _is_unlikely(el):
+                unlikely.add(el)
+        return unlikely
+
+    def _is_skipped(self, el) -> bool:
+        return self.ruthless and el in self._unlikely
+
+    def stats(self, el) -> _NodeStats:
+        return self._stats.get(el, _EMPTY_STATS)
+
+    def _compute_stats(self):
+        self._stats = all_stats = {}
+        # reverse of pre-order, descendants always come before ancestors
+        for el in reversed(self._nodes):
+            stats = _NodeStats()
+            all_stats[el] = stats
+            if self._is_skipped(el):
+                continue
+            text = el.text
+            if text:
+                stats.text_length = len(text.strip())
+                stats.comma_count = len(RE_COMMA.findall(text))
+            for child in el:
+                child_stats = all_stats.get(child)
+                if child_stats is not None:
+                    stats.text_length += child_stats.text_length
+                    stats.link_length += child_stats.link_length
+                    stats.comma_count += child_stats.comma_count
+                    if child.tag in _BLOCK_TAGS or child_stats.has_block:
+                        stats.has_block = True
+                tail = child.tail
+                if tail:
+                    stats.text_length += len(tail.strip())
+                    stats.comma_count += len(RE_COMMA.findall(tail))
+            if el.tag == 'a':
+                stats.link_length = stats.text_length
+
+    def _is_paragraph(self, el) -> bool:
+        if el.tag in _PARAGRAPH_TAGS:
+            return True
+        return el.tag == 'div' and not self.stats(el).has_block
+
+    def _new_candidate(self, el) -> float:
+        return _class_weight(el) + _TAG_WEIGHTS.get(el.tag, 0)
+
+    def score(self):
+        self._compute_stats()
+        self.candidates = candidates = {}
+        for el in self._nodes:
+            if self._is_skipped(el) or not self._is_paragraph(el):
+                continue
+            parent = el.getparent()
+            if parent is None:
+                continue
+            stats = self.stats(el)
+            if stats.text_length < _MIN_TEXT_LENGTH:
+                continue
+            grand_parent = parent.getparent()
+            if parent not in candidates:
+                candidates[parent] = self._new_candidate(parent)
+            if grand_parent is not None and grand_parent not in candidates:
+                candidates[grand_parent] = self._new_candidate(grand_parent)
+            content_score = 1 + (stats.comma_count + 1) + min(stats.text_length / 100, 3)
+            candidates[parent] += content_score
+            if grand_parent is not None:
+                candidates[grand_parent] += content_score / 2.0
+        for el in candidates:
+            candidates[el] *= 1 - self.stats(el).link_density
+        return candidates
+
+    def select_article(self) -> list:
+        """Select best candidate and its related siblings"""
+        candidates = self.candidates
+        if not candidates:
+            return []
+        best_elem = max(candidates, key=candidates.get)
+        threshold = max(10, candidates[best_elem] * 0.2)
+        parent = best_elem.getparent()
+        siblings = list(parent) if parent is not None else [best_elem]
+        article = []
+        for sibling in siblings:
+            if not isinstance(sibling.tag, str) or self._is_skipped(sibling):
+                continue
+            append = sibling is best_elem
+            if sibling in candidates and candidates[sibling] >= threshold:
+                append = True
+            if sibling.tag == 'p':
+                link_density = self.stats(sibling).link_density
+                node_content = sibling.text or ''
+                if len(node_content) > 80 and link_density < 0.25:
+                    append = True
+                elif len(node_content) <= 80 and link_density == 0 \
+                        and RE_SENTENCE_END.search(node_content):
+                    append = True
+            if append:
+                article.append(sibling)
+        return article
+
+    def article_length(self, article) -> int:
+        return sum(self.stats(x).text_length for x in article)
+
+    def _should_remove(self, el) -> bool:
+        if el.tag in _HEADER_TAGS:
+            return _class_weight(el) < 0 or self.stats(el).link_density > 0.33
+        if el.tag not in _CONDITIONAL_CLEAN_TAGS:
+            return False
+        weight = _class_weight(el) + self.candidates.get(el, 0)
+        if weight < 0:
+            return True
+        stats = self.stats(el)
+        if stats.comma_count >= 10:
+            return False
+        link_density = stats.link_density
+        if weight < 25 and link_density > 0.2:
+            return True
+        if weight >= 25 and link_density > 0.5:
+            return True
+        return False
+
+    def sanitize(self, article):
+        """Drop unlikely and low quality elements inside article"""
+        removes = []
+        for top in article:
+            for el in top.iterdescendants():
+                if not isinstance(el.tag, str):
+                    continue
+                if self._is_skipped(el) or self._should_remove(el):
+                    removes.append(el)
+        # descendants of removed element are also in the list, skip them
+        removes_set = set(removes)
+        for el in removes:
+            if el.getparent() not in removes_set:
+                el.drop_tree()
+
+
+def _extract_article(root):
+    scorer = _ContentScorer(root)
+    scorer.score()
+    article = scorer.select_article()
+    if scorer.article_length(article) < _RETRY_LENGTH:
+        # ruthless removal did not work, try again without remove unlikely
+        scorer.ruthless = False
+        scorer.score()
+        article = scorer.select_article()
+    if not article:
+        article = [root]
+    scorer.sanitize(article)
+    output = lxml.html.Element('div')
+    for el in article:
+        if el is root:
+            output.text = root.text
+            output.extend(list(root))
+        else:
+            el.tail = None
+            output.append(el)
+    return output
+
+
+def story_extract_content(content: str, story_link: str = None) -> str:
+    """
+    Extract main content of story web page, parse HTML only once.
+
+    >>> content = '<p>hello <b>world</b><br>你好<i>世界</i></p>'
+    >>> print(story_extract_content(content))
+    <div><p>hello <b>world</b><br>你好<i>世界</i></p></div>
+    >>> content = '<a href="/story/1.html">汉字</a>'
+    >>> print(story_extract_content(content, 'http://blog.example.com/'))
+    <div><a href="http://blog.example.com/story/1.html" rel="nofollow" target="_blank">汉字</a></div>
+    """
+    if (not content) or (not content.strip()):
+        return ""
+    try:
+        root = lxml_call(lxml.html.document_fromstring, content)
+        lxml_story_html_cleaner(root)
+    except LXMLError as ex:
+        LOG.info(f'lxml unable to parse content: {ex} content={content!r}', exc_info=ex)
+        return html_escape(content)
+    output = _extract_article(root)
+    process_story_dom_links(output, story_link)
+    result = lxml.html.tostring(output, encoding='unicode')
+    return readability.cleaners.clean_attributes(result)
+
+
+def story_extract_content_legacy(content: str, story_link: str = None) -> str:
+    """The previous clean, readability and process links pipeline"""
+    content = story_html_clean(content)
+    content = story_readability(content)
+    return process_story_links(content, story_link)
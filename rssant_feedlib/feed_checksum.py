@@ -1,10 +1,37 @@
-from typing import List, Tuple
-from collections import OrderedDict
-import itertools
+from typing import List, Tuple, Iterable
+from array import array
+import sys
 import struct
 import hashlib
 
 
+_BYTEORDER = sys.byteorder
+
+
+def _md5_hash(value: str, length: int) -> int:
+    digest = hashlib.md5(value.encode('utf-8')).digest()[:length]
+    return int.from_bytes(digest, _BYTEORDER)
+
+
+def _blake2b_hash(value: str, length: int) -> int:
+    digest = hashlib.blake2b(value.encode('utf-8'), digest_size=length).digest()
+    return int.from_bytes(digest, _BYTEORDER)
+
+
+# version => hash function, version 1 keep md5 to be compatible with stored data
+_HASH_FUNCS = {
+    1: _md5_hash,
+    2: _blake2b_hash,
+}
+
+_DEFAULT_VERSION = 2
+
+_KEY_TYPECODE = 'I'
+_VAL_TYPECODE = 'Q'
+assert array(_KEY_TYPECODE).itemsize == 4
+assert array(_VAL_TYPECODE).itemsize == 8
+
+
 class FeedChecksum:
     """
     size of 300 items: (4 + 8) * 300 = 3.6KB, can not compress
@@ -13,20 +40,41 @@ class FeedChecksum:
     +---------+----------------------+------------------------+
     | version |     ident_hash ...   |     content_hash ...   |
     +---------+----------------------+------------------------+
+
+    version 1: md5 hash, version 2: blake2b hash, the layout is the same.
+
+    Items are stored in two array columns with the same layout as dumped
+    data, plus a dict index of ident_hash -> position, so dump and load
+    only copy buffers instead of building objects item by item.
     """
 
     _key_len = 4
     _val_len = 8
     _key_val_len = _key_len + _val_len
 
-    def __init__(self, items: List[Tuple[bytes, bytes]] = None, version: int = 1):
-        if version != 1:
-            raise ValueError(f'not support version {version}')
+    def __init__(self, items: List[Tuple[bytes, bytes]] = None, version: int = None):
+        if version is None:
+            version = _DEFAULT_VERSION
+        self._hash = self._get_hash_func(version)
         self.version = version
-        self._map = OrderedDict()
+        self._keys = array(_KEY_TYPECODE)
+        self._vals = array(_VAL_TYPECODE)
+        self._index = {}
         for key, value in items or []:
             self._check_key_value(key, value)
-            self._map[key] = value
+            self._set(self._to_int(key), self._to_int(value))
+
+    @staticmethod
+    def _get_hash_func(version: int):
+        hash_func = _HASH_FUNCS.get(version)
+        if hash_func is None:
+            raise ValueError(f'not support version {version}')
+        return hash_func
+
+    @staticmethod
+    def _to_int(value: bytes) -> int:
+        # the same byte order as array, so dump keep the original bytes
+        return int.from_bytes(value, _BYTEORDER)
 
     def __repr__(self):
         return '<{} version={} size={}>'.format(
@@ -35,17 +83,30 @@ class FeedChecksum:
     def __eq__(self, other):
         if not isinstance(other, type(self)):
             return False
-        return (self.version == other.version and self._map == other._map)
+        return (
+            self.version == other.version
+            and self._keys == other._keys
+            and self._vals == other._vals
+        )
 
     def size(self) -> int:
-        return len(self._map)
+        return len(self._keys)
 
     def copy(self) -> "FeedChecksum":
-        items = list(self._map.items())
-        return FeedChecksum(items, version=self.version)
+        checksum = FeedChecksum(version=self.version)
+        checksum._keys = array(_KEY_TYPECODE, self._keys)
+        checksum._vals = array(_VAL_TYPECODE, self._vals)
+        checksum._index = self._index.copy()
+        return checksum
 
-    def _hash(self, value: str, length: int) -> bytes:
-        return hashlib.md5(value.encode('utf-8')).digest()[:length]
+    def _set(self, key: int, value: int):
+        pos = self._index.get(key)
+        if pos is None:
+            self._index[key] = len(self._keys)
+            self._keys.append(key)
+            self._vals.append(value)
+        else:
+            self._vals[pos] = value
 
     def update(self, ident: str, content: str) -> bool:
         """
@@ -56,13 +117,28 @@ class FeedChecksum:
         if not ident:
             raise ValueError('ident can not be empty')
         key = self._hash(ident, self._key_len)
-        old_sum = self._map.get(key)
         new_sum = self._hash(content, self._val_len)
-        if (not old_sum) or old_sum != new_sum:
-            self._map[key] = new_sum
+        pos = self._index.get(key)
+        if pos is None:
+            self._index[key] = len(self._keys)
+            self._keys.append(key)
+            self._vals.append(new_sum)
+            return True
+        if self._vals[pos] != new_sum:
+            self._vals[pos] = new_sum
             return True
         return False
 
+    def batch_update(self, idents: Iterable[str], contents: Iterable[str]) -> List[bool]:
+        """
+        Update many items at once, return is updated flags in the same order.
+        The result is the same as call update one by one.
+        """
+        return [
+            self.update(ident, content)
+            for ident, content in zip(idents, contents)
+        ]
+
     def _check_key_value(self, key: bytes, value: bytes):
         if len(key) != self._key_len:
             raise ValueError(f'key length must be {self._key_len} bytes')
@@ -70,34 +146,24 @@ class FeedChecksum:
             raise ValueError(f'value length must be {self._val_len} bytes')
 
     def dump(self, limit=None) -> bytes:
-        length = len(self._map)
-        keys_buffer = bytearray()
-        vals_buffer = bytearray()
-        version_bytes = struct.pack('>B', self.version)
-        items = self._map.items()
+        length = len(self._keys)
+        keys = self._keys
+        vals = self._vals
         if limit is not None and length > limit:
-            items = itertools.islice(items, length - limit, length)
-        for key, value in items:
-            self._check_key_value(key, value)
-            keys_buffer.extend(key)
-            vals_buffer.extend(value)
-        return version_bytes + keys_buffer + vals_buffer
+            keys = keys[length - limit:]
+            vals = vals[length - limit:]
+        version_bytes = struct.pack('>B', self.version)
+        return version_bytes + keys.tobytes() + vals.tobytes()
 
     @classmethod
     def load(cls, data: bytes) -> "FeedChecksum":
         version = struct.unpack('>B', data[:1])[0]
-        if version != 1:
-            raise ValueError(f'not support version {version}')
+        checksum = cls(version=version)
         n, remain = divmod(len(data) - 1, cls._key_val_len)
         if remain != 0:
             raise ValueError(f'unexpect data length {len(data)}')
-        keys_buffer = memoryview(data)[1: 1 + n * cls._key_len]
-        vals_buffer = memoryview(data)[1 + n * cls._key_len:]
-        key_packer = struct.Struct(str(cls._key_len) + 's')
-        val_packer = struct.Struct(str(cls._val_len) + 's')
-        items = []
-        keys_iter = key_packer.iter_unpack(keys_buffer)
-        vals_iter = val_packer.iter_unpack(vals_buffer)
-        for (key,), (value,) in zip(keys_iter, vals_iter):
-            items.append((key, value))
-        return cls(items, version=version)
+        buffer = memoryview(data)
+        checksum._keys.frombytes(buffer[1: 1 + n * cls._key_len])
+        checksum._vals.frombytes(buffer[1 + n * cls._key_len:])
+        checksum._index = dict(zip(checksum._keys, range(n)))
+        return checksum
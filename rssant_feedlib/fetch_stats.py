@@ -0,0 +1,251 @@
+"""
+Learned conditional request behavior of a feed server.
+
+Many servers ignore If-None-Match / If-Modified-Since but return the same
+body, some change ETag on every request while body not changed. The stats
+record how the server behaved on previous fetches, and decide:
+
+    - which conditional headers are worth sending
+    - whether a cheap probe (HEAD or Range of the first bytes) can tell
+      the feed not modified, instead of downloading the full body
+    - how much the check interval can be stretched for stable feeds
+"""
+import hashlib
+import struct
+import typing
+
+# size of the content prefix used by Range probe
+PREFIX_SIZE = 4096
+
+PROBE_HEAD = 'HEAD'
+PROBE_RANGE = 'RANGE'
+
+# consecutive unchanged fetches before try probe
+_PROBE_MIN_UNCHANGED = 2
+# force full fetch after these consecutive probes, in case probe missed changes
+_MAX_CONSECUTIVE_PROBES = 6
+# assume server ignore conditional headers after these 200 responses of unchanged body
+_MIN_IGNORED = 4
+# re-send conditional headers periodically to re-learn server behavior
+_RELEARN_PERIOD = 32
+# check interval factor grow by 1 for each N consecutive unchanged fetches
+_UNCHANGED_PER_FACTOR = 8
+MAX_INTERVAL_FACTOR = 4
+
+_MAX_COUNT = 255
+
+_FLAG_RANGES_UNSUPPORTED = 1
+
+
+class FeedProbe(typing.NamedTuple):
+    status: int
+    etag: typing.Optional[str] = None
+    last_modified: typing.Optional[str] = None
+    content_length: typing.Optional[int] = None
+    prefix_hash: typing.Optional[int] = None
+
+
+def prefix_hash_of(content: bytes) -> int:
+    digest = hashlib.blake2b(content[:PREFIX_SIZE], digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+
+class FeedFetchStats:
+    """
+    size: 21 bytes, big-endian
+    +---------+---------------------------------+---------+--------+-------------+
+    | 1 byte  |          7 * 1 byte             | 1 byte  | 4 byte |   8 byte    |
+    +---------+---------------------------------+---------+--------+-------------+
+    | version | num_fetch ... num_probe counter |  flags  | length | prefix_hash |
+    +---------+---------------------------------+---------+--------+-------------+
+
+    Counters saturate at 255, num_fetch wraps and is used to re-send
+    conditional headers periodically.
+
+    >>> stats = FeedFetchStats()
+    >>> stats.conditional_headers('"v1"', 'Mon, 01 Jan 2024 00:00:00 GMT')
+    ('"v1"', 'Mon, 01 Jan 2024 00:00:00 GMT')
+    >>> for i in range(5):
+    ...     stats.record_fetch(b'hello', etag=f'"v{i+2}"', etag_changed=True,
+    ...                        last_modified=None, last_modified_changed=False,
+    ...                        is_conditional=True, is_unchanged=True)
+    >>> stats.conditional_headers('"v6"', None)
+    (None, None)
+    >>> stats.probe_method('"v6"', None)
+    'RANGE'
+    >>> FeedFetchStats.load(stats.dump()) == stats
+    True
+    """
+
+    _FORMAT = struct.Struct('>BBBBBBBBBIQ')
+    _VERSION = 1
+
+    __slots__ = (
+        'num_fetch',
+        'num_not_modified',
+        'num_ignored',
+        'num_etag_unstable',
+        'num_last_modified_unstable',
+        'num_unchanged',
+        'num_probe',
+        'flags',
+        'content_length',
+        'prefix_hash',
+    )
+
+    def __init__(self):
+        self.num_fetch = 0
+        self.num_not_modified = 0
+        self.num_ignored = 0
+        self.num_etag_unstable = 0
+        self.num_last_modified_unstable = 0
+        self.num_unchanged = 0
+        self.num_probe = 0
+        self.flags = 0
+        self.content_length = 0
+        self.prefix_hash = 0
+
+    def _values(self) -> tuple:
+        return tuple(getattr(self, k) for k in self.__slots__)
+
+    def __eq__(self, other):
+        return isinstance(other, FeedFetchStats) and self._values() == other._values()
+
+    def __repr__(self):
+        return '<{} fetch={} not_modified={} ignored={} unchanged={} probe={}>'.format(
+            type(self).__name__, self.num_fetch, self.num_not_modified,
+            self.num_ignored, self.num_unchanged, self.num_probe)
+
+    def dump(self) -> bytes:
+        return self._FORMAT.pack(self._VERSION, *self._values())
+
+    @classmethod
+    def load(cls, data: bytes) -> "FeedFetchStats":
+        """Load from dumped data, return empty stats if data invalid"""
+        stats = cls()
+        if not data or len(data) != cls._FORMAT.size or data[0] != cls._VERSION:
+            return stats
+        values = cls._FORMAT.unpack(data)[1:]
+        for key, value in zip(cls.__slots__, values):
+            setattr(stats, key, value)
+        return stats
+
+    @staticmethod
+    def _incr(value: int) -> int:
+        return min(_MAX_COUNT, value + 1)
+
+    @property
+    def is_ranges_unsupported(self) -> bool:
+        return bool(self.flags & _FLAG_RANGES_UNSUPPORTED)
+
+    @property
+    def is_etag_stable(self) -> bool:
+        return self.num_etag_unstable < 2
+
+    @property
+    def is_last_modified_stable(self) -> bool:
+        return self.num_last_modified_unstable < 2
+
+    @property
+    def is_conditional_ignored(self) -> bool:
+        """Server never responded 304 for requests which body not changed"""
+        return self.num_not_modified <= 0 and self.num_ignored >= _MIN_IGNORED
+
+    def _is_relearn(self) -> bool:
+        return self.num_fetch % _RELEARN_PERIOD == 0
+
+    def conditional_headers(self, etag: str, last_modified: str) -> tuple:
+        """Return (etag, last_modified) worth sending as conditional headers"""
+        if self._is_relearn():
+            return etag, last_modified
+        if self.is_conditional_ignored:
+            return None, None
+        if not self.is_etag_stable:
+            etag = None
+        if not self.is_last_modified_stable:
+            last_modified = None
+        return etag, last_modified
+
+    def probe_method(self, etag: str, last_modified: str) -> typing.Optional[str]:
+        """Return probe method if the probe is cheaper than full fetch, or None"""
+        if not self.is_conditional_ignored or self._is_relearn():
+            return None
+        if self.num_unchanged < _PROBE_MIN_UNCHANGED:
+            return None
+        if self.num_probe >= _MAX_CONSECUTIVE_PROBES:
+            return None
+        if (etag and self.is_etag_stable) or (last_modified and self.is_last_modified_stable):
+            return PROBE_HEAD
+        if self.content_length and self.prefix_hash and not self.is_ranges_unsupported:
+            return PROBE_RANGE
+        return None
+
+    def is_probe_unchanged(self, probe: FeedProbe, etag: str, last_modified: str) -> bool:
+        if not (probe and 200 <= probe.status <= 299):
+            return False
+        if probe.prefix_hash is not None:
+            return (
+                probe.content_length == self.content_length
+                and probe.prefix_hash == self.prefix_hash
+            )
+        if etag and self.is_etag_stable and probe.etag:
+            return probe.etag == etag
+        if last_modified and self.is_last_modified_stable and probe.last_modified:
+            return probe.last_modified == last_modified
+        return False
+
+    def record_probe(self, probe: FeedProbe, is_unchanged: bool):
+        if probe and probe.prefix_hash is not None and probe.status != 206:
+            # server ignored Range header
+            self.flags |= _FLAG_RANGES_UNSUPPORTED
+        if is_unchanged:
+            self.num_probe = self._incr(self.num_probe)
+            self.num_unchanged = self._incr(self.num_unchanged)
+
+    def record_not_modified(self):
+        self.num_fetch = (self.num_fetch + 1) % 256
+        self.num_not_modified = self._incr(self.num_not_modified)
+        self.num_unchanged = self._incr(self.num_unchanged)
+        self.num_probe = 0
+
+    def record_fetch(
+        self,
+        content: bytes,
+        *,
+        etag: str,
+        etag_changed: bool,
+        last_modified: str,
+        last_modified_changed: bool,
+        is_conditional: bool,
+        is_unchanged: bool,
+    ):
+        """Record full fetch which responded 200 with body"""
+        self.num_fetch = (self.num_fetch + 1) % 256
+        self.num_probe = 0
+        if is_unchanged:
+            self.num_unchanged = self._incr(self.num_unchanged)
+            if is_conditional:
+                self.num_ignored = self._incr(self.num_ignored)
+            if etag and etag_changed:
+                self.num_etag_unstable = self._incr(self.num_etag_unstable)
+            if last_modified and last_modified_changed:
+                self.num_last_modified_unstable = self._incr(self.num_last_modified_unstable)
+        else:
+            self.num_unchanged = 0
+        if content:
+            self.content_length = len(content)
+            self.prefix_hash = prefix_hash_of(content)
+
+    def interval_factor(self) -> int:
+        """
+        Multiple of check interval, stable feeds are checked less often.
+
+        >>> stats = FeedFetchStats()
+        >>> stats.interval_factor()
+        1
+        >>> stats.num_unchanged = 20
+        >>> stats.interval_factor()
+        3
+        """
+        factor = 1 + self.num_unchanged // _UNCHANGED_PER_FACTOR
+        return min(MAX_INTERVAL_FACTOR, factor)
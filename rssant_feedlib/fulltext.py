@@ -1,5 +1,4 @@
 import re
-import difflib
 import enum
 from typing import List
 
@@ -16,8 +15,15 @@ sentence_sep_s = [
     r'“', r'”', r'‘', r'’', r'【', r'】', r'《', r'》', r'（', r'）', r'〈', r'〉',
 ]
 
-_SEP_S = r'(?:[\s\d]*(?:{})[\s\d]*)+'.format('|'.join(sentence_sep_s))
-RE_SENTENCE_SEP = re.compile(r'(?:{})|(?:{})'.format(RE_URL.pattern, _SEP_S), re.I)
+# All separators are single char, a separator is a run of separator chars,
+# spaces and digits which contains at least one separator char. The match
+# only begin at start of the run, and spaces or digits are disjoint with
+# separator chars, so a failed match backtrack at most once over the run and
+# split is linear time even on long runs of spaces or digits.
+# Note: not use possessive quantifiers, they require Python 3.11
+_SEP_CHARS = ''.join(sentence_sep_s)
+_SEP_S = r'(?<![\s\d])(?:[^\S\r\n]|\d)*[{sep}][\s\d{sep}]*'.format(sep=_SEP_CHARS)
+RE_SENTENCE_SEP = re.compile(_SEP_S, re.I)
 
 
 def split_sentences(text: str, keep_short: bool = False) -> List[str]:
@@ -26,12 +32,10 @@ def split_sentences(text: str, keep_short: bool = False) -> List[str]:
     """
     if not text:
         return []
-    sentences = RE_SENTENCE_SEP.split(text)
+    sentences = []
+    for part in RE_URL.split(text):
+        sentences.extend(RE_SENTENCE_SEP.split(part))
     sentences = list(filter(None, (x.strip() for x in sentences)))
-    if sentences and not sentences[0]:
-        sentences = sentences[1:]
-    if sentences and not sentences[-1]:
-        sentences = sentences[:-1]
     if not keep_short:
         sentences = [x for x in sentences if not is_short_sentence(x)]
     return sentences
@@ -55,9 +59,31 @@ def is_short_sentence(sentence: str) -> bool:
     return len(sentence) <= 16 and wcswidth(sentence) <= 8
 
 
+_SHINGLE_SIZE = 4
+
+
+def _sentence_shingles(sentences: List[str]) -> set:
+    """
+    character n-grams of sentences, short sentence is a shingle itself.
+    """
+    k = _SHINGLE_SIZE
+    shingles = set()
+    for sentence in sentences:
+        sentence = sentence.lower()
+        if len(sentence) <= k:
+            shingles.add(sentence)
+            continue
+        for i in range(len(sentence) - k + 1):
+            shingles.add(sentence[i: i + k])
+    return shingles
+
+
 def is_summary_prob(subtext: str, fulltext: str) -> float:
     """
     判断subtext是fulltext的摘要的概率。概率大于0.5可认为是。
+
+    摘要通常是全文的开头部分，计算subtext的shingles有多少包含在
+    fulltext开头部分的shingles中，线性时间复杂度。
     """
     sub_sentences = split_sentences(subtext)
     full_sentences = split_sentences(fulltext)
@@ -70,23 +96,10 @@ def is_summary_prob(subtext: str, fulltext: str) -> float:
     if num_sub - num_full >= 0:
         return 0.0
     max_check = min(num_sub * 2 + 1, num_full)
-    num_positive = 0
-    prev_value = 0
-    for delta in difflib.ndiff(sub_sentences, full_sentences[:max_check]):
-        diff_type = delta[0]
-        if diff_type == ' ':
-            value = 1
-        elif diff_type == '+':
-            value = 0.9
-        elif diff_type == '-':
-            value = -2.5
-        elif diff_type == '?':
-            value = 1.5 - prev_value * 0.5
-        else:
-            value = 0
-        num_positive += value
-        prev_value = value
-    return max(0.0, min(1.0, num_positive / max_check))
+    sub_shingles = _sentence_shingles(sub_sentences)
+    full_shingles = _sentence_shingles(full_sentences[:max_check])
+    num_contained = len(sub_shingles & full_shingles)
+    return max(0.0, min(1.0, num_contained / len(sub_shingles)))
 
 
 def is_summary(subtext: str, fulltext: str) -> bool:
@@ -94,9 +107,28 @@ def is_summary(subtext: str, fulltext: str) -> bool:
 
 
 class StoryContentInfo:
-    def __init__(self, html: str, *, sentence_count: int = None):
+    """
+    Derived metrics of story content. Metrics can be given by precomputed
+    values (eg: stored in StoryInfo), then they will not be computed again.
+    """
+
+    METRIC_FIELDS = (
+        'length',
+        'text_length',
+        'link_count',
+        'image_count',
+        'url_count',
+        'sentence_count',
+    )
+
+    def __init__(self, html: str, **metrics):
         self.html = html
-        self._sentence_count = sentence_count
+        for key, value in metrics.items():
+            if key not in self.METRIC_FIELDS:
+                raise TypeError(f'unknown metric field {key!r}')
+            # the same place as cached_property, so will not compute again
+            if value is not None:
+                self.__dict__[key] = value
 
     def __bool__(self):
         return bool(self.html)
@@ -105,9 +137,13 @@ class StoryContentInfo:
     def text(self) -> str:
         return processor.story_html_to_text(self.html)
 
-    @property
+    @cached_property
     def length(self) -> int:
-        return len(self.html)
+        return len(self.html or '')
+
+    @cached_property
+    def text_length(self) -> int:
+        return len(self.text)
 
     @cached_property
     def link_count(self) -> int:
@@ -121,11 +157,15 @@ class StoryContentInfo:
     def url_count(self) -> int:
         return processor.story_url_count(self.html)
 
-    @property
+    @cached_property
     def sentence_count(self) -> int:
-        if self._sentence_count is None:
-            self._sentence_count = len(split_sentences(self.text))
-        return self._sentence_count
+        return len(split_sentences(self.text))
+
+    def get_metrics(self) -> dict:
+        """
+        Metrics to persist, length is the same as content_length.
+        """
+        return {key: getattr(self, key) for key in self.METRIC_FIELDS if key != 'length'}
 
 
 def is_fulltext_content(story_content_info: StoryContentInfo):
@@ -0,0 +1,110 @@
+"""
+Fast HTML to plain text conversion.
+
+Use lxml parser target interface to receive parse events as a stream,
+text is collected in a single pass without building DOM tree or running
+the html cleaner.
+"""
+import hashlib
+import re
+from threading import Lock
+
+import lxml.etree
+from cachetools import LRUCache, cached
+from cachetools.keys import hashkey
+
+from .helper import lxml_call
+
+# tags which content should be dropped, the same as lxml html cleaner
+# with scripts, style, meta, embedded, frames and forms options, plus
+# code, pre and media tags
+_CLEAN_KILL_TAGS = frozenset([
+    'script', 'style', 'noscript', 'template',
+    'code', 'pre', 'img', 'video', 'audio',
+    'meta', 'link',
+    'iframe', 'frame', 'frameset', 'noframes',
+    'applet', 'embed', 'object', 'param',
+    'button', 'input', 'select', 'textarea',
+])
+
+# keep all text, the same as lxml text_content
+_RAW_KILL_TAGS = frozenset()
+
+RE_BLANK_LINE = re.compile(r'(\n\s*)(\n\s*)+')
+
+
+class _TextCollector:
+    """lxml parser target, collect text not inside kill tags"""
+
+    def __init__(self, kill_tags: frozenset):
+        self._kill_tags = kill_tags
+        self._kill_depth = 0
+        self._num_elements = 0
+        self._texts = []
+
+    def start(self, tag, attrib):
+        self._num_elements += 1
+        if self._kill_depth > 0 or tag in self._kill_tags:
+            self._kill_depth += 1
+
+    def end(self, tag):
+        if self._kill_depth > 0:
+            self._kill_depth -= 1
+
+    def data(self, data):
+        if self._kill_depth <= 0:
+            self._texts.append(data)
+
+    def close(self):
+        if self._num_elements <= 0:
+            # libxml2 silently drops content it can not understand,
+            # eg: php code, let caller fallback to other parser
+            raise ValueError('no element found in content')
+        return ''.join(self._texts)
+
+
+def _feed_and_close(content, parser):
+    parser.feed(content)
+    return parser.close()
+
+
+def html_to_text(content: str, clean: bool = True) -> str:
+    """
+    Convert HTML to text in one pass, raise LXMLError if content is invalid.
+
+    >>> print(html_to_text('<p>hello <b>world</b></p><script>x = 1</script>'))
+    hello world
+    >>> print(html_to_text('<p>a</p>\\n\\n\\n<p>b</p>'))
+    a
+    b
+    >>> print(html_to_text('<pre>x</pre><p>y</p>', clean=False))
+    xy
+    """
+    kill_tags = _CLEAN_KILL_TAGS if clean else _RAW_KILL_TAGS
+    parser = lxml.etree.HTMLParser(
+        target=_TextCollector(kill_tags),
+        remove_comments=True,
+        remove_pis=True,
+        collect_ids=False,
+    )
+    text = lxml_call(_feed_and_close, content, parser)
+    return RE_BLANK_LINE.sub('\n', text.strip())
+
+
+def _cache_key(content: str, clean: bool = True):
+    digest = hashlib.blake2b(content.encode('utf-8'), digest_size=16).digest()
+    return hashkey(digest, clean)
+
+
+# at most 8M chars of text, too large value will not be cached
+@cached(
+    cache=LRUCache(maxsize=8 * 1024 * 1024, getsizeof=len),
+    key=_cache_key,
+    lock=Lock(),
+)
+def html_to_text_cached(content: str, clean: bool = True) -> str:
+    """
+    The same as html_to_text, but memo result by content hash, so the same
+    content (eg: summary equals content) will not be converted repeatedly.
+    """
+    return html_to_text(content, clean=clean)
@@ -0,0 +1,215 @@
+"""
+Opt-in HTTP/2 capable feed reader based on httpx.
+
+Requests of the same reader share one connection pool, concurrent requests
+to the same host are multiplexed on one connection if server negotiated h2
+by ALPN. Response body is decoded by ContentDecoder which support brotli
+and zstd, decoded size is bounded by max_content_length while streaming.
+
+HTTP/2 requires the h2 package, otherwise fallback to HTTP/1.1. Requests
+by proxy still go through AsyncFeedReader.
+"""
+import contextlib
+import logging
+import ssl
+
+import httpcore
+import httpx
+from aiohttp.helpers import is_ip_address
+from httpcore.backends.auto import AutoBackend
+from httpcore.backends.base import AsyncNetworkBackend
+
+try:
+    import h2
+except ImportError:
+    h2 = None
+
+from .async_reader import AsyncFeedReader
+from .content_decoder import ACCEPT_ENCODING, ContentDecoder
+from .reader import (
+    ContentTypeNotSupportError,
+    FeedReaderError,
+    is_ok_status,
+    is_webpage,
+)
+from .response import FeedResponseStatus
+
+LOG = logging.getLogger(__name__)
+
+HAS_HTTP2 = h2 is not None
+
+_MAX_REDIRECTS = 10
+
+
+class Http2ReaderError(FeedReaderError):
+    """httpx errors mapped to feed response status"""
+
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+
+@contextlib.contextmanager
+def _map_httpx_errors():
+    try:
+        yield
+    except httpx.TimeoutException as ex:
+        if isinstance(ex, (httpx.ReadTimeout, httpx.WriteTimeout)):
+            status = FeedResponseStatus.READ_TIMEOUT
+        else:
+            status = FeedResponseStatus.CONNECTION_TIMEOUT
+        raise Http2ReaderError(repr(ex), status.value) from ex
+    except (httpx.NetworkError, httpx.RemoteProtocolError) as ex:
+        if isinstance(ex.__context__, ssl.SSLError):
+            status = FeedResponseStatus.SSL_ERROR
+        else:
+            status = FeedResponseStatus.CONNECTION_RESET
+        raise Http2ReaderError(repr(ex), status.value) from ex
+    except httpx.TooManyRedirects as ex:
+        status = FeedResponseStatus.TOO_MANY_REDIRECT_ERROR
+        raise Http2ReaderError(repr(ex), status.value) from ex
+    except httpx.DecodingError as ex:
+        status = FeedResponseStatus.CONTENT_DECODING_ERROR
+        raise Http2ReaderError(repr(ex), status.value) from ex
+    except (httpx.HTTPError, httpx.InvalidURL) as ex:
+        status = FeedResponseStatus.UNKNOWN_ERROR
+        raise Http2ReaderError(repr(ex), status.value) from ex
+
+
+class _ResolverNetworkBackend(AsyncNetworkBackend):
+    """Connect to address resolved by aiohttp resolver, eg: DNSService which reject private address"""
+
+    def __init__(self, resolver):
+        self._resolver = resolver
+        self._backend = AutoBackend()
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None):
+        if not is_ip_address(host):
+            hosts = await self._resolver.resolve(host, port)
+            host = hosts[0]['host']
+        return await self._backend.connect_tcp(
+            host, port, timeout=timeout, local_address=local_address)
+
+    async def connect_unix_socket(self, path, timeout=None):
+        return await self._backend.connect_unix_socket(path, timeout=timeout)
+
+    async def sleep(self, seconds):
+        return await self._backend.sleep(seconds)
+
+
+class _ResolverTransport(httpx.AsyncHTTPTransport):
+    def __init__(self, *, resolver, ssl_context: ssl.SSLContext, http2: bool, limits: httpx.Limits):
+        super().__init__(verify=ssl_context, http2=http2, limits=limits)
+        # httpx 0.23 transport not accept network backend, replace the pool
+        self._pool = httpcore.AsyncConnectionPool(
+            ssl_context=ssl_context,
+            max_connections=limits.max_connections,
+            max_keepalive_connections=limits.max_keepalive_connections,
+            keepalive_expiry=limits.keepalive_expiry,
+            http1=True,
+            http2=http2,
+            network_backend=_ResolverNetworkBackend(resolver),
+        )
+
+
+class Http2FeedReader(AsyncFeedReader):
+
+    accept_encoding = ACCEPT_ENCODING
+
+    def __init__(self, *args, http2: bool = True, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.http2 = http2 and HAS_HTTP2
+        self._client: httpx.AsyncClient = None
+
+    async def _async_init(self):
+        await super()._async_init()
+        if self._client is None:
+            limits = httpx.Limits(max_connections=100, max_keepalive_connections=20)
+            transport = _ResolverTransport(
+                resolver=self.resolver,
+                ssl_context=self._sslcontext,
+                http2=self.http2,
+                limits=limits,
+            )
+            self._client = httpx.AsyncClient(
+                transport=transport,
+                timeout=httpx.Timeout(self.request_timeout),
+                follow_redirects=True,
+                max_redirects=_MAX_REDIRECTS,
+            )
+
+    def _check_httpx_content_type(self, response: httpx.Response):
+        if self.allow_non_webpage:
+            return
+        if not is_ok_status(response.status_code):
+            return
+        content_type = response.headers.get('content-type')
+        if not is_webpage(content_type, str(response.url)):
+            raise ContentTypeNotSupportError(
+                f'content-type {content_type} not support'
+            )
+
+    async def _read_httpx_content(self, response: httpx.Response):
+        buffer = self._create_content_buffer(
+            response.status_code,
+            content_length=response.headers.get('Content-Length'),
+        )
+        decoder = ContentDecoder(
+            response.headers.get('Content-Encoding'),
+            max_length=self.max_content_length,
+        )
+        try:
+            async for chunk in response.aiter_raw():
+                if not buffer.append(decoder.decode(chunk)):
+                    return buffer.getvalue()
+        except httpx.RemoteProtocolError as ex:
+            # eg: peer closed connection without sending complete message body
+            status = FeedResponseStatus.CHUNKED_ENCODING_ERROR
+            raise Http2ReaderError(repr(ex), status.value) from ex
+        buffer.append(decoder.flush())
+        return buffer.getvalue()
+
+    async def _read(
+        self,
+        url,
+        etag=None,
+        last_modified=None,
+        referer=None,
+        headers=None,
+        ignore_content=False,
+        proxy_url=None,
+    ):
+        if proxy_url:
+            return await super()._read(
+                url,
+                etag=etag,
+                last_modified=last_modified,
+                referer=referer,
+                headers=headers,
+                ignore_content=ignore_content,
+                proxy_url=proxy_url,
+            )
+        headers = self._prepare_headers(
+            url,
+            etag=etag,
+            last_modified=last_modified,
+            referer=referer,
+            headers=headers,
+        )
+        await self._async_init()
+        with _map_httpx_errors():
+            async with self._client.stream('GET', url, headers=headers) as response:
+                LOG.debug('read %s %s status=%s', url, response.http_version, response.status_code)
+                content = None
+                if not is_ok_status(response.status_code) or not ignore_content:
+                    content = await self._read_httpx_content(response)
+                if not is_ok_status(response.status_code):
+                    return response.headers, content, url, response.status_code
+                self._check_httpx_content_type(response)
+        return response.headers, content, str(response.url), response.status_code
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        await super().close()
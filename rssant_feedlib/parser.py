@@ -203,13 +203,10 @@ class FeedParser:
         return FeedResult(feed, storys, checksum=result.checksum)
 
     def _check_update_storys(self, storys: list):
-        update_storys = []
-        for story in storys:
-            ident = story['ident']
-            content = story['content'] or ''
-            if self._checksum.update(ident, content):
-                update_storys.append(story)
-        return update_storys
+        idents = [story['ident'] for story in storys]
+        contents = [story['content'] or '' for story in storys]
+        is_updated = self._checksum.batch_update(idents, contents)
+        return [story for story, ok in zip(storys, is_updated) if ok]
 
     @staticmethod
     def _story_sort_key(story):
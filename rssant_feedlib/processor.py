@@ -18,6 +18,7 @@ from validr import Invalid, T
 from rssant_common.validator import compiler
 
 from .helper import RE_URL, LXMLError, lxml_call
+from .html_to_text import html_to_text_cached
 
 LOG = logging.getLogger(__name__)
 
@@ -382,6 +383,15 @@ def process_story_links(content, story_link):
     if not content:
         return content
     dom = lxml_call(lxml.html.fromstring, content)
+    process_story_dom_links(dom, story_link)
+    result = lxml.html.tostring(dom, encoding='unicode')
+    if isinstance(result, bytes):
+        result = result.decode('utf-8')
+    return result
+
+
+def process_story_dom_links(dom, story_link):
+    """The same as process_story_links, but modify lxml element in place"""
     for a in dom.iter('a'):
         url = a.get('href')
         if url:
@@ -401,10 +411,6 @@ def process_story_links(content, story_link):
     # also make image, video... other links absolute
     if story_link:
         dom.make_links_absolute(story_link)
-    result = lxml.html.tostring(dom, encoding='unicode')
-    if isinstance(result, bytes):
-        result = result.decode('utf-8')
-    return result
 
 
 def story_readability(content):
@@ -465,30 +471,6 @@ def story_extract_attach(html, base_url=None) -> StoryAttach:
 
 RE_BLANK_LINE = re.compile(r'(\n\s*)(\n\s*)+')
 
-lxml_html_parser = lxml.html.HTMLParser(
-    remove_blank_text=True,
-    remove_comments=True,
-    collect_ids=False,
-)
-
-
-lxml_text_html_cleaner = Cleaner(
-    scripts=True,
-    javascript=True,
-    comments=True,
-    style=True,
-    links=True,
-    meta=True,
-    page_structure=True,
-    processing_instructions=True,
-    embedded=True,
-    frames=True,
-    forms=True,
-    annoying_tags=True,
-    remove_tags=set(['body']),
-    kill_tags=set(['code', 'pre', 'img', 'video', 'noscript']),
-)
-
 
 def _to_soup_text(content: str):
     """
@@ -538,17 +520,7 @@ def story_html_to_text(content, clean=True):
     if (not content) or (not content.strip()):
         return ""
     try:
-        if clean:
-            # https://bugs.launchpad.net/lxml/+bug/1851029
-            # The html cleaner raise AssertionError when both
-            # root tag and child tag in kill_tags set.
-            if content.startswith('<pre'):
-                content = '<div>' + content + '</div>'
-            content = lxml_call(lxml_text_html_cleaner.clean_html, content).strip()
-        if not content:
-            return ""
-        r = lxml_call(lxml.html.fromstring, content, parser=lxml_html_parser)
-        content = r.text_content().strip()
+        content = html_to_text_cached(content, clean=clean)
         if _has_cdata(content):
             content = _to_soup_text(content)
     except LXMLError:
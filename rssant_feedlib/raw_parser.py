@@ -1,4 +1,5 @@
 import typing
+import codecs
 import json
 import logging
 import datetime
@@ -25,6 +26,9 @@ feedparser.SANITIZE_HTML = False
 
 UTC = datetime.timezone.utc
 
+# chunk size to check content encoding without decode the whole content
+_DECODE_CHUNK_SIZE = 64 * 1024
+
 # TODO: maybe remove in the future
 # On the date story ident change to v2 format
 STORY_INDENT_V2_DATE = datetime.datetime(2020, 9, 1, 0, 0, 0, tzinfo=UTC)
@@ -537,10 +541,26 @@ class RawFeedParser:
         return RawFeedResult(feed, storys, warnings=result.warnings)
 
     @staticmethod
-    def _fix_response_content(response: FeedResponse) -> bytes:
+    def _is_valid_encoding(content: bytes, encoding: str) -> bool:
+        decoder = codecs.getincrementaldecoder(encoding)()
+        view = memoryview(content)
+        try:
+            for i in range(0, len(view), _DECODE_CHUNK_SIZE):
+                decoder.decode(view[i:i + _DECODE_CHUNK_SIZE].tobytes())
+            decoder.decode(b'', final=True)
+        except UnicodeError:
+            return False
+        return True
+
+    @classmethod
+    def _fix_response_content(cls, response: FeedResponse) -> bytes:
         # ensure encoding works to avoid feedparser use wrong encoding
         # content.strip is required because feedparser not allow whitespace
-        return response.content\
+        content = response.content
+        if cls._is_valid_encoding(content, response.encoding):
+            # avoid decode and encode copies of the whole content
+            return bytes(content).strip()
+        return content\
             .decode(response.encoding, errors='ignore')\
             .encode(response.encoding)\
             .strip()
@@ -1,12 +1,19 @@
+import codecs
 import logging
 import re
 import socket
 import ssl
+import typing
 from http import HTTPStatus
 from urllib.parse import unquote, urlparse
 
 import requests
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 from rssant_common import _proxy_helper
 from rssant_common.dns_service import (
     DNS_SERVICE,
@@ -14,9 +21,11 @@ from rssant_common.dns_service import (
     NameNotResolvedError,
     PrivateAddressError,
 )
+from rssant_common.rate_limiter import HostRateLimiter, get_url_host
 from rssant_common.requests_helper import requests_check_incomplete_response
 
 from . import cacert
+from .fetch_stats import FeedProbe, prefix_hash_of
 from .response import FeedResponse, FeedResponseStatus
 from .response_builder import FeedResponseBuilder
 from .useragent import DEFAULT_USER_AGENT
@@ -42,12 +51,29 @@ class ContentTypeNotSupportError(FeedReaderError):
     status = FeedResponseStatus.CONTENT_TYPE_NOT_SUPPORT_ERROR.value
 
 
+class ContentDecodingError(FeedReaderError):
+    """Content-Encoding not supported or invalid compressed content"""
+
+    status = FeedResponseStatus.CONTENT_DECODING_ERROR.value
+
+
 class RSSProxyError(FeedReaderError):
     """RSSProxyError"""
 
     status = FeedResponseStatus.RSS_PROXY_ERROR.value
 
 
+# urllib3 decode brotli by either brotli or brotlipy package
+DEFAULT_ACCEPT_ENCODING = 'gzip, deflate, br' if brotli is not None else 'gzip, deflate'
+
+# first bytes of body used to sniff binary content
+_SNIFF_SIZE = 512
+# body of error response is only used in log or error message
+MAX_ERROR_CONTENT_LENGTH = 64 * 1024
+
+_TEXT_BOMS = (codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE, codecs.BOM_UTF32_BE)
+
+
 RE_WEBPAGE_CONTENT_TYPE = re.compile(
     r'(text/html|application/xml|text/xml|text/plain|application/json|'
     r'application/.*xml|application/.*json|text/.*xml)',
@@ -115,6 +141,88 @@ def is_ok_status(status):
     return status and 200 <= status <= 299
 
 
+def is_binary_content(head: bytes) -> bool:
+    """
+    Text never contains NUL bytes, except UTF-16 and UTF-32 which has BOM.
+
+    >>> is_binary_content(b'<?xml version="1.0"?><rss>')
+    False
+    >>> is_binary_content(b'\\x89PNG\\r\\n\\x1a\\n\\x00\\x00\\x00\\rIHDR')
+    True
+    >>> is_binary_content('<rss>'.encode('utf-16'))
+    False
+    """
+    head = bytes(head[:_SNIFF_SIZE])
+    if head.startswith(_TEXT_BOMS):
+        return False
+    return b'\x00' in head
+
+
+class ContentBuffer:
+    """
+    Accumulate chunks of response body, reject content larger than max_length
+    or binary content as soon as the first chunks arrived, instead of after
+    the whole body downloaded. If truncate, content larger than max_length
+    is truncated instead of rejected.
+
+    >>> buffer = ContentBuffer(max_length=10, truncate=True)
+    >>> buffer.append(b'hello world')
+    False
+    >>> buffer.getvalue()
+    bytearray(b'hello worl')
+    >>> buffer = ContentBuffer(max_length=10)
+    >>> buffer.append(b'hello world')
+    Traceback (most recent call last):
+    ...
+    rssant_feedlib.reader.ContentTooLargeError: content length larger than limit 10
+    >>> buffer = ContentBuffer(max_length=8)
+    >>> buffer.append(b'abcd'), buffer.append(b'efgh')
+    (True, True)
+    >>> buffer.append(b'ijkl')
+    Traceback (most recent call last):
+    ...
+    rssant_feedlib.reader.ContentTooLargeError: content length larger than limit 8
+    """
+
+    __slots__ = ('max_length', 'sniff', 'truncate', '_content')
+
+    def __init__(self, max_length: int, *, content_length=None, sniff=False, truncate=False):
+        self.max_length = max_length
+        self.sniff = sniff
+        self.truncate = truncate
+        if content_length and not truncate:
+            content_length = int(content_length)
+            if content_length > max_length:
+                msg = 'content length {} larger than limit {}'.format(
+                    content_length, max_length
+                )
+                raise ContentTooLargeError(msg)
+        self._content = bytearray()
+
+    def _check_sniff(self):
+        self.sniff = False
+        if is_binary_content(self._content):
+            raise ContentTypeNotSupportError('binary content not support')
+
+    def append(self, chunk: bytes) -> bool:
+        """Append chunk, return False if the rest of body should be discarded"""
+        if self.truncate:
+            chunk = chunk[:self.max_length - len(self._content)]
+        elif len(self._content) + len(chunk) > self.max_length:
+            msg = 'content length larger than limit {}'.format(self.max_length)
+            raise ContentTooLargeError(msg)
+        self._content.extend(chunk)
+        if self.sniff and len(self._content) >= _SNIFF_SIZE:
+            self._check_sniff()
+        # keep reading at the limit, any byte past it raise ContentTooLargeError
+        return (not self.truncate) or len(self._content) < self.max_length
+
+    def getvalue(self) -> bytearray:
+        if self.sniff and self._content:
+            self._check_sniff()
+        return self._content
+
+
 class FeedReader:
     def __init__(
         self,
@@ -127,6 +235,8 @@ class FeedReader:
         rss_proxy_url=None,
         rss_proxy_token=None,
         dns_service: DNSService = DNS_SERVICE,
+        rate_limiter: HostRateLimiter = None,
+        rate_limit_max_wait: float = None,
     ):
         if session is None:
             session = requests.session()
@@ -146,6 +256,8 @@ class FeedReader:
         self.rss_proxy_token = rss_proxy_token
         self._use_rss_proxy = self._choice_proxy()
         self.dns_service = dns_service
+        self.rate_limiter = rate_limiter
+        self.rate_limit_max_wait = rate_limit_max_wait
         self._cacert = cacert.where()
 
     @property
@@ -168,27 +280,28 @@ class FeedReader:
                 f'content-type {content_type!r} not support'
             )
 
+    def _create_content_buffer(self, status: int, content_length=None) -> ContentBuffer:
+        if not is_ok_status(status):
+            return ContentBuffer(MAX_ERROR_CONTENT_LENGTH, truncate=True)
+        return ContentBuffer(
+            self.max_content_length,
+            content_length=content_length,
+            sniff=not self.allow_non_webpage,
+        )
+
     def _read_content(self, response: requests.Response):
-        content_length = response.headers.get('Content-Length')
-        if content_length:
-            content_length = int(content_length)
-            if content_length > self.max_content_length:
-                msg = 'content length {} larger than limit {}'.format(
-                    content_length, self.max_content_length
-                )
-                raise ContentTooLargeError(msg)
-        content_length = 0
-        content = bytearray()
+        buffer = self._create_content_buffer(
+            response.status_code,
+            content_length=response.headers.get('Content-Length'),
+        )
+        is_complete = True
         for data in response.iter_content(chunk_size=64 * 1024):
-            content_length += len(data)
-            if content_length > self.max_content_length:
-                msg = 'content length larger than limit {}'.format(
-                    self.max_content_length
-                )
-                raise ContentTooLargeError(msg)
-            content.extend(data)
-        requests_check_incomplete_response(response)
-        return content
+            if not buffer.append(data):
+                is_complete = False
+                break
+        if is_complete:
+            requests_check_incomplete_response(response)
+        return buffer.getvalue()
 
     def _decode_content(self, content: bytes):
         if not content:
@@ -201,9 +314,9 @@ class FeedReader:
             headers['User-Agent'] = self.user_agent(url)
         else:
             headers['User-Agent'] = self.user_agent
-        headers['Accept-Encoding'] = 'gzip, deflate'
+        headers['Accept-Encoding'] = DEFAULT_ACCEPT_ENCODING
         if etag:
-            headers["ETag"] = etag
+            headers["If-None-Match"] = etag
         if last_modified:
             headers["If-Modified-Since"] = last_modified
         return headers
@@ -292,6 +405,81 @@ class FeedReader:
             proxies = {'http': self.proxy_url, 'https': self.proxy_url}
             return self._read(url, *args, **kwargs, proxies=proxies)
 
+    @staticmethod
+    def _get_probe_content_length(response: requests.Response):
+        content_range = response.headers.get('Content-Range')
+        if response.status_code == 206 and content_range:
+            # eg: bytes 0-4095/12345, the total may be *
+            total = content_range.rpartition('/')[2].strip()
+            return int(total) if total.isdigit() else None
+        content_length = response.headers.get('Content-Length')
+        if content_length and content_length.isdigit():
+            return int(content_length)
+        return None
+
+    def _send_probe(self, url, range_size=None) -> typing.Tuple[FeedProbe, dict]:
+        headers = self._prepare_headers(url)
+        # length and prefix are compared with the identity body
+        headers['Accept-Encoding'] = 'identity'
+        method = 'HEAD'
+        if range_size:
+            method = 'GET'
+            headers['Range'] = f'bytes=0-{range_size - 1}'
+        req = requests.Request(method, url, headers=headers)
+        prepared = self.session.prepare_request(req)
+        response = self.session.send(
+            prepared,
+            verify=self._cacert,
+            timeout=self.request_timeout,
+            stream=True,
+        )
+        try:
+            prefix_hash = None
+            if range_size and is_ok_status(response.status_code):
+                prefix = bytearray()
+                for data in response.iter_content(chunk_size=range_size):
+                    prefix.extend(data)
+                    if len(prefix) >= range_size:
+                        break
+                prefix_hash = prefix_hash_of(bytes(prefix[:range_size]))
+        finally:
+            # not read the rest body if server ignored Range
+            response.close()
+        probe = FeedProbe(
+            status=response.status_code,
+            etag=response.headers.get('ETag'),
+            last_modified=response.headers.get('Last-Modified'),
+            content_length=self._get_probe_content_length(response),
+            prefix_hash=prefix_hash,
+        )
+        return probe, response.headers
+
+    def probe(self, url, range_size: int = None) -> typing.Optional[FeedProbe]:
+        """
+        Cheap request to tell whether the feed changed without download body,
+        HEAD request if range_size not set, otherwise GET the first range_size
+        bytes by Range request. Return None if request failed or rate limited.
+        """
+        host = get_url_host(url) if self.rate_limiter else None
+        if host and not self.rate_limiter.wait(host, max_wait=self.rate_limit_max_wait):
+            LOG.info('probe %s rate limited', unquote(url))
+            return None
+        method = f'RANGE {range_size}' if range_size else 'HEAD'
+        LOG.info('probe %s method=%s', unquote(url), method)
+        try:
+            probe, headers = self._send_probe(url, range_size=range_size)
+        except (
+            OSError,
+            requests.RequestException,
+            NameNotResolvedError,
+            PrivateAddressError,
+        ) as ex:
+            LOG.info('probe %s failed: %r', unquote(url), ex)
+            return None
+        if host:
+            self.rate_limiter.on_response(host, probe.status, headers)
+        return probe
+
     def _get_proxy_msg(self, use_proxy: bool):
         if (not self.has_proxy) or (not use_proxy):
             return 'False'
@@ -303,6 +491,13 @@ class FeedReader:
     def read(self, url, *args, use_proxy=False, **kwargs) -> FeedResponse:
         proxy_msg = self._get_proxy_msg(use_proxy)
         LOG.info('read %s use_proxy=%s', unquote(url), proxy_msg)
+        host = get_url_host(url) if self.rate_limiter else None
+        if host and not self.rate_limiter.wait(host, max_wait=self.rate_limit_max_wait):
+            LOG.info('read %s rate limited', unquote(url))
+            builder = FeedResponseBuilder(use_proxy=use_proxy)
+            builder.url(url)
+            builder.status(FeedResponseStatus.RATE_LIMITED.value)
+            return builder.build()
         headers = content = None
         try:
             if use_proxy:
@@ -352,6 +547,8 @@ class FeedReader:
                 status = ex.response.status_code
             else:
                 status = FeedResponseStatus.UNKNOWN_ERROR.value
+        if host:
+            self.rate_limiter.on_response(host, status, headers)
         builder = FeedResponseBuilder(use_proxy=use_proxy)
         builder.url(url)
         builder.status(status)
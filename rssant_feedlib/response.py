@@ -22,6 +22,7 @@ class FeedResponseStatus(enum.IntEnum):
     REFERER_DENY = -405  # 严格防盗链，必须服务端才能绕过
     REFERER_NOT_ALLOWED = -406  # 普通防盗链，不带Referer头可绕过
     CONTENT_TYPE_NOT_SUPPORT_ERROR = -407  # 非文本/HTML响应
+    RATE_LIMITED = -408  # 单个域名请求过于频繁，未发送请求
 
     @classmethod
     def name_of(cls, value):
@@ -1,3 +1,4 @@
+import itertools
 import logging
 import time
 
@@ -11,22 +12,23 @@ from rssant_api.models import (
     CommonStory,
     Feed,
     FeedCreation,
+    FeedFreezeTask,
+    FeedMonthlyStoryCount,
     FeedStatus,
     FeedUrlMap,
+    UserActivity,
     UserFeed,
     WorkerTask,
 )
 from rssant_api.models.worker_task import WorkerTaskExpired, WorkerTaskPriority
 from rssant_common.base64 import UrlsafeBase64
 from rssant_config import CONFIG
-from rssant_feedlib import processor
 from rssant_feedlib.do_not_fetch_fulltext import is_not_fetch_fulltext
 from rssant_feedlib.fulltext import (
     FulltextAcceptStrategy,
     StoryContentInfo,
     decide_accept_fulltext,
     is_fulltext_content,
-    split_sentences,
 )
 
 from .schema import FeedInfoSchema, FeedSchema, validate_feed_output
@@ -106,6 +108,8 @@ class HarborService:
                     is_from_bookmark=feed_creation.is_from_bookmark,
                 )
                 user_feed.save()
+                UserActivity.on_subscribe(feed_creation.user_id, [feed.id])
+                FeedFreezeTask.enqueue([feed.id])
             FeedUrlMap(source=feed_creation.url, target=feed.url).save()
             if feed.url != feed_creation.url:
                 FeedUrlMap(source=feed.url, target=feed.url).save()
@@ -119,6 +123,17 @@ class HarborService:
             feed_dict.pop('checksum_data_base64', None)
         )
 
+    def _pop_fetch_stats(self, feed_dict: dict) -> dict:
+        """Pop fetch stats fields, which not count as feed updated"""
+        fetch_stats_base64 = feed_dict.pop('fetch_stats_base64', None)
+        fetch_interval_factor = feed_dict.pop('fetch_interval_factor', None)
+        if not fetch_stats_base64:
+            return {}
+        return dict(
+            fetch_stats_data=UrlsafeBase64.decode(fetch_stats_base64),
+            fetch_interval_factor=fetch_interval_factor or 1,
+        )
+
     def update_feed(
         self,
         feed_id: int,
@@ -127,6 +142,7 @@ class HarborService:
     ):
         feed_dict = feed
         self._convert_checksum_data(feed_dict)
+        fetch_stats = self._pop_fetch_stats(feed_dict)
         with transaction.atomic():
             storys = feed_dict.pop('storys')
             feed = Feed.get_by_pk(feed_id)
@@ -148,6 +164,7 @@ class HarborService:
                     feed_dict.pop('url')
             # only update dt_updated if has storys or feed fields updated
             is_feed_updated = bool(storys)
+            content_length_level = Feed.content_length_freeze_level(feed.content_length)
             for k, v in feed_dict.items():
                 if k == 'dt_updated':
                     continue
@@ -160,10 +177,19 @@ class HarborService:
             if is_feed_updated:
                 # set dt_updated to now, not trust rss date
                 feed.dt_updated = now
+            for k, v in fetch_stats.items():
+                setattr(feed, k, v)
             feed.dt_checked = feed.dt_synced = now
-            feed.reverse_url = reverse_url(feed.url)
+            feed_reverse_url = reverse_url(feed.url)
+            if feed.reverse_url != feed_reverse_url:
+                feed.reverse_url = feed_reverse_url
+                # url changed, check duplicate feeds again
+                feed.dedup_key = None
             feed.status = FeedStatus.READY
+            feed.dt_next_check = feed.compute_dt_next_check()
             feed.save()
+            if Feed.content_length_freeze_level(feed.content_length) != content_length_level:
+                FeedFreezeTask.enqueue([feed.id])
         self._save_feed_storys(
             feed=feed,
             storys=storys,
@@ -201,21 +227,22 @@ class HarborService:
         is_freezed = feed.freeze_level is None or feed.freeze_level > 1
         if modified_storys and is_freezed:
             Feed.unfreeze_by_id(feed.id)
+        if modified_storys:
+            # new storys may change dryness
+            FeedFreezeTask.enqueue([feed.id])
         need_fetch_story = self._is_feed_need_fetch_storys(feed, modified_storys)
         fetch_story_task_s = []
         for story in modified_storys:
             if not story.link:
                 continue
             if need_fetch_story and (not self._is_fulltext_story(story)):
-                text = processor.story_html_to_text(story.content)
-                num_sub_sentences = len(split_sentences(text))
                 fetch_story_task_s.append(
                     dict(
                         url=story.link,
                         use_proxy=feed.use_proxy,
                         feed_id=story.feed_id,
                         offset=story.offset,
-                        num_sub_sentences=num_sub_sentences,
+                        num_sub_sentences=story.get_content_info().sentence_count,
                     )
                 )
         self._save_fetch_story_task_s(fetch_story_task_s)
@@ -230,10 +257,10 @@ class HarborService:
         return True
 
     @staticmethod
-    def _is_fulltext_story(story):
+    def _is_fulltext_story(story: CommonStory):
         if story.iframe_url or story.audio_url or story.image_url:
             return True
-        return is_fulltext_content(StoryContentInfo(story.content))
+        return is_fulltext_content(story.get_content_info())
 
     def _save_fetch_story_task_s(self, fetch_story_task_s: list):
         task_obj_s = []
@@ -256,12 +283,17 @@ class HarborService:
         feed: FeedInfoSchema,
     ):
         feed_dict = feed
-        self._convert_checksum_data(feed_dict)
+        # validators are kept if response not carry them, eg: error response
+        for key in ['etag', 'last_modified']:
+            if not feed_dict.get(key):
+                feed_dict.pop(key, None)
+        feed_dict.update(self._pop_fetch_stats(feed_dict))
         with transaction.atomic():
             feed = Feed.get_by_pk(feed_id)
             for k, v in feed_dict.items():
                 setattr(feed, k, v)
             feed.dt_updated = timezone.now()
+            feed.dt_next_check = feed.compute_dt_next_check()
             feed.save()
 
     def update_story(
@@ -274,19 +306,31 @@ class HarborService:
         has_mathjax: bool = None,
         response_status: int = None,
         sentence_count: int = None,
+        text_length: int = None,
+        link_count: int = None,
+        image_count: int = None,
+        url_count: int = None,
     ):
         story = STORY_SERVICE.get_by_offset(feed_id, offset, detail=True)
         if not story:
             LOG.error('story#%s,%s not found', feed_id, offset)
             return
+        new_info = StoryContentInfo(
+            content,
+            sentence_count=sentence_count,
+            text_length=text_length,
+            link_count=link_count,
+            image_count=image_count,
+            url_count=url_count,
+        )
         accept = self._update_story(
             story=story,
-            story_content_info=StoryContentInfo(story.content),
+            story_content_info=story.get_content_info(),
             content=content,
             summary=summary,
             url=url,
             has_mathjax=has_mathjax,
-            sentence_count=sentence_count,
+            new_info=new_info,
         )
         return dict(accept=accept.value)
 
@@ -299,22 +343,27 @@ class HarborService:
         summary: str,
         url: str,
         has_mathjax: bool = None,
-        sentence_count: int = None,
+        new_info: StoryContentInfo = None,
     ) -> FulltextAcceptStrategy:
-        new_info = StoryContentInfo(content)
+        if new_info is None:
+            new_info = StoryContentInfo(content)
         accept = decide_accept_fulltext(new_info, story_content_info)
         if accept == FulltextAcceptStrategy.REJECT:
             msg = 'fetched story#%s,%s url=%r is not fulltext of feed story content'
             LOG.info(msg, story.feed_id, story.offset, url)
             return accept
+        metrics = new_info.get_metrics()
         if accept == FulltextAcceptStrategy.APPEND:
             content = (story.content or '') + '\n<hr/>\n' + (content or '')
+            # metrics of appended content is the sum of both
+            old_metrics = story_content_info.get_metrics()
+            metrics = {k: v + old_metrics[k] for k, v in metrics.items()}
         data = dict(
             link=url,
             content=content,
             summary=summary,
             has_mathjax=has_mathjax,
-            sentence_count=sentence_count,
+            **metrics,
         )
         STORY_SERVICE.update_story(story.feed_id, story.offset, data)
         return accept
@@ -327,13 +376,18 @@ class HarborService:
 
     def clean_by_retention(self):
         retention = CONFIG.feed_story_retention
-        feeds = Feed.take_retention_feeds(retention=retention, limit=50)
+        budget = CONFIG.feed_story_retention_budget
+        feeds = Feed.take_retention_feeds(retention=retention, limit=200)
         LOG.info('found {} feeds need clean by retention'.format(len(feeds)))
-        for feed in feeds:
-            feed_id = feed['feed_id']
-            url = feed['url']
-            n = STORY_SERVICE.delete_by_retention(feed_id, retention=retention)
-            LOG.info(f'deleted {n} storys of feed#{feed_id} {url} by retention')
+        if not feeds:
+            return
+        begin_time = time.time()
+        feed_ids = [x['feed_id'] for x in feeds]
+        n = STORY_SERVICE.batch_delete_by_retention(
+            feed_ids, retention=retention, budget=budget)
+        cost = time.time() - begin_time
+        LOG.info('deleted {} storys of {} feeds by retention cost {:.1f}ms'.format(
+            n, len(feeds), cost * 1000))
 
     def clean_feedurlmap_by_retention(self):
         num_rows = FeedUrlMap.delete_by_retention()
@@ -345,36 +399,68 @@ class HarborService:
 
     def feed_refresh_freeze_level(self):
         begin_time = time.time()
+        UserActivity.rebuild()
         Feed.refresh_freeze_level()
         cost = time.time() - begin_time
         LOG.info('feed_refresh_freeze_level cost {:.1f}ms'.format(cost * 1000))
 
+    def feed_process_freeze_task(self, limit=500):
+        begin_time = time.time()
+        FeedFreezeTask.enqueue(UserActivity.expire_inactive())
+        num_feeds = 0
+        while True:
+            feed_ids = FeedFreezeTask.take(limit=limit)
+            FeedMonthlyStoryCount.refresh_dryness(feed_ids)
+            Feed.refresh_freeze_level(feed_ids)
+            num_feeds += len(feed_ids)
+            if len(feed_ids) < limit:
+                break
+        cost = time.time() - begin_time
+        LOG.info('feed_process_freeze_task num_feeds={} cost {:.1f}ms'.format(num_feeds, cost * 1000))
+
     @classmethod
     def _feed_merge_duplicate(cls, found: list):
-        for feed_ids in found:
-            primary_id, *duplicates = feed_ids
-            with transaction.atomic():
-                primary = Feed.get_by_pk(primary_id)
+        feed_ids = set(itertools.chain.from_iterable(found))
+        if not feed_ids:
+            return
+        q = Feed.objects.filter(id__in=feed_ids).only('_version', 'id', 'url', 'total_storys')
+        feed_map = {x.id: x for x in q.all()}
+        url_maps = []
+        merged_feed_ids = []
+        with transaction.atomic():
+            for primary_id, *duplicates in found:
+                primary = feed_map.get(primary_id)
+                if primary is None:
+                    continue
                 primary_info = f'#{primary.id} url={primary.url!r}'
                 for feed_id in duplicates:
-                    other = Feed.get_by_pk(feed_id)
+                    other = feed_map.get(feed_id)
+                    if other is None:
+                        continue
                     other_info = f'#{other.id} url={other.url!r}'
                     LOG.info(
                         'merge duplicate feed %s into %s', other_info, primary_info
                     )
-                    FeedUrlMap(source=other.url, target=primary.url).save()
-                    primary.merge(other)
+                    url_maps.append(FeedUrlMap(source=other.url, target=primary.url))
+                    user_ids = primary.merge(other)
+                    UserActivity.on_feed_merge(primary.id, other.id, user_ids)
+                    merged_feed_ids.extend([primary.id, other.id])
+            FeedUrlMap.objects.bulk_create(url_maps)
+            # subscribers changed, refresh freeze level of both feeds
+            FeedFreezeTask.enqueue(merged_feed_ids)
 
-    def feed_detect_and_merge_duplicate(self):
+    def feed_detect_and_merge_duplicate(self, limit=1000):
         begin_time = time.time()
-        checkpoint = None
+        num_feeds = 0
         while True:
-            found, checkpoint = Feed.find_duplicate_feeds(checkpoint=checkpoint)
+            found, dedup_keys = Feed.find_duplicate_feeds(limit=limit)
             self._feed_merge_duplicate(found)
-            if not checkpoint:
+            Feed.save_dedup_keys(dedup_keys)
+            num_feeds += len(dedup_keys)
+            if len(dedup_keys) < limit:
                 break
         cost = time.time() - begin_time
-        LOG.info('feed_detect_and_merge_duplicate cost {:.1f}ms'.format(cost * 1000))
+        LOG.info('feed_detect_and_merge_duplicate num_feeds={} cost {:.1f}ms'.format(num_feeds, cost * 1000))
 
 
 HARBOR_SERVICE = HarborService()
@@ -19,6 +19,10 @@ StorySchemaFields = dict(
     summary=T.str.optional,
     content=T.str.optional,
     sentence_count=T.int.min(0).optional,
+    text_length=T.int.min(0).optional,
+    link_count=T.int.min(0).optional,
+    image_count=T.int.min(0).optional,
+    url_count=T.int.min(0).optional,
 )
 
 StoryOutputSchemaFields = StorySchemaFields.copy()
@@ -44,6 +48,8 @@ FeedSchemaFields = dict(
     last_modified=T.str.optional,
     response_status=T.int.optional,
     checksum_data_base64=T.str.maxlen(8192).optional,
+    fetch_stats_base64=T.str.maxlen(128).optional,
+    fetch_interval_factor=T.int.min(1).optional,
     warnings=T.str.optional,
 )
 
@@ -61,6 +67,10 @@ FeedSchema = T.dict(
 FeedInfoSchemaFieldNames = [
     'response_status',
     'warnings',
+    'etag',
+    'last_modified',
+    'fetch_stats_base64',
+    'fetch_interval_factor',
 ]
 FeedInfoSchemaFields = {k: FeedSchemaFields[k] for k in FeedInfoSchemaFieldNames}
 FeedInfoSchema = T.dict(
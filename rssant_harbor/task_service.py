@@ -1,5 +1,4 @@
 import logging
-import random
 from threading import RLock
 from typing import Optional
 
@@ -48,14 +47,13 @@ class RssantTaskService:
 
     @throttle(seconds=10)
     def _fetch_sync_feed_task(self):
-        rand_sec = random.random() * CHECK_FEED_SECONDS / 10
-        outdate_seconds = CHECK_FEED_SECONDS + rand_sec
-        feeds = Feed.take_outdated_feeds(outdate_seconds, limit=100)
+        feeds = Feed.take_outdated_feeds(timeout_seconds=3 * CHECK_FEED_SECONDS, limit=100)
         LOG.info('found {} feeds need sync'.format(len(feeds)))
         for feed in feeds:
             task_api = 'worker_rss.sync_feed'
             task_key = f'{task_api}:{feed["feed_id"]}'
             checksum_data_base64 = UrlsafeBase64.encode(feed['checksum_data'])
+            fetch_stats_base64 = UrlsafeBase64.encode(feed['fetch_stats_data'])
             task_data = dict(
                 feed_id=feed['feed_id'],
                 url=feed['url'],
@@ -63,6 +61,8 @@ class RssantTaskService:
                 last_modified=feed['last_modified'],
                 use_proxy=feed['use_proxy'],
                 checksum_data_base64=checksum_data_base64,
+                content_hash_base64=feed['content_hash_base64'],
+                fetch_stats_base64=fetch_stats_base64 or None,
             )
             task = WorkerTask.from_dict(
                 api=task_api,
@@ -124,6 +124,10 @@ def do_update_story(
     url: T.url,
     response_status: T.int.optional,
     sentence_count: T.int.min(0).optional,
+    text_length: T.int.min(0).optional,
+    link_count: T.int.min(0).optional,
+    image_count: T.int.min(0).optional,
+    url_count: T.int.min(0).optional,
 ) -> T.any:
     return HARBOR_SERVICE.update_story(
         feed_id=feed_id,
@@ -134,6 +138,10 @@ def do_update_story(
         url=url,
         response_status=response_status,
         sentence_count=sentence_count,
+        text_length=text_length,
+        link_count=link_count,
+        image_count=image_count,
+        url_count=url_count,
     )
 
 
@@ -162,6 +170,11 @@ def do_feed_refresh_freeze_level(request):
     HARBOR_SERVICE.feed_refresh_freeze_level()
 
 
+@HarborView.post('harbor_rss.feed_process_freeze_task')
+def do_feed_process_freeze_task(request):
+    HARBOR_SERVICE.feed_process_freeze_task()
+
+
 @HarborView.post('harbor_rss.feed_detect_and_merge_duplicate')
 def do_feed_detect_and_merge_duplicate(request):
     HARBOR_SERVICE.feed_detect_and_merge_duplicate()
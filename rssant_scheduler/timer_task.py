@@ -29,13 +29,17 @@ SCHEDULER_TASK_S = [
         api='harbor_rss.clean_feedurlmap_by_retention',
         timer=Timer('30m'),
     ),
+    dict(
+        api='harbor_rss.feed_process_freeze_task',
+        timer=Timer('1m'),
+    ),
     dict(
         api='harbor_rss.feed_refresh_freeze_level',
-        timer=Timer('40m'),
+        timer=Timer('6h'),
     ),
     dict(
         api='harbor_rss.feed_detect_and_merge_duplicate',
-        timer=Timer('4h'),
+        timer=Timer('10m'),
     ),
     dict(
         api='harbor_django.clear_expired_sessions',
@@ -32,6 +32,7 @@ def do_sync_feed(
     content_hash_base64: T.str.optional,
     etag: T.str.optional,
     last_modified: T.str.optional,
+    fetch_stats_base64: T.str.maxlen(128).optional,
     is_refresh: T.bool.default(False),
 ):
     WORKER_SERVICE.sync_feed(
@@ -42,6 +43,7 @@ def do_sync_feed(
         content_hash_base64=content_hash_base64,
         etag=etag,
         last_modified=last_modified,
+        fetch_stats_base64=fetch_stats_base64,
         is_refresh=is_refresh,
     )
 
@@ -1,7 +1,7 @@
 import asyncio
 import logging
 import random
-import time
+from http import HTTPStatus
 from threading import Thread
 from urllib.parse import unquote
 
@@ -16,6 +16,7 @@ from rssant_common._proxy_helper import is_use_proxy_url
 from rssant_common.attrdict import AttrDict
 from rssant_common.base64 import UrlsafeBase64
 from rssant_common.dns_service import DNS_SERVICE
+from rssant_common.rate_limiter import HOST_RATE_LIMITER
 from rssant_common.rss import get_story_of_feed_entry
 from rssant_common.rss import validate_feed as _validate_feed
 from rssant_common.rss import validate_story as _validate_story
@@ -24,15 +25,19 @@ from rssant_config import CONFIG
 from rssant_feedlib import (
     AsyncFeedReader,
     FeedChecksum,
+    FeedFetchStats,
     FeedFinder,
     FeedParser,
     FeedParserError,
     FeedReader,
     FeedResponse,
     FeedResponseStatus,
+    Http2FeedReader,
     RawFeedParser,
     RawFeedResult,
 )
+from rssant_feedlib.content_extractor import story_extract_content
+from rssant_feedlib.fetch_stats import PREFIX_SIZE, PROBE_RANGE
 from rssant_feedlib.fulltext import (
     FulltextAcceptStrategy,
     StoryContentInfo,
@@ -41,10 +46,8 @@ from rssant_feedlib.fulltext import (
 )
 from rssant_feedlib.processor import (
     get_html_redirect_url,
-    process_story_links,
     story_html_clean,
     story_html_to_text,
-    story_readability,
 )
 
 LOG = logging.getLogger(__name__)
@@ -53,6 +56,10 @@ LOG = logging.getLogger(__name__)
 _MAX_STORY_HTML_LENGTH = 5 * 1000 * 1024
 _MAX_STORY_CONTENT_LENGTH = 1000 * 1024
 _MAX_STORY_SUMMARY_LENGTH = 300
+# interval to check expired DNS records
+_DNS_REFRESH_INTERVAL = 60
+# fetch story must finish within service default 30s timeout
+_FETCH_STORY_RATE_LIMIT_MAX_WAIT = 3
 
 T_ACCEPT = T.enum(','.join(FulltextAcceptStrategy.__members__))
 
@@ -65,6 +72,10 @@ SCHEMA_FETCH_STORY_RESULT = T.dict(
     content=T.str.maxlen(_MAX_STORY_HTML_LENGTH).optional,
     summary=T.str.optional,
     sentence_count=T.int.optional,
+    text_length=T.int.optional,
+    link_count=T.int.optional,
+    image_count=T.int.optional,
+    url_count=T.int.optional,
     accept=T_ACCEPT.optional,
 )
 
@@ -139,13 +150,19 @@ class WorkerService:
         content_hash_base64: T.str.optional,
         etag: T.str.optional,
         last_modified: T.str.optional,
+        fetch_stats_base64: T.str.optional,
         is_refresh: T.bool.default(False),
     ):
+        fetch_stats = FeedFetchStats.load(UrlsafeBase64.decode(fetch_stats_base64))
         params = {}
         if not is_refresh:
-            params = dict(etag=etag, last_modified=last_modified)
+            send_etag, send_last_modified = fetch_stats.conditional_headers(etag, last_modified)
+            params = dict(etag=send_etag, last_modified=send_last_modified)
         options = _proxy_helper.get_proxy_options(url=url)
-        options.update(request_timeout=CONFIG.feed_reader_request_timeout)
+        options.update(
+            request_timeout=CONFIG.feed_reader_request_timeout,
+            rate_limiter=HOST_RATE_LIMITER,
+        )
         if DNS_SERVICE.is_resolved_url(url):
             use_proxy = False
         switch_prob = 0.25  # the prob of switch from use proxy to not use proxy
@@ -155,6 +172,14 @@ class WorkerService:
                 use_proxy = False
             if is_use_proxy_url(url):
                 use_proxy = True
+            if (not is_refresh) and (not use_proxy):
+                is_unchanged = _probe_feed(
+                    reader, url, fetch_stats, etag=etag, last_modified=last_modified)
+                if is_unchanged:
+                    LOG.info(f'feed#{feed_id} url={unquote(url)} not modified by probe!')
+                    response = FeedResponse(url=url, status=HTTPStatus.NOT_MODIFIED.value)
+                    _update_feed_info(feed_id, response=response, fetch_stats=fetch_stats)
+                    return
             response = reader.read(url, **params, use_proxy=use_proxy)
             LOG.info(f'read feed#{feed_id} url={unquote(url)} status={response.status}')
             need_proxy = FeedResponseStatus.is_need_proxy(response.status)
@@ -166,16 +191,30 @@ class WorkerService:
                 )
                 if proxy_response.ok:
                     response = proxy_response
+        if response.status == HTTPStatus.NOT_MODIFIED:
+            fetch_stats.record_not_modified()
         if (not response.ok) or (not response.content):
-            status = FeedStatus.READY if response.status == 304 else FeedStatus.ERROR
-            _update_feed_info(feed_id, status=status, response=response)
+            is_ready = response.status in (304, FeedResponseStatus.RATE_LIMITED)
+            status = FeedStatus.READY if is_ready else FeedStatus.ERROR
+            _update_feed_info(feed_id, status=status, response=response, fetch_stats=fetch_stats)
             return
         new_hash = compute_hash_base64(response.content)
-        if (not is_refresh) and (new_hash == content_hash_base64):
+        is_unchanged = new_hash == content_hash_base64
+        if not is_refresh:
+            fetch_stats.record_fetch(
+                response.content,
+                etag=response.etag,
+                etag_changed=response.etag != etag,
+                last_modified=response.last_modified,
+                last_modified_changed=response.last_modified != last_modified,
+                is_conditional=bool(params.get('etag') or params.get('last_modified')),
+                is_unchanged=is_unchanged,
+            )
+        if (not is_refresh) and is_unchanged:
             LOG.info(
                 f'feed#{feed_id} url={unquote(url)} not modified by compare content hash!'
             )
-            _update_feed_info(feed_id, response=response)
+            _update_feed_info(feed_id, response=response, fetch_stats=fetch_stats)
             return
         LOG.info(f'parse feed#{feed_id} url={unquote(url)}')
         try:
@@ -211,6 +250,7 @@ class WorkerService:
                 warnings=str(ex),
             )
             return
+        feed.update(_get_fetch_stats_info(fetch_stats))
         result = dict(feed_id=feed_id, feed=feed, is_refresh=is_refresh)
         SERVICE_CLIENT.call('harbor_rss.update_feed', result)
 
@@ -256,8 +296,13 @@ class WorkerService:
         if DNS_SERVICE.is_resolved_url(url):
             use_proxy = False
         # make timeout less than service default 30s to avoid ask timeout
-        options.update(request_timeout=25)
-        async with AsyncFeedReader(**options) as reader:
+        options.update(
+            request_timeout=25,
+            rate_limiter=HOST_RATE_LIMITER,
+            rate_limit_max_wait=_FETCH_STORY_RATE_LIMIT_MAX_WAIT,
+        )
+        reader_class = Http2FeedReader if CONFIG.feed_reader_http2_enable else AsyncFeedReader
+        async with reader_class(**options) as reader:
             use_proxy = use_proxy and reader.has_proxy
             url, content, response = await self._fetch_story(
                 reader, feed_id, offset, url, use_proxy=use_proxy
@@ -325,16 +370,18 @@ class WorkerService:
         text = text.strip()
         if not text:
             return DEFAULT_RESULT
-        text = story_html_clean(text)
-        content = story_readability(text)
-        content = process_story_links(content, url)
+        content = story_extract_content(text, url)
         content_info = StoryContentInfo(content)
         text_content = shorten(content_info.text, width=_MAX_STORY_CONTENT_LENGTH)
         num_sentences = len(split_sentences(text_content))
+        content_info.sentence_count = num_sentences
         if len(content) > _MAX_STORY_CONTENT_LENGTH:
             msg = 'too large story#%s,%s size=%s url=%r, will only save plain text'
             LOG.warning(msg, feed_id, offset, len(content), url)
             content = text_content
+            # metrics of the content which actually saved
+            content_info = StoryContentInfo(content)
+            content_info.sentence_count = num_sentences
         # 如果取回的内容比RSS内容更短，就不是正确的全文
         if num_sub_sentences is not None:
             if not is_fulltext_content(content_info):
@@ -347,11 +394,12 @@ class WorkerService:
         summary = shorten(text_content, width=_MAX_STORY_SUMMARY_LENGTH)
         if not summary:
             return DEFAULT_RESULT
+        # metrics of fetched content, harbor will persist them without parse again
         result = dict(
             **DEFAULT_RESULT,
             content=content,
             summary=summary,
-            sentence_count=num_sentences,
+            **content_info.get_metrics(),
         )
         res = SERVICE_CLIENT.call('harbor_rss.update_story', result)
         result.update(
@@ -360,37 +408,70 @@ class WorkerService:
         return result
 
     @staticmethod
-    def _dns_refresh_main():
-        LOG.info('DNS service refresh thread started')
-        time.sleep(10)
+    async def _dns_refresh_loop():
+        await asyncio.sleep(10)
         while True:
             try:
-                DNS_SERVICE.refresh()
+                await DNS_SERVICE.refresh_async()
             except Exception as ex:
                 LOG.error('DNS service refresh failed: %s', ex, exc_info=ex)
-            time.sleep(4 * 60 * 60)
+            # hosts are refreshed individually when their records expired
+            await asyncio.sleep(_DNS_REFRESH_INTERVAL)
+
+    @classmethod
+    def _dns_refresh_main(cls):
+        LOG.info('DNS service refresh thread started')
+        asyncio.run(cls._dns_refresh_loop())
 
     def start_dns_refresh_thread(self):
         thread = Thread(target=self._dns_refresh_main, daemon=True)
         thread.start()
 
 
+def _probe_feed(
+    reader: FeedReader,
+    url: str,
+    fetch_stats: FeedFetchStats,
+    etag: str = None,
+    last_modified: str = None,
+) -> bool:
+    """Probe feed if server ignore conditional request, return True if not modified"""
+    method = fetch_stats.probe_method(etag, last_modified)
+    if not method:
+        return False
+    range_size = PREFIX_SIZE if method == PROBE_RANGE else None
+    probe = reader.probe(url, range_size=range_size)
+    is_unchanged = fetch_stats.is_probe_unchanged(probe, etag, last_modified)
+    fetch_stats.record_probe(probe, is_unchanged)
+    return is_unchanged
+
+
+def _get_fetch_stats_info(fetch_stats: FeedFetchStats) -> dict:
+    return dict(
+        fetch_stats_base64=UrlsafeBase64.encode(fetch_stats.dump()),
+        fetch_interval_factor=fetch_stats.interval_factor(),
+    )
+
+
 def _update_feed_info(
     feed_id,
     response: FeedResponse,
     status: str = None,
     warnings: str = None,
+    fetch_stats: FeedFetchStats = None,
 ):
+    feed = dict(
+        status=status,
+        response_status=response.status,
+        warnings=warnings,
+    )
+    if response.status in (HTTPStatus.OK, HTTPStatus.NOT_MODIFIED):
+        feed.update(etag=response.etag, last_modified=response.last_modified)
+    if fetch_stats is not None:
+        feed.update(_get_fetch_stats_info(fetch_stats))
     return SERVICE_CLIENT.call(
         'harbor_rss.update_feed_info',
-        dict(
-            feed_id=feed_id,
-            feed=dict(
-                status=status,
-                response_status=response.status,
-                warnings=warnings,
-            ),
-        ),
+        dict(feed_id=feed_id, feed=feed),
     )
 
 
@@ -0,0 +1,50 @@
+import time
+
+from rssant_asyncapi.image_cache import ImageDiskCache
+
+
+def _write(cache, url, body, expires_at=None):
+    if expires_at is None:
+        expires_at = time.time() + 60
+    headers = {'Content-Type': 'image/png', 'ETag': '"v1"'}
+    entry = cache.write_files(url, body, headers, expires_at)
+    for item in cache.add(entry):
+        cache.remove_files(item)
+    return entry
+
+
+def test_image_cache(tmp_path):
+    cache = ImageDiskCache(str(tmp_path), max_bytes=100)
+    cache.load()
+    entry = _write(cache, 'https://example.com/1.png', b'x' * 10)
+    assert entry.is_fresh()
+    assert entry.validator_headers() == {'If-None-Match': '"v1"'}
+    assert cache.get('https://example.com/1.png') is entry
+    assert cache.get('https://example.com/2.png') is None
+    with open(entry.filepath, 'rb') as f:
+        assert f.read() == b'x' * 10
+    loaded = ImageDiskCache(str(tmp_path), max_bytes=100)
+    loaded.load()
+    assert loaded.size() == 1
+    assert loaded.total_bytes == 10
+    loaded_entry = loaded.get('https://example.com/1.png')
+    assert loaded_entry.headers == entry.headers
+    assert loaded_entry.expires_at == entry.expires_at
+
+
+def test_image_cache_evict(tmp_path):
+    cache = ImageDiskCache(str(tmp_path), max_bytes=100)
+    cache.load()
+    urls = [f'https://example.com/{i}.png' for i in range(5)]
+    entrys = [_write(cache, url, b'x' * 30) for url in urls[:3]]
+    # access the first one, the second one become least recently used
+    assert cache.get(urls[0]) is entrys[0]
+    _write(cache, urls[3], b'x' * 30)
+    assert cache.size() == 3
+    assert cache.total_bytes == 90
+    assert cache.get(urls[1]) is None
+    assert cache.get(urls[0]) is not None
+    loaded = ImageDiskCache(str(tmp_path), max_bytes=100)
+    loaded.load()
+    assert loaded.size() == 3
+    assert loaded.get(urls[1]) is None
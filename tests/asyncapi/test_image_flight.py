@@ -0,0 +1,127 @@
+import asyncio
+
+import pytest
+from aiohttp import HttpVersion11
+
+from rssant_asyncapi import image_proxy
+from rssant_asyncapi.image_flight import ImageFlightGroup, ImageFlightAborted
+from rssant_asyncapi.image_proxy import ImageProxyHandler
+
+
+async def _read_flight(flight):
+    head = await flight.wait_head()
+    chunks = [chunk async for chunk in flight.iter_chunks()]
+    return head, b''.join(chunks)
+
+
+async def _async_test_image_flight():
+    group = ImageFlightGroup(max_bytes=100)
+    flight = group.start('url')
+    assert flight is not None
+    assert group.start('url') is None
+    followers = [group.join('url') for _ in range(3)]
+    assert all(x is flight for x in followers)
+    tasks = [asyncio.ensure_future(_read_flight(x)) for x in followers]
+    await asyncio.sleep(0)
+    flight.set_head('head')
+    for _ in range(3):
+        flight.feed(b'x' * 10)
+        await asyncio.sleep(0)
+    assert group.total_bytes == 30
+    flight.finish(is_complete=True)
+    assert group.total_bytes == 0
+    assert group.join('url') is None
+    results = await asyncio.gather(*tasks)
+    assert results == [('head', b'x' * 30)] * 3
+    assert flight.is_complete
+
+
+async def _async_test_image_flight_error():
+    group = ImageFlightGroup(max_bytes=100)
+    flight = group.start('url')
+    task = asyncio.ensure_future(group.join('url').wait_head())
+    await asyncio.sleep(0)
+    flight.finish(error=ValueError('error'))
+    with pytest.raises(ValueError):
+        await task
+    flight = group.start('url')
+    flight.finish()
+    with pytest.raises(ImageFlightAborted):
+        await flight.wait_head()
+
+
+async def _async_test_image_flight_exceeded():
+    group = ImageFlightGroup(max_bytes=100)
+    flight = group.start('url')
+    flight.set_head('head')
+    flight.feed(b'x' * 101)
+    assert group.join('url') is None
+    assert group.total_bytes == 0
+    assert group.start('url') is not None
+
+
+class _FakeContent:
+    def __init__(self, chunks):
+        self._chunks = chunks
+
+    async def iter_chunked(self, size):
+        for chunk in self._chunks:
+            yield chunk
+
+
+class _FakeResponse:
+    def __init__(self, chunks):
+        self.status = 200
+        self.headers = {'Content-Type': 'image/png'}
+        self.content = _FakeContent(chunks)
+
+    def release(self):
+        pass
+
+
+class _FakeRequest:
+    def __init__(self):
+        self.headers = {}
+        self.version = HttpVersion11
+        self.config_dict = {image_proxy.IMAGE_PROXY_SESSION_KEY: object()}
+
+
+async def _async_test_image_flight_too_large(monkeypatch):
+    monkeypatch.setattr(image_proxy, 'MAX_IMAGE_SIZE', 25)
+    handler = ImageProxyHandler(_FakeRequest(), url='https://example.com/a.png')
+
+    async def send_proxy_request(cache_entry=None):
+        return _FakeResponse([b'x' * 10] * 3)
+
+    monkeypatch.setattr(handler, 'send_proxy_request', send_proxy_request)
+    group = ImageFlightGroup(max_bytes=100)
+    flight = group.start('url')
+    task = asyncio.ensure_future(_read_flight(group.join('url')))
+    await handler.fetch_flight(flight)
+    head, body = await task
+    assert handler.is_too_large
+    assert body == b'x' * 20
+    # followers should abort the truncated response
+    assert flight.is_done and not flight.is_complete
+
+
+def test_image_flight_key():
+    request = _FakeRequest()
+    request.headers = {'Accept': 'image/webp,*/*', 'Accept-Encoding': 'gzip'}
+    key = ImageProxyHandler(request, url='https://example.com/a.png')._get_flight_key()
+    other = _FakeRequest()
+    other.headers = {'Accept': '*/*', 'Accept-Encoding': 'gzip'}
+    other_key = ImageProxyHandler(other, url='https://example.com/a.png')._get_flight_key()
+    assert key != other_key
+
+
+def test_image_flight_too_large(monkeypatch):
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(_async_test_image_flight_too_large(monkeypatch))
+
+
+def test_image_flight():
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(_async_test_image_flight())
+    loop.run_until_complete(_async_test_image_flight_error())
+    loop.run_until_complete(_async_test_image_flight_exceeded())
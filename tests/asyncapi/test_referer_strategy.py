@@ -0,0 +1,55 @@
+import time
+
+from rssant_asyncapi.referer_strategy import (
+    RefererStrategyTable,
+    STRATEGY_REFERER,
+    STRATEGY_NO_REFERER,
+    STRATEGY_ORIGIN_REFERER,
+    MAX_SCORE,
+)
+
+
+def test_referer_strategy_decay():
+    table = RefererStrategyTable(half_life=100)
+    table.record('example.com', STRATEGY_NO_REFERER, is_ok=True, now=0)
+    assert table.get_score('example.com', STRATEGY_NO_REFERER, now=0) == 1
+    assert table.get_score('example.com', STRATEGY_NO_REFERER, now=100) == 0.5
+    table.record('example.com', STRATEGY_NO_REFERER, is_ok=False, now=100)
+    assert table.get_score('example.com', STRATEGY_NO_REFERER, now=100) == -0.5
+    assert table.get_score('example.com', STRATEGY_REFERER) == 0
+    assert table.get_score('other.com', STRATEGY_REFERER) == 0
+
+
+def test_referer_strategy_bounded():
+    table = RefererStrategyTable()
+    now = time.time()
+    for _ in range(100):
+        table.record('example.com', STRATEGY_REFERER, is_ok=False, now=now)
+        table.record('example.com', STRATEGY_NO_REFERER, is_ok=True, now=now)
+    assert table.get_score('example.com', STRATEGY_REFERER, now=now) == -MAX_SCORE
+    assert table.get_score('example.com', STRATEGY_NO_REFERER, now=now) == MAX_SCORE
+    for _ in range(MAX_SCORE + 1):
+        table.record('example.com', STRATEGY_NO_REFERER, is_ok=False, now=now)
+    assert table.get_strategies('example.com')[0] == STRATEGY_ORIGIN_REFERER
+
+
+def test_referer_strategy_lru():
+    table = RefererStrategyTable(maxsize=2)
+    for host in ['a.com', 'b.com', 'c.com']:
+        table.record(host, STRATEGY_ORIGIN_REFERER, is_ok=True)
+    assert table.size() == 2
+    assert table.get_strategies('a.com')[0] == STRATEGY_REFERER
+    assert table.get_strategies('c.com')[0] == STRATEGY_ORIGIN_REFERER
+
+
+def test_referer_strategy_file(tmp_path):
+    filepath = str(tmp_path / 'referer_strategy.json')
+    table = RefererStrategyTable()
+    table.load_file(filepath)
+    table.record('example.com', STRATEGY_REFERER, is_ok=False)
+    table.save_file(filepath)
+    loaded = RefererStrategyTable()
+    loaded.load_file(filepath)
+    assert loaded.dump() == table.dump()
+    assert loaded.get_strategies('example.com')[-1] == STRATEGY_REFERER
+    assert [x.name for x in tmp_path.iterdir()] == ['referer_strategy.json']
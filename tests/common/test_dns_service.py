@@ -1,11 +1,12 @@
 import requests
 import pytest
 import asyncio
+import socket
 from urllib.parse import urlparse
 from pytest_httpserver import HTTPServer
 
 from rssant_common.helper import aiohttp_client_session
-from rssant_common.dns_service import DNSService, DNS_SERVICE, PrivateAddressError
+from rssant_common.dns_service import DNSService, DNS_SERVICE, PrivateAddressError, DNSCache
 
 
 def _requests_session():
@@ -91,6 +92,91 @@ def test_resolve_private_address(resolve, url, expect):
     assert is_private == expect
 
 
+@pytest.mark.parametrize('resolve', [
+    _sync_async_resolve_host,
+    _sync_resolve_host,
+])
+def test_resolve_cached(resolve):
+    dns_service = DNSService.create(allow_private_address=True)
+    assert resolve(dns_service, 'localhost') == '127.0.0.1'
+    assert dns_service.cache.get('localhost') == ['127.0.0.1']
+    dns_service.cache.set('example.invalid', ['8.8.8.8'])
+    assert resolve(dns_service, 'example.invalid') == '8.8.8.8'
+    dns_service.cache.set('example.invalid', [])
+    with pytest.raises(OSError):
+        resolve(dns_service, 'example.invalid')
+
+
+def test_resolve_cached_private_address():
+    dns_service = DNSService.create(allow_private_address=False)
+    dns_service.cache.set('example.invalid', ['192.168.0.1'])
+    with pytest.raises(PrivateAddressError):
+        _sync_resolve_host(dns_service, 'example.invalid')
+
+
+def test_resolve_negative_cache():
+    dns_service = DNSService.create(allow_private_address=False)
+    with pytest.raises(socket.gaierror):
+        _sync_resolve_host(dns_service, 'not-exists.invalid')
+    assert dns_service.cache.get('not-exists.invalid') == []
+
+
+def test_dns_cache_ttl():
+    cache = DNSCache(min_ttl=10, max_ttl=100, negative_ttl=5)
+    cache.set('a.com', ['1.1.1.1'], ttl=1, now=0)
+    assert cache.get('a.com', now=9) == ['1.1.1.1']
+    assert cache.get('a.com', now=10) is None
+    cache.set('a.com', ['1.1.1.1'], ttl=1000, now=0)
+    assert cache.get('a.com', now=100) is None
+    cache.set('a.com', [], ttl=1000, now=0)
+    assert cache.get('a.com', now=4) == []
+    assert cache.get('a.com', now=5) is None
+
+
 @pytest.mark.xfail(run=False, reason='depends on test network')
 def test_dns_service_refresh():
     DNS_SERVICE.refresh()
+
+
+def test_dns_service_refresh_incremental(monkeypatch):
+    dns_service = DNSService.create(allow_private_address=False)
+    dns_service.hosts = ['a.example.com']
+    dns_service.update({'a.example.com': {'1.1.1.1'}})
+    answers = {
+        'a.example.com': [('1.1.1.1', 60), ('2.2.2.2', 3600)],
+        'b.example.com': [('3.3.3.3', 3600)],
+    }
+    verified = []
+
+    async def verify_record_task(host, ip, semaphore=None):
+        verified.append(ip)
+        return (host, ip, ip != '2.2.2.2')
+
+    monkeypatch.setattr(dns_service, '_query_host_dns_over_https', lambda url, host: answers[host])
+    monkeypatch.setattr(dns_service, '_verify_record_task', verify_record_task)
+    monkeypatch.setattr(type(dns_service), 'client', property(lambda self: _FakeClient()))
+    # most used hosts are also refreshed
+    for _ in range(3):
+        dns_service._record_usage('b.example.com')
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(dns_service.refresh_async())
+    assert dns_service.records == {
+        'a.example.com': {'1.1.1.1'},
+        'b.example.com': {'3.3.3.3'},
+    }
+    assert sorted(verified) == ['1.1.1.1', '2.2.2.2', '3.3.3.3']
+    # records not expired, nothing to refresh
+    verified.clear()
+    loop.run_until_complete(dns_service.refresh_async())
+    assert verified == []
+    # only verify changed IPs
+    # usage of b.example.com decayed out of most used hosts, it's evicted
+    loop.run_until_complete(dns_service.refresh_async(force=True))
+    assert verified == ['2.2.2.2']
+    assert dns_service.records == {'a.example.com': {'1.1.1.1'}}
+    assert 'b.example.com' not in dns_service._refresh_at
+    assert 'b.example.com' not in dns_service._verified
+
+
+class _FakeClient:
+    has_proxy = False
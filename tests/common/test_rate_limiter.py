@@ -0,0 +1,65 @@
+import multiprocessing
+
+from rssant_common.rate_limiter import (
+    HostRateLimiter,
+    MemoryRateLimitBackend,
+    SharedFileRateLimitBackend,
+)
+
+
+def test_rate_limiter_refill():
+    limiter = HostRateLimiter(rate=2, burst=2, backend=MemoryRateLimitBackend())
+    assert limiter.acquire('a.com', now=100) == 0
+    assert limiter.acquire('a.com', now=100) == 0
+    assert limiter.acquire('a.com', now=100) == 0.5
+    assert limiter.acquire('b.com', now=100) == 0
+    # reserved token at 100.5 is consumed, one token refilled at 101
+    assert limiter.acquire('a.com', now=101) == 0
+    assert limiter.acquire('a.com', now=101, max_wait=0.1) is None
+
+
+def test_rate_limiter_retry_after():
+    limiter = HostRateLimiter(rate=1, burst=5)
+    limiter.on_response('a.com', 200, {'Retry-After': '30'})
+    assert limiter.acquire('a.com', max_wait=0) == 0
+    limiter.on_response('a.com', 429, {'Retry-After': '30'})
+    assert limiter.acquire('a.com', max_wait=10) is None
+    wait = limiter.acquire('a.com', max_wait=60)
+    assert 29 <= wait <= 30
+    limiter.on_response('b.com', 503, {})
+    assert limiter.acquire('b.com', max_wait=0) == 0
+    limiter.on_response('b.com', 429, {})
+    assert limiter.acquire('b.com', max_wait=10) is None
+
+
+def test_shared_file_backend_evict(tmp_path):
+    backend = SharedFileRateLimitBackend(str(tmp_path / 'limiter'), num_slots=4)
+    limiter = HostRateLimiter(rate=1, burst=1, backend=backend)
+    for i in range(10):
+        assert limiter.acquire(f'{i}.example.com', now=100 + i) == 0
+    assert limiter.acquire('9.example.com', now=109, max_wait=0) is None
+    backend.close()
+
+
+def _acquire_in_process(filepath, queue):
+    backend = SharedFileRateLimitBackend(filepath)
+    limiter = HostRateLimiter(rate=0.001, burst=5, backend=backend)
+    result = [limiter.acquire('example.com', now=100, max_wait=0) for _ in range(5)]
+    queue.put(result)
+
+
+def test_shared_file_backend_multiprocess(tmp_path):
+    filepath = str(tmp_path / 'limiter')
+    ctx = multiprocessing.get_context('fork')
+    queue = ctx.Queue()
+    processes = [
+        ctx.Process(target=_acquire_in_process, args=(filepath, queue))
+        for _ in range(4)
+    ]
+    for p in processes:
+        p.start()
+    results = [queue.get(timeout=10) for _ in processes]
+    for p in processes:
+        p.join()
+    num_acquired = sum(x is not None for result in results for x in result)
+    assert num_acquired == 5
@@ -0,0 +1,63 @@
+import gzip
+import zlib
+
+import brotli
+import pytest
+
+from rssant_feedlib.content_decoder import ContentDecoder
+from rssant_feedlib.reader import ContentDecodingError, ContentTooLargeError
+
+
+def _raw_deflate(data: bytes) -> bytes:
+    obj = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    return obj.compress(data) + obj.flush()
+
+
+_ENCODERS = {
+    'gzip': gzip.compress,
+    'deflate': zlib.compress,
+    'br': brotli.compress,
+}
+
+
+def _decode_chunks(decoder: ContentDecoder, data: bytes, chunk_size=100) -> bytes:
+    result = b''
+    for i in range(0, len(data), chunk_size):
+        result += decoder.decode(data[i:i + chunk_size])
+    return result + decoder.flush()
+
+
+@pytest.mark.parametrize('encoding', list(_ENCODERS))
+def test_decode_chunks(encoding):
+    content = b'hello world ' * 1000
+    data = _ENCODERS[encoding](content)
+    decoder = ContentDecoder(encoding, max_length=len(content))
+    assert _decode_chunks(decoder, data) == content
+    decoder = ContentDecoder(encoding, max_length=len(content) - 1)
+    with pytest.raises(ContentTooLargeError):
+        _decode_chunks(decoder, data)
+
+
+def test_decode_raw_deflate_and_multiple_encodings():
+    content = b'hello world ' * 1000
+    decoder = ContentDecoder('deflate', max_length=len(content))
+    assert _decode_chunks(decoder, _raw_deflate(content)) == content
+    data = brotli.compress(gzip.compress(content))
+    decoder = ContentDecoder('gzip, br', max_length=len(content))
+    assert _decode_chunks(decoder, data) == content
+
+
+def test_decode_invalid():
+    decoder = ContentDecoder('gzip', max_length=1000)
+    with pytest.raises(ContentDecodingError):
+        decoder.decode(b'not gzip content')
+
+
+def test_decode_brotli_bounded():
+    content = b' '.join(str(i).encode() for i in range(200000))
+    data = brotli.compress(content, quality=5)
+    decoder = ContentDecoder('br', max_length=100)
+    with pytest.raises(ContentTooLargeError):
+        decoder.decode(data)
+    # stop decompress once output exceed limit
+    assert decoder.length < len(content) // 10
@@ -0,0 +1,50 @@
+from pathlib import Path
+
+import pytest
+
+from rssant_feedlib.content_extractor import (
+    story_extract_content, story_extract_content_legacy,
+)
+from rssant_feedlib.html_to_text import html_to_text
+
+_data_dir = Path(__file__).parent / 'testdata/fulltext'
+
+
+def test_extract_content_drop_unlikely():
+    paragraph = '<p>{}</p>'.format('Hello, world. ' * 30)
+    html = f'''
+    <html><head><title>Title</title><script>var x = 1;</script></head>
+    <body>
+    <div class="sidebar"><p>{'sidebar, ' * 10}</p></div>
+    <div class="article">{paragraph * 3}</div>
+    <div id="comment"><p>{'comment, ' * 10}</p></div>
+    </body></html>
+    '''
+    content = story_extract_content(html)
+    assert 'Hello, world.' in content
+    assert 'sidebar' not in content
+    assert 'comment' not in content
+    assert 'var x' not in content
+
+
+def test_extract_content_links():
+    html = '<p><a href="/story/1.html">link</a><img data-src="/story/1.png"></p>'
+    content = story_extract_content(html, 'https://blog.example.com/')
+    assert 'href="https://blog.example.com/story/1.html"' in content
+    assert 'src="https://blog.example.com/story/1.png"' in content
+    assert 'target="_blank"' in content
+
+
+def test_extract_content_invalid():
+    html = "<?php echo 'hello'; ?>"
+    content = story_extract_content(html)
+    assert 'hello' in content
+    assert '<?php' not in content
+
+
+@pytest.mark.parametrize('filepath', list(sorted(_data_dir.glob('*_web.html'))))
+def test_extract_content_same_as_legacy(filepath):
+    html = filepath.read_text()
+    text = html_to_text(story_extract_content(html, 'https://example.com/'))
+    legacy_text = html_to_text(story_extract_content_legacy(html, 'https://example.com/'))
+    assert abs(len(text) - len(legacy_text)) <= 0.05 * len(legacy_text)
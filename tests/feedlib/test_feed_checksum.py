@@ -105,6 +105,47 @@ def test_feed_checksum_error():
         FeedChecksum(items)
 
 
+def test_feed_checksum_batch_update():
+    storys = _random_storys(100)
+    idents = [ident for ident, _ in storys]
+    contents = [content for _, content in storys]
+    checksum = FeedChecksum()
+    expect = FeedChecksum()
+    assert checksum.batch_update(idents, contents) == [True] * 100
+    for ident, content in storys:
+        expect.update(ident, content)
+    assert checksum == expect
+    contents[0] = contents[0] + 'changed'
+    result = checksum.batch_update(idents, contents)
+    assert result == [True] + [False] * 99
+
+
+@pytest.mark.parametrize('version', [1, 2])
+def test_feed_checksum_version(version):
+    storys = _random_storys(100)
+    checksum = FeedChecksum(version=version)
+    for ident, content in storys:
+        assert checksum.update(ident, content) is True
+    loaded = FeedChecksum.load(checksum.dump())
+    assert loaded.version == version
+    assert loaded == checksum
+    for ident, content in storys:
+        assert loaded.update(ident, content) is False
+    with pytest.raises(ValueError):
+        FeedChecksum(version=0)
+
+
+def test_feed_checksum_load_v1_data():
+    # dumped by md5 based FeedChecksum, ident='ident' content='content'
+    data = bytes.fromhex('01' + '67217d8b' + '9a0364b9e99bb480')
+    checksum = FeedChecksum.load(data)
+    assert checksum.version == 1
+    assert checksum.size() == 1
+    assert checksum.update('ident', 'content') is False
+    assert checksum.update('ident', 'changed') is True
+    assert checksum.dump()[:5] == data[:5]
+
+
 def _format_t(t):
     return '{:.1f}ms'.format(t * 1000)
 
@@ -0,0 +1,112 @@
+from rssant_feedlib.fetch_stats import (
+    PROBE_HEAD,
+    PROBE_RANGE,
+    FeedFetchStats,
+    FeedProbe,
+    prefix_hash_of,
+)
+
+CONTENT = b'<rss>' + b'hello world ' * 1000 + b'</rss>'
+
+
+def _record_unchanged(stats: FeedFetchStats, n: int, etag_changed=False):
+    for i in range(n):
+        stats.record_fetch(
+            CONTENT,
+            etag='"v1"',
+            etag_changed=etag_changed,
+            last_modified=None,
+            last_modified_changed=False,
+            is_conditional=True,
+            is_unchanged=True,
+        )
+
+
+def test_dump_load():
+    stats = FeedFetchStats()
+    _record_unchanged(stats, 3)
+    stats.record_not_modified()
+    data = stats.dump()
+    assert len(data) == 21
+    assert FeedFetchStats.load(data) == stats
+    assert FeedFetchStats.load(None) == FeedFetchStats()
+    assert FeedFetchStats.load(b'\x00' * 21) == FeedFetchStats()
+    assert FeedFetchStats.load(data[:-1]) == FeedFetchStats()
+
+
+def test_honour_not_modified():
+    stats = FeedFetchStats()
+    for i in range(10):
+        stats.record_not_modified()
+    assert not stats.is_conditional_ignored
+    assert stats.conditional_headers('"v1"', 'x') == ('"v1"', 'x')
+    assert stats.probe_method('"v1"', 'x') is None
+    assert stats.interval_factor() == 2
+
+
+def test_conditional_ignored_stable_etag():
+    stats = FeedFetchStats()
+    _record_unchanged(stats, 5)
+    assert stats.is_conditional_ignored
+    assert stats.conditional_headers('"v1"', None) == (None, None)
+    assert stats.probe_method('"v1"', None) == PROBE_HEAD
+    probe = FeedProbe(status=200, etag='"v1"')
+    assert stats.is_probe_unchanged(probe, '"v1"', None)
+    probe = FeedProbe(status=200, etag='"v2"')
+    assert not stats.is_probe_unchanged(probe, '"v1"', None)
+    assert not stats.is_probe_unchanged(None, '"v1"', None)
+
+
+def test_unstable_etag_range_probe():
+    stats = FeedFetchStats()
+    _record_unchanged(stats, 5, etag_changed=True)
+    assert not stats.is_etag_stable
+    assert stats.probe_method('"v1"', None) == PROBE_RANGE
+    probe = FeedProbe(status=206, content_length=len(CONTENT), prefix_hash=prefix_hash_of(CONTENT))
+    assert stats.is_probe_unchanged(probe, '"v1"', None)
+    probe = FeedProbe(status=206, content_length=len(CONTENT) + 1, prefix_hash=prefix_hash_of(CONTENT))
+    assert not stats.is_probe_unchanged(probe, '"v1"', None)
+    # server ignored Range header, not probe by range again
+    probe = FeedProbe(status=200, content_length=len(CONTENT), prefix_hash=prefix_hash_of(CONTENT))
+    stats.record_probe(probe, stats.is_probe_unchanged(probe, '"v1"', None))
+    assert stats.is_ranges_unsupported
+    assert stats.probe_method('"v1"', None) is None
+
+
+def test_consecutive_probes_limited():
+    stats = FeedFetchStats()
+    _record_unchanged(stats, 5)
+    probe = FeedProbe(status=200, etag='"v1"')
+    num_probes = 0
+    while stats.probe_method('"v1"', None):
+        stats.record_probe(probe, is_unchanged=True)
+        num_probes += 1
+    assert num_probes == 6
+    _record_unchanged(stats, 1)
+    assert stats.probe_method('"v1"', None) == PROBE_HEAD
+
+
+def test_changed_reset_interval_factor():
+    stats = FeedFetchStats()
+    _record_unchanged(stats, 30)
+    assert stats.interval_factor() == 4
+    stats.record_fetch(
+        CONTENT + b'changed',
+        etag='"v2"',
+        etag_changed=True,
+        last_modified=None,
+        last_modified_changed=False,
+        is_conditional=False,
+        is_unchanged=False,
+    )
+    assert stats.interval_factor() == 1
+    assert stats.content_length == len(CONTENT) + 7
+
+
+def test_relearn_periodically():
+    stats = FeedFetchStats()
+    _record_unchanged(stats, 31)
+    assert stats.conditional_headers('"v1"', None) == (None, None)
+    _record_unchanged(stats, 1)
+    assert stats.conditional_headers('"v1"', None) == ('"v1"', None)
+    assert stats.probe_method('"v1"', None) is None
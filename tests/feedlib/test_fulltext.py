@@ -1,3 +1,4 @@
+import time
 from pathlib import Path
 
 import pytest
@@ -70,6 +71,18 @@ def test_split_short_sentences():
     assert split_sentences('你好，世界') == []
 
 
+def test_split_long_space_digit_sentences():
+    text = 'hello world ' + '1 ' * 100000 + 'happy day. ' + '\n' * 100 + 'good night'
+    t0 = time.monotonic()
+    sentences = split_sentences(text)
+    cost = time.monotonic() - t0
+    assert len(sentences) == 2
+    assert sentences[0].startswith('hello world 1 1')
+    assert sentences[0].endswith('1 happy day')
+    assert sentences[1] == 'good night'
+    assert cost < 1.0, f'split sentences cost {cost:.3f}s'
+
+
 thoughtworks_subtext = """
 从项目制到产品制，说来只有6个本质不同，但实施起来并非易事。所有产品都需要每两周发布一次吗？不管什么类型的产品，都需要投入大量精力做用户研究吗？是否每个产品都应有一致的增长和运营策略？哪些产品做“虚拟”端到端团队就够了、哪些产品必须有“实体”的端到端团队？怎样才算够“产品化”了？
 从项目制到产品制之2：产品化运作的成熟度最先出现在ThoughtWorks洞见。
@@ -186,3 +199,18 @@ def test_decide_accept_fulltext(name, expect_accept):
     got_accept = decide_accept_fulltext(
         StoryContentInfo(web_html), StoryContentInfo(rss_html))
     assert got_accept == expect_accept
+
+
+def test_story_content_info_metrics():
+    html = (_data_dir / 'juejin1_web.html').read_text()
+    html = _clean_story_html(html, readability=True)
+    info = StoryContentInfo(html)
+    metrics = info.get_metrics()
+    assert metrics['text_length'] == len(info.text)
+    assert metrics['sentence_count'] > 0
+    stored_info = StoryContentInfo(html, length=info.length, **metrics)
+    assert stored_info.get_metrics() == metrics
+    assert 'text' not in stored_info.__dict__
+    assert is_fulltext_content(stored_info) == is_fulltext_content(info)
+    with pytest.raises(TypeError):
+        StoryContentInfo(html, unknown_count=1)
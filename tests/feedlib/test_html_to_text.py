@@ -0,0 +1,39 @@
+from pathlib import Path
+
+import pytest
+
+from rssant_feedlib.html_to_text import html_to_text, html_to_text_cached
+from rssant_feedlib.helper import LXMLError
+
+_data_dir = Path(__file__).parent / 'testdata/fulltext'
+
+
+def test_html_to_text_kill_tags():
+    html = '''
+    <div>
+        <script>var x = '<p>script</p>';</script>
+        <style>p { color: red; }</style>
+        <p>hello <b>world</b></p>
+        <pre><code>print('code')</code></pre>
+        <form><input value="input"><textarea>textarea</textarea></form>
+        <p>happy day</p>
+    </div>
+    '''
+    assert html_to_text(html) == 'hello world\nhappy day'
+    text = html_to_text(html, clean=False)
+    assert "print('code')" in text
+    assert 'textarea' in text
+
+
+def test_html_to_text_error():
+    with pytest.raises(LXMLError):
+        html_to_text("<?php echo 'hello'; ?>")
+
+
+@pytest.mark.parametrize('filepath', list(sorted(_data_dir.glob('*_rss.html'))))
+def test_html_to_text_cached(filepath):
+    html = filepath.read_text()
+    text = html_to_text(html)
+    assert html_to_text_cached(html) == text
+    assert html_to_text_cached(html) == text
+    assert html_to_text_cached(html, clean=False) == html_to_text(html, clean=False)
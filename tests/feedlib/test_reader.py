@@ -1,17 +1,22 @@
 import asyncio
+import gzip
 import os.path
 import logging
 from typing import Type
 from pathlib import Path
 
+import brotli
 import pytest
 from pytest_httpserver import HTTPServer
 from werkzeug import Response as WerkzeugResponse
 
 from rssant_config import CONFIG
-from rssant_feedlib.reader import FeedReader, FeedResponseStatus
+from rssant_feedlib.reader import MAX_ERROR_CONTENT_LENGTH, FeedReader, FeedResponseStatus
 from rssant_feedlib.async_reader import AsyncFeedReader
+from rssant_feedlib.http2_reader import Http2FeedReader
+from rssant_feedlib.fetch_stats import PREFIX_SIZE, prefix_hash_of
 from rssant_common.dns_service import DNSService
+from rssant_common.rate_limiter import HostRateLimiter
 from tests.socket_http_server import SocketHttpServer
 
 
@@ -19,10 +24,13 @@ LOG = logging.getLogger(__name__)
 
 
 class SyncAsyncFeedReader:
+
+    async_reader_class = AsyncFeedReader
+
     def __init__(self, *args, **kwargs):
         self._loop = asyncio.get_event_loop()
         self._loop_run = self._loop.run_until_complete
-        self._reader = AsyncFeedReader(*args, **kwargs)
+        self._reader = self.async_reader_class(*args, **kwargs)
 
     @property
     def has_proxy(self):
@@ -42,6 +50,14 @@ class SyncAsyncFeedReader:
         return self._loop_run(self._reader.close())
 
 
+class SyncHttp2FeedReader(SyncAsyncFeedReader):
+
+    async_reader_class = Http2FeedReader
+
+
+_READER_CLASSES = [FeedReader, SyncAsyncFeedReader, SyncHttp2FeedReader]
+
+
 def _build_proxy_options():
     if CONFIG.proxy_enable:
         yield 'proxy', dict(
@@ -68,7 +84,7 @@ _PROXY_OPTION_IDS, _PROXY_OPTIONS = tuple(zip(*list(_build_proxy_options()))) or
     'https://www.reddit.com/r/Python.rss',
     'https://www.youtube.com/feeds/videos.xml?channel_id=UCBcRF18a7Qf58cCRy5xuWwQ',
 ])
-@pytest.mark.parametrize('reader_class', [FeedReader, SyncAsyncFeedReader])
+@pytest.mark.parametrize('reader_class', _READER_CLASSES)
 @pytest.mark.parametrize('proxy_config', _PROXY_OPTIONS, ids=_PROXY_OPTION_IDS)
 def test_read_by_proxy(reader_class: Type[FeedReader], url, proxy_config):
     with reader_class(**proxy_config) as reader:
@@ -82,7 +98,7 @@ def test_read_by_proxy(reader_class: Type[FeedReader], url, proxy_config):
     'https://www.ruanyifeng.com/blog/atom.xml',
     'https://blog.guyskk.com/feed.xml',
 ])
-@pytest.mark.parametrize('reader_class', [FeedReader, SyncAsyncFeedReader])
+@pytest.mark.parametrize('reader_class', _READER_CLASSES)
 def test_read_by_real(reader_class: Type[FeedReader], url):
     with reader_class() as reader:
         response = reader.read(url)
@@ -93,8 +109,10 @@ def test_read_by_real(reader_class: Type[FeedReader], url):
 @pytest.mark.parametrize('status', [
     200, 201, 301, 302, 400, 403, 404, 500, 502, 600,
 ])
-@pytest.mark.parametrize('reader_class', [FeedReader, SyncAsyncFeedReader])
+@pytest.mark.parametrize('reader_class', _READER_CLASSES)
 def test_read_status(reader_class: Type[FeedReader], httpserver: HTTPServer, status: int):
+    if reader_class is SyncHttp2FeedReader and status == 600:
+        pytest.skip('h11 reject status code out of range [200, 600)')
     dns_service = DNSService.create(allow_private_address=True)
     options = dict(allow_non_webpage=True, dns_service=dns_service)
     local_resp = WerkzeugResponse(str(status), status=status)
@@ -109,7 +127,7 @@ def test_read_status(reader_class: Type[FeedReader], httpserver: HTTPServer, sta
 @pytest.mark.parametrize('mime_type', [
     'image/png', 'text/csv',
 ])
-@pytest.mark.parametrize('reader_class', [FeedReader, SyncAsyncFeedReader])
+@pytest.mark.parametrize('reader_class', _READER_CLASSES)
 def test_read_non_webpage(reader_class: Type[FeedReader], httpserver: HTTPServer, mime_type: str):
     options = dict(dns_service=DNSService.create(allow_private_address=True))
     local_resp = WerkzeugResponse(b'xxxxxxxx', mimetype=mime_type)
@@ -121,7 +139,7 @@ def test_read_non_webpage(reader_class: Type[FeedReader], httpserver: HTTPServer
         assert not response.content
 
 
-@pytest.mark.parametrize('reader_class', [FeedReader, SyncAsyncFeedReader])
+@pytest.mark.parametrize('reader_class', _READER_CLASSES)
 def test_read_private_address(reader_class: Type[FeedReader], httpserver: HTTPServer):
     httpserver.expect_request("/private-address").respond_with_json(0)
     url = httpserver.url_for("/private-address")
@@ -132,7 +150,7 @@ def test_read_private_address(reader_class: Type[FeedReader], httpserver: HTTPSe
         assert not response.content
 
 
-@pytest.mark.parametrize('reader_class', [FeedReader, SyncAsyncFeedReader])
+@pytest.mark.parametrize('reader_class', _READER_CLASSES)
 def test_read_incomplete_response(reader_class: Type[FeedReader]):
     dns_service = DNSService.create(allow_private_address=True)
     with SocketHttpServer.incomplete_text() as server:
@@ -141,7 +159,7 @@ def test_read_incomplete_response(reader_class: Type[FeedReader]):
             assert response.status == FeedResponseStatus.CHUNKED_ENCODING_ERROR
 
 
-@pytest.mark.parametrize('reader_class', [FeedReader, SyncAsyncFeedReader])
+@pytest.mark.parametrize('reader_class', _READER_CLASSES)
 def test_read_incomplete_response_gzip(reader_class: Type[FeedReader], httpserver: HTTPServer):
     dns_service = DNSService.create(allow_private_address=True)
     with SocketHttpServer.incomplete_gzip() as server:
@@ -174,7 +192,7 @@ def _collect_header_cases():
 
 
 @pytest.mark.parametrize('filepath', _collect_testdata_filepaths())
-@pytest.mark.parametrize('reader_class', [FeedReader, SyncAsyncFeedReader])
+@pytest.mark.parametrize('reader_class', _READER_CLASSES)
 def test_read_testdata(reader_class: Type[FeedReader], httpserver: HTTPServer, filepath: str):
     filepath = _data_dir / filepath
     content = filepath.read_bytes()
@@ -196,7 +214,7 @@ def test_read_testdata(reader_class: Type[FeedReader], httpserver: HTTPServer, f
 @pytest.mark.parametrize('status', [
     200, 201, 301, 302, 400, 403, 404, 500, 502, 600,
 ])
-@pytest.mark.parametrize('reader_class', [FeedReader, SyncAsyncFeedReader])
+@pytest.mark.parametrize('reader_class', _READER_CLASSES)
 def test_read_rss_proxy(reader_class: Type[FeedReader], rss_proxy_server, httpserver: HTTPServer, status: int):
     options = rss_proxy_server
     url = httpserver.url_for('/not-proxy')
@@ -209,7 +227,7 @@ def test_read_rss_proxy(reader_class: Type[FeedReader], rss_proxy_server, httpse
 @pytest.mark.parametrize('error', [
     301, 302, 400, 403, 404, 500, 502, 'ERROR',
 ])
-@pytest.mark.parametrize('reader_class', [FeedReader, SyncAsyncFeedReader])
+@pytest.mark.parametrize('reader_class', _READER_CLASSES)
 def test_read_rss_proxy_error(reader_class: Type[FeedReader], rss_proxy_server, httpserver: HTTPServer, error):
     options = rss_proxy_server
     url = httpserver.url_for('/not-proxy')
@@ -217,3 +235,151 @@ def test_read_rss_proxy_error(reader_class: Type[FeedReader], rss_proxy_server,
         response = reader.read(url + f'?error={error}', use_proxy=True)
         httpserver.check_assertions()
         assert response.status == FeedResponseStatus.RSS_PROXY_ERROR
+
+
+@pytest.mark.parametrize('reader_class', _READER_CLASSES)
+def test_read_rate_limited(reader_class: Type[FeedReader], httpserver: HTTPServer):
+    options = dict(
+        allow_non_webpage=True,
+        dns_service=DNSService.create(allow_private_address=True),
+        rate_limiter=HostRateLimiter(rate=1, burst=5),
+    )
+    local_resp = WerkzeugResponse('429', status=429, headers={'Retry-After': '60'})
+    httpserver.expect_request("/rate-limited").respond_with_response(local_resp)
+    url = httpserver.url_for("/rate-limited")
+    with reader_class(**options) as reader:
+        response = reader.read(url)
+        assert response.status == 429
+        response = reader.read(url)
+        assert response.status == FeedResponseStatus.RATE_LIMITED
+        assert not response.content
+    assert len(httpserver.log) == 1
+
+
+def _compressed_handler(content: bytes):
+    def handler(request):
+        accept_encoding = request.headers.get('Accept-Encoding', '')
+        headers = {'Content-Type': 'application/xml'}
+        body = content
+        if 'br' in accept_encoding:
+            body = brotli.compress(content)
+            headers['Content-Encoding'] = 'br'
+        elif 'gzip' in accept_encoding:
+            body = gzip.compress(content)
+            headers['Content-Encoding'] = 'gzip'
+        return WerkzeugResponse(body, headers=headers)
+    return handler
+
+
+@pytest.mark.parametrize('reader_class', _READER_CLASSES)
+def test_read_compressed(reader_class: Type[FeedReader], httpserver: HTTPServer):
+    content = b'<rss>' + b'hello world ' * 1000 + b'</rss>'
+    httpserver.expect_request("/compressed").respond_with_handler(_compressed_handler(content))
+    url = httpserver.url_for("/compressed")
+    dns_service = DNSService.create(allow_private_address=True)
+    with reader_class(dns_service=dns_service) as reader:
+        response = reader.read(url)
+        assert response.ok
+        assert response.content == content
+    with reader_class(dns_service=dns_service, max_content_length=len(content) - 1) as reader:
+        response = reader.read(url)
+        assert response.status == FeedResponseStatus.CONTENT_TOO_LARGE_ERROR
+
+
+def _conditional_handler(content: bytes, etag: str):
+    def handler(request):
+        if request.headers.get('If-None-Match') == etag:
+            return WerkzeugResponse(status=304, headers={'ETag': etag})
+        headers = {'Content-Type': 'application/xml', 'ETag': etag}
+        range_header = request.headers.get('Range')
+        if range_header:
+            end = int(range_header.rpartition('-')[2])
+            headers['Content-Range'] = f'bytes 0-{end}/{len(content)}'
+            return WerkzeugResponse(content[:end + 1], status=206, headers=headers)
+        return WerkzeugResponse(content, headers=headers)
+    return handler
+
+
+@pytest.mark.parametrize('reader_class', _READER_CLASSES)
+def test_read_conditional(reader_class: Type[FeedReader], httpserver: HTTPServer):
+    content = b'<rss>' + b'hello world ' * 100 + b'</rss>'
+    httpserver.expect_request("/conditional").respond_with_handler(_conditional_handler(content, '"v1"'))
+    url = httpserver.url_for("/conditional")
+    dns_service = DNSService.create(allow_private_address=True)
+    with reader_class(dns_service=dns_service) as reader:
+        response = reader.read(url)
+        assert response.ok
+        assert response.etag == '"v1"'
+        response = reader.read(url, etag='"v1"')
+        assert response.status == 304
+
+
+def test_probe(httpserver: HTTPServer):
+    content = b'<rss>' + b'hello world ' * 1000 + b'</rss>'
+    httpserver.expect_request("/probe").respond_with_handler(_conditional_handler(content, '"v1"'))
+    url = httpserver.url_for("/probe")
+    dns_service = DNSService.create(allow_private_address=True)
+    with FeedReader(dns_service=dns_service) as reader:
+        probe = reader.probe(url)
+        assert probe.status == 200
+        assert probe.etag == '"v1"'
+        assert probe.prefix_hash is None
+        probe = reader.probe(url, range_size=PREFIX_SIZE)
+        assert probe.status == 206
+        assert probe.content_length == len(content)
+        assert probe.prefix_hash == prefix_hash_of(content)
+        assert reader.probe(httpserver.url_for("/probe").replace('http:', 'unknown:')) is None
+
+
+@pytest.mark.parametrize('reader_class', _READER_CLASSES)
+def test_read_binary_content(reader_class: Type[FeedReader], httpserver: HTTPServer):
+    content = b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR' + b'x' * 1024 * 1024
+    local_resp = WerkzeugResponse(content, mimetype='text/html')
+    httpserver.expect_request("/binary").respond_with_response(local_resp)
+    url = httpserver.url_for("/binary")
+    dns_service = DNSService.create(allow_private_address=True)
+    with reader_class(dns_service=dns_service) as reader:
+        response = reader.read(url)
+        assert response.status == FeedResponseStatus.CONTENT_TYPE_NOT_SUPPORT_ERROR
+        assert not response.content
+    with reader_class(dns_service=dns_service, allow_non_webpage=True) as reader:
+        response = reader.read(url)
+        assert response.ok
+        assert response.content == content
+
+
+@pytest.mark.parametrize('reader_class', _READER_CLASSES)
+def test_read_error_content_truncated(reader_class: Type[FeedReader], httpserver: HTTPServer):
+    content = b'<html>' + b'not found ' * 100 * 1024 + b'</html>'
+    local_resp = WerkzeugResponse(content, status=404, mimetype='text/html')
+    httpserver.expect_request("/not-found").respond_with_response(local_resp)
+    url = httpserver.url_for("/not-found")
+    dns_service = DNSService.create(allow_private_address=True)
+    with reader_class(dns_service=dns_service, max_content_length=len(content) - 1) as reader:
+        response = reader.read(url)
+        assert response.status == 404
+        assert response.content == content[:MAX_ERROR_CONTENT_LENGTH]
+
+
+def _streaming_handler(chunks: list):
+    def handler(request):
+        # generator body, response has no Content-Length header
+        return WerkzeugResponse(iter(chunks), mimetype='application/xml')
+    return handler
+
+
+@pytest.mark.parametrize('reader_class', _READER_CLASSES)
+def test_read_streaming_content_too_large(reader_class: Type[FeedReader], httpserver: HTTPServer):
+    # limit is multiple of chunk size of readers
+    max_content_length = 64 * 1024
+    chunks = [b'<rss>' + b'x' * (8 * 1024 - 5)] + [b'x' * 8 * 1024] * 7
+    httpserver.expect_request("/streaming").respond_with_handler(_streaming_handler(chunks))
+    httpserver.expect_request("/streaming-large").respond_with_handler(
+        _streaming_handler(chunks + [b'x' * 8 * 1024]))
+    dns_service = DNSService.create(allow_private_address=True)
+    with reader_class(dns_service=dns_service, max_content_length=max_content_length) as reader:
+        response = reader.read(httpserver.url_for("/streaming"))
+        assert response.ok
+        assert response.content == b''.join(chunks)
+        response = reader.read(httpserver.url_for("/streaming-large"))
+        assert response.status == FeedResponseStatus.CONTENT_TOO_LARGE_ERROR